@@ -0,0 +1,79 @@
+# STDLIB
+import argparse
+import os
+import pathlib
+import tempfile
+import time
+from typing import Callable, List
+
+# OWN
+import lib_shell
+
+"""
+measures get_quoted_command on pathological commandlines with many blanks (a java classpath, json parameters),
+compared to the former implementation : all variations built with rsplit, and a stat call for each variation.
+
+usage: python benchmarks/bench_command_variations.py [--blanks 10 50 100 1000 5000] [--rounds 5]
+"""
+
+
+class Process(object):
+    """ a stand in for psutil.Process - only cwd() is needed """
+    def __init__(self, cwd: str) -> None:
+        self._cwd = cwd
+
+    def cwd(self) -> str:
+        return self._cwd
+
+
+def get_quoted_command_former(s_command: str, process: Process) -> str:
+    """ the former implementation, without the final quoting which is the same for both """
+    l_command_variations = list()
+    for n_variation in range(s_command.count(' ') + 1):
+        l_command_variations.append(s_command.rsplit(' ', n_variation)[0])
+    for command_variation in l_command_variations:
+        if (pathlib.Path(process.cwd()) / command_variation).exists():
+            return command_variation
+    raise RuntimeError('executable not found')
+
+
+def measure(function: Callable[[], object], n_rounds: int) -> float:
+    """ returns the best time in seconds of one call """
+    l_times = list()    # type: List[float]
+    for _ in range(n_rounds):
+        start_time = time.perf_counter()
+        function()
+        l_times.append(time.perf_counter() - start_time)
+    return min(l_times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='measures the executable resolution of commandlines with many blanks')
+    parser.add_argument('--blanks', type=int, nargs='+', default=[10, 50, 100, 1000, 5000], help='the number of blanks in the parameters')
+    parser.add_argument('--rounds', type=int, default=5, help='the number of rounds per measurement')
+    args = parser.parse_args()
+
+    # measure the parsing, not the cache
+    lib_shell.conf_lib_shell.commandline_cache_enabled = False
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        os.mkdir(os.path.join(temp_directory, 'my app'))
+        with open(os.path.join(temp_directory, 'my app', 'run app.sh'), 'w'):
+            pass
+        process = Process(cwd=temp_directory)
+
+        print(f'{"blanks":>8} {"former ms":>12} {"current ms":>12} {"speedup":>8}')
+        for n_blanks in args.blanks:
+            s_command = 'my app/run app.sh --json {"key": "value", "list": [1, 2, 3]}' + ' -cp /opt/lib/x.jar' * n_blanks
+            time_current = measure(lambda: lib_shell.get_quoted_command(s_command, process), args.rounds)     # type: ignore
+            try:
+                time_former = measure(lambda: get_quoted_command_former(s_command, process), args.rounds)
+            except OSError as exc:
+                # the former implementation fails, if a variation is longer than the maximum path length
+                print(f'{n_blanks:>8} {"errno " + str(exc.errno):>12} {time_current * 1000:>12.3f}')
+                continue
+            print(f'{n_blanks:>8} {time_former * 1000:>12.3f} {time_current * 1000:>12.3f} {time_former / time_current:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
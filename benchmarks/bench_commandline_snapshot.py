@@ -0,0 +1,66 @@
+# STDLIB
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+# EXT
+import psutil   # type: ignore
+
+# OWN
+import lib_shell
+
+"""
+compares the time to read the commandline, working directory and executable of all processes :
+snapshot_commandlines (one scan of /proc) versus get_l_commandline_from_pid plus psutil cwd() and exe() for each pid.
+
+usage: python benchmarks/bench_commandline_snapshot.py [--rounds 20]
+"""
+
+
+def read_per_pid() -> int:
+    """ the per-pid path - returns the number of processes read """
+    n_processes = 0
+    for pid in psutil.pids():
+        try:
+            lib_shell.get_l_commandline_from_pid(pid)
+            process = psutil.Process(pid)
+            process.cwd()
+            process.exe()
+        except (psutil.Error, OSError, RuntimeError, ValueError):
+            continue
+        n_processes = n_processes + 1
+    return n_processes
+
+
+def read_snapshot() -> int:
+    """ the bulk path - returns the number of processes read """
+    return len(lib_shell.snapshot_commandlines())
+
+
+def measure(function: Callable[[], int], n_rounds: int) -> float:
+    """ returns the median time in seconds of one call """
+    l_times = list()    # type: List[float]
+    for _ in range(n_rounds):
+        start_time = time.perf_counter()
+        function()
+        l_times.append(time.perf_counter() - start_time)
+    return statistics.median(l_times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='compares snapshot_commandlines with the per-pid commandline lookup')
+    parser.add_argument('--rounds', type=int, default=20, help='the number of rounds per measurement')
+    args = parser.parse_args()
+
+    n_processes = read_snapshot()
+    time_per_pid = measure(read_per_pid, args.rounds)
+    time_snapshot = measure(read_snapshot, args.rounds)
+    print(f'processes          : {n_processes}')
+    print(f'per pid            : {time_per_pid * 1000:10.3f} ms')
+    print(f'snapshot           : {time_snapshot * 1000:10.3f} ms')
+    print(f'speedup            : {time_per_pid / time_snapshot:10.1f} x')
+
+
+if __name__ == '__main__':
+    main()
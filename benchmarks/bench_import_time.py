@@ -0,0 +1,56 @@
+# STDLIB
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+"""
+measures the startup cost of "import lib_shell" in a fresh interpreter, using python -X importtime
+
+usage: python benchmarks/bench_import_time.py [--runs 10] [--top 15] [--module lib_shell]
+"""
+
+
+def measure_import_time(module: str) -> Tuple[int, Dict[str, int]]:
+    """
+    imports the module in a fresh interpreter and returns the cumulative import time of the module in microseconds,
+    and the cumulative import time of each imported module
+    """
+    ls_command = [sys.executable, '-X', 'importtime', '-c', f'import {module}']
+    process = subprocess.run(ls_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    cumulative_times = dict()   # type: Dict[str, int]
+    for line in process.stderr.decode('utf-8', errors='replace').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, imported_module = line[len('import time:'):].split('|')
+        cumulative_times[imported_module.strip()] = int(cumulative)
+    return cumulative_times.get(module, 0), cumulative_times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='measures the import time of lib_shell')
+    parser.add_argument('--runs', type=int, default=10, help='the number of fresh interpreters to measure')
+    parser.add_argument('--top', type=int, default=15, help='the number of the slowest imported modules to show')
+    parser.add_argument('--module', default='lib_shell', help='the module to import')
+    args = parser.parse_args()
+
+    l_total_times = list()      # type: List[int]
+    module_times = dict()       # type: Dict[str, List[int]]
+    for _ in range(args.runs):
+        total_time, cumulative_times = measure_import_time(args.module)
+        l_total_times.append(total_time)
+        for imported_module, cumulative_time in cumulative_times.items():
+            module_times.setdefault(imported_module, list()).append(cumulative_time)
+
+    print(f'import {args.module}: median {statistics.median(l_total_times) / 1000:.1f} ms, '
+          f'min {min(l_total_times) / 1000:.1f} ms, max {max(l_total_times) / 1000:.1f} ms ({args.runs} runs)')
+    print(f'slowest imports (median cumulative time):')
+    l_medians = sorted(((statistics.median(times), imported_module) for imported_module, times in module_times.items()), reverse=True)
+    for median_time, imported_module in l_medians[1:args.top + 1]:
+        print(f'{median_time / 1000:8.1f} ms  {imported_module}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# STDLIB
+import argparse
+import time
+
+# OWN
+import lib_shell
+
+"""
+compares the throughput of run_shell_command, which starts a new process for each command,
+with ShellSession, which runs all commands in one long-lived shell
+
+usage: python benchmarks/bench_session.py [--commands 200] [--command "true"]
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='compares run_shell_command with ShellSession')
+    parser.add_argument('--commands', type=int, default=200, help='the number of commands to run')
+    parser.add_argument('--command', default='true', help='the command to run')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    for _ in range(args.commands):
+        lib_shell.run_shell_command(args.command, shell=True, quiet=True)
+    run_shell_command_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with lib_shell.ShellSession() as session:
+        for _ in range(args.commands):
+            session.run_shell_command(args.command, quiet=True)
+    session_time = time.perf_counter() - start_time
+
+    print(f'{args.commands} x "{args.command}"')
+    print(f'run_shell_command : {run_shell_command_time:.3f} s, {args.commands / run_shell_command_time:8.1f} commands/s')
+    print(f'ShellSession      : {session_time:.3f} s, {args.commands / session_time:8.1f} commands/s')
+    print(f'speedup           : {run_shell_command_time / session_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
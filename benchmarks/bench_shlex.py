@@ -0,0 +1,111 @@
+# STDLIB
+import argparse
+import random
+import shlex
+import time
+from typing import Callable, List, Optional
+
+# OWN
+import lib_platform
+import lib_shell
+from lib_shell import lib_shell_shlex
+
+"""
+measures the time to split posix commandlines with the stdlib shlex, the former lib_shell tokenizer,
+and shlex_split_multi_platform / shlex_split_many without and with repeated commandlines (cache hits).
+
+usage: python benchmarks/bench_shlex.py [--commandlines 20000] [--distinct 500]
+"""
+
+
+def shlex_split_multi_platform_former(s_commandline: str, is_platform_windows: Optional[bool] = None) -> List[str]:
+    """ the tokenizer before the platform was resolved once and the results were cached - for comparison """
+    if is_platform_windows is None:
+        is_platform_windows = lib_platform.get_is_platform_windows()
+
+    if is_platform_windows:
+        re_cmd_lex_precompiled = lib_shell_shlex._re_cmd_lex_precompiled_win
+    else:
+        re_cmd_lex_precompiled = lib_shell_shlex._re_cmd_lex_precompiled_posix
+
+    args = []
+    acc = None
+    for qs, qss, esc, pipe, word, white, fail in re_cmd_lex_precompiled.findall(s_commandline):
+        if word:
+            pass
+        elif esc:
+            word = esc[1]
+        elif white or pipe:
+            if acc is not None:
+                args.append(acc)
+            if pipe:
+                args.append(pipe)
+            acc = None
+            continue
+        elif fail:
+            raise ValueError("invalid or incomplete shell string")
+        elif qs:
+            word = qs.replace('\\"', '"').replace('\\\\', '\\')
+            if lib_platform.get_is_platform_windows():
+                word = word.replace('""', '"')
+        else:
+            word = qss
+        acc = (acc or '') + word
+    if acc is not None:
+        args.append(acc)
+    return args
+
+
+def get_commandlines(n_commandlines: int, n_distinct: int) -> List[str]:
+    """ returns n_commandlines job spec like commandlines, of which n_distinct are different - half of them with quotes """
+    randomizer = random.Random(0)
+    l_distinct = list()     # type: List[str]
+    for index in range(n_distinct):
+        if index % 2:
+            l_distinct.append(f'/usr/bin/rsync -av --delete --exclude "*.tmp" "/srv/data {index}/" backup@host:/srv/backup/{index}/')
+        else:
+            l_distinct.append(f'/usr/bin/python3 -m worker --job {index} --queue default --retries 3 --timeout 600 --log-level info')
+    return [randomizer.choice(l_distinct) for _ in range(n_commandlines)]
+
+
+def measure(split: Callable[[List[str]], object], l_commandlines: List[str]) -> float:
+    """ returns the time in seconds to split all commandlines """
+    start_time = time.perf_counter()
+    split(l_commandlines)
+    return time.perf_counter() - start_time
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='compares the commandline tokenizer of lib_shell with the stdlib shlex')
+    parser.add_argument('--commandlines', type=int, default=20000, help='the number of commandlines split per measurement')
+    parser.add_argument('--distinct', type=int, default=500, help='the number of distinct commandlines')
+    args = parser.parse_args()
+
+    l_commandlines = get_commandlines(args.commandlines, args.distinct)
+    # the tokenizer without the cache, to measure the tokenizer itself
+    shlex_split_uncached = lib_shell_shlex._shlex_split.__wrapped__     # type: ignore
+    # all results must match - shlex does not split pipes, but there are none in the commandlines
+    for s_commandline in set(l_commandlines):
+        assert lib_shell.shlex_split_multi_platform(s_commandline, is_platform_windows=False) == shlex.split(s_commandline)
+        assert shlex_split_multi_platform_former(s_commandline, is_platform_windows=False) == shlex.split(s_commandline)
+
+    l_candidates = [
+        ('stdlib shlex.split', lambda l_lines: [shlex.split(s_line) for s_line in l_lines]),
+        ('former tokenizer', lambda l_lines: [shlex_split_multi_platform_former(s_line) for s_line in l_lines]),
+        ('tokenizer, no cache', lambda l_lines: [list(shlex_split_uncached(s_line, False)) for s_line in l_lines]),
+        ('shlex_split_many, cached', lambda l_lines: lib_shell.shlex_split_many(l_lines)),
+    ]
+
+    print(f'{args.commandlines} commandlines, {args.distinct} distinct')
+    print(f'{"tokenizer":>26} {"total ms":>10} {"us/line":>9} {"vs shlex":>9}')
+    shlex_time = 0.0
+    for name, split in l_candidates:
+        lib_shell_shlex._shlex_split.cache_clear()
+        split_time = measure(split, l_commandlines)
+        if not shlex_time:
+            shlex_time = split_time
+        print(f'{name:>26} {split_time * 1000:>10.1f} {split_time / len(l_commandlines) * 1e6:>9.2f} {shlex_time / split_time:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# STDLIB
+import argparse
+import statistics
+import subprocess
+import time
+from typing import List
+
+# OWN
+import lib_shell
+
+"""
+measures the latency to spawn a child process with the spawn backends of lib_shell, depending on the memory used by the parent.
+the memory is allocated and touched step by step in this process, to grow the resident set size of the parent.
+
+usage: python benchmarks/bench_spawn.py [--rss-mb 0 512 2048] [--spawns 50]
+"""
+
+
+def measure_spawn_latency(spawn_backend: str, n_spawns: int) -> float:
+    """ returns the median time in seconds to spawn and reap the command 'true' """
+    lib_shell.conf_lib_shell.spawn_backend = spawn_backend
+    l_times = list()    # type: List[float]
+    for _ in range(n_spawns):
+        start_time = time.perf_counter()
+        process = lib_shell.popen(['true'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process.communicate()
+        l_times.append(time.perf_counter() - start_time)
+    return statistics.median(l_times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='measures the spawn latency of the spawn backends versus the parent memory')
+    parser.add_argument('--rss-mb', type=int, nargs='+', default=[0, 512, 2048], help='the memory in MB allocated by the parent')
+    parser.add_argument('--spawns', type=int, default=50, help='the number of processes spawned per measurement')
+    args = parser.parse_args()
+
+    ballast = list()    # type: List[bytes]
+    allocated_mb = 0
+    print(f'{"parent MB":>10} ' + ' '.join(f'{spawn_backend:>14}' for spawn_backend in lib_shell.spawn_backends))
+    for rss_mb in sorted(args.rss_mb):
+        # bytes filled with a non zero value - so the pages are really resident
+        while allocated_mb < rss_mb:
+            ballast.append(b'\x01' * 1024 * 1024)
+            allocated_mb = allocated_mb + 1
+        l_latencies = [measure_spawn_latency(spawn_backend, args.spawns) for spawn_backend in lib_shell.spawn_backends]
+        print(f'{rss_mb:>10} ' + ' '.join(f'{latency * 1000:>11.3f} ms' for latency in l_latencies))
+
+
+if __name__ == '__main__':
+    main()
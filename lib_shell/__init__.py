@@ -2,9 +2,27 @@ import pathlib
 
 from .conf_lib_shell import *
 from .lib_shell import *
+from .lib_shell_async import *
+from .lib_shell_cache import *
+from .lib_shell_capture import *
 from .lib_shell_commandline import *
+from .lib_shell_encoding import *
+from .lib_shell_env import *
+from .lib_shell_hooks import *
+from .lib_shell_input import *
+from .lib_shell_job import *
 from .lib_shell_log import *
+from .lib_shell_parallel import *
+from .lib_shell_pipeline import *
+from .lib_shell_reaper import *
+from .lib_shell_resource import *
+from .lib_shell_result_cache import *
+from .lib_shell_retry import *
+from .lib_shell_session import *
 from .lib_shell_shlex import *
+from .lib_shell_spawn import *
+from .lib_shell_spill import *
+from .lib_shell_stream import *
 
 
 def get_version() -> str:
@@ -1,6 +1,7 @@
 # STDLIB
 import logging
-import subprocess
+import shutil
+from typing import Optional
 
 # OWN
 import lib_platform
@@ -17,8 +18,25 @@ except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cove
 class ConfLibShell(object):
     def __init__(self) -> None:
         self._sudo_command = 'sudo'                                                                    # type: str
+        # None if not detected yet - we detect the sudo command on first use, not on import
+        self._sudo_command_exists = None                                                               # type: Optional[bool]
         self.retries = 3                                                                               # type: int
-        self.sudo_command_exists = get_sudo_command_exist(self._sudo_command)                          # type: bool
+        # the number of lines of stdout and stderr kept for logging when streaming the output of a command
+        self.stream_log_tail_lines = 100                                                               # type: int
+        # the number of bytes of stdout and stderr used to detect the encoding of the output
+        self.encoding_detection_sample_size = 65536                                                    # type: int
+        # cache the detected encoding per executable
+        self.encoding_cache_enabled = True                                                             # type: bool
+        # the directory for the output spilled to disk, '' for the default temp directory
+        self.spill_directory = ''                                                                      # type: str
+        # the number of bytes of spilled output passed to subprocess.CalledProcessError
+        self.spill_error_excerpt_bytes = 65536                                                         # type: int
+        # the way child processes are started : 'subprocess' or 'posix_spawn' - see lib_shell_spawn.popen
+        self.spawn_backend = 'subprocess'                                                              # type: str
+        # collect the cpu times and the maximum rss of the processes with os.wait4 (posix only) - see lib_shell_spawn.wait_process
+        self.collect_rusage = False                                                                    # type: bool
+        # cache the parsed commandlines per process - see lib_shell_commandline.commandline_cache
+        self.commandline_cache_enabled = True                                                          # type: bool
         self.log_settings_default = lib_shell_log.RunShellCommandLogSettings()                         # type: lib_shell_log.RunShellCommandLogSettings
         # log_settings_quiet: no logging if returncode is zero
         self.log_settings_quiet = lib_shell_log.RunShellCommandLogSettings()                           # type: lib_shell_log.RunShellCommandLogSettings
@@ -34,7 +52,17 @@ class ConfLibShell(object):
     @sudo_command.setter
     def sudo_command(self, value: str) -> None:
         self._sudo_command = str(value).strip()
-        self.sudo_command_exists = get_sudo_command_exist(self._sudo_command)
+        self._sudo_command_exists = None
+
+    @property
+    def sudo_command_exists(self) -> bool:
+        if self._sudo_command_exists is None:
+            self._sudo_command_exists = get_sudo_command_exist(self._sudo_command)
+        return self._sudo_command_exists
+
+    @sudo_command_exists.setter
+    def sudo_command_exists(self, value: bool) -> None:
+        self._sudo_command_exists = bool(value)
 
 
 def get_sudo_command_exist(sudo_command: str = 'sudo') -> bool:
@@ -57,12 +85,7 @@ def get_sudo_command_exist(sudo_command: str = 'sudo') -> bool:
 
     if lib_platform.get_is_platform_windows():
         return False
-    try:
-        ls_command = ['bash', '-c', f'command -v {sudo_command}']
-        subprocess.check_output(ls_command, stderr=subprocess.PIPE)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    return shutil.which(sudo_command) is not None
 
 
 conf_lib_shell = ConfLibShell()
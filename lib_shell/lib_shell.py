@@ -1,39 +1,150 @@
 # STDLIB
-import locale
 import os
 import subprocess
-from typing import List, Optional, Tuple
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
 
 # OWN
-import lib_detect_encoding
 import lib_platform
 
 # PROJ
 try:                                            # type: ignore # pragma: no cover
     # imports for local pytest
     from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+    from . import lib_shell_capture             # type: ignore # pragma: no cover
+    from . import lib_shell_encoding            # type: ignore # pragma: no cover
+    from . import lib_shell_env                 # type: ignore # pragma: no cover
     from . import lib_shell_helpers             # type: ignore # pragma: no cover
+    from . import lib_shell_hooks               # type: ignore # pragma: no cover
+    from . import lib_shell_input               # type: ignore # pragma: no cover
     from . import lib_shell_log                 # type: ignore # pragma: no cover
     from . import lib_shell_pass_output         # type: ignore # pragma: no cover
+    from . import lib_shell_reaper              # type: ignore # pragma: no cover
+    from . import lib_shell_resource            # type: ignore # pragma: no cover
+    from . import lib_shell_result_cache        # type: ignore # pragma: no cover
+    from . import lib_shell_retry               # type: ignore # pragma: no cover
     from . import lib_shell_shlex               # type: ignore # pragma: no cover
+    from . import lib_shell_spawn               # type: ignore # pragma: no cover
+    from . import lib_shell_spill               # type: ignore # pragma: no cover
 
 except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
     # imports for doctest local
     from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+    import lib_shell_capture                    # type: ignore # pragma: no cover
+    import lib_shell_encoding                   # type: ignore # pragma: no cover
+    import lib_shell_env                        # type: ignore # pragma: no cover
     import lib_shell_helpers                    # type: ignore # pragma: no cover
+    import lib_shell_hooks                      # type: ignore # pragma: no cover
+    import lib_shell_input                      # type: ignore # pragma: no cover
     import lib_shell_log                        # type: ignore # pragma: no cover
     import lib_shell_pass_output                # type: ignore # pragma: no cover
+    import lib_shell_reaper                     # type: ignore # pragma: no cover
+    import lib_shell_resource                   # type: ignore # pragma: no cover
+    import lib_shell_result_cache               # type: ignore # pragma: no cover
+    import lib_shell_retry                      # type: ignore # pragma: no cover
     import lib_shell_shlex                      # type: ignore # pragma: no cover
-
-# This sets the locale for all categories to the user’s default setting (typically specified in the LANG environment variable).
-locale.setlocale(locale.LC_ALL, '')
+    import lib_shell_spawn                      # type: ignore # pragma: no cover
+    import lib_shell_spill                      # type: ignore # pragma: no cover
 
 
 class ShellCommandResponse(object):
+    """
+    the response of a shell command.
+    with decode=False the raw output is kept in stdout_bytes and stderr_bytes, and stdout and stderr are decoded lazily on first access.
+    with decode=True the output is decoded at once, and the raw output is not kept.
+    output larger than spill_threshold is spilled to disk, and available as stdout_file or stderr_file (see ShellCommandOutputFile),
+    in that case stdout or stderr reads and decodes the whole file on first access.
+    with max_stdout_bytes or max_stderr_bytes only the head, the tail or both of the output are kept (see lib_shell_capture.BoundedOutputBuffer),
+    the number of bytes dropped is in stdout_truncated_bytes and stderr_truncated_bytes.
+
+    >>> response = ShellCommandResponse()
+    >>> response.set_output_bytes(b'test', b'')
+    >>> assert response.stdout_bytes == b'test'
+    >>> assert response.encoding == ''
+    >>> assert response.stdout == 'test'
+    >>> assert response.encoding == 'utf-8'
+
+    """
     def __init__(self) -> None:
-        self.returncode = 0
-        self.stdout = ''
-        self.stderr = ''
+        self.returncode = 0                 # type: int
+        self.stdout_bytes = b''             # type: bytes
+        self.stderr_bytes = b''             # type: bytes
+        # the encoding used to decode stdout and stderr
+        self.encoding = ''                  # type: str
+        # the executable of the command - the key to the cached encodings
+        self.executable = ''                # type: str
+        # the output spilled to disk
+        self.stdout_file = None             # type: Optional[lib_shell_spill.ShellCommandOutputFile]
+        self.stderr_file = None             # type: Optional[lib_shell_spill.ShellCommandOutputFile]
+        # None if not decoded yet
+        self._stdout = ''                   # type: Optional[str]
+        self._stderr = ''                   # type: Optional[str]
+        # the number of attempts made, and the duration of each attempt in seconds - see RetryPolicy
+        self.attempts = 0                   # type: int
+        self.attempt_durations = list()     # type: List[float]
+        # True if the command was killed, because the timeout or the deadline was reached
+        self.timed_out = False              # type: bool
+        # the number of bytes dropped, because the output was larger than max_stdout_bytes or max_stderr_bytes
+        self.stdout_truncated_bytes = 0     # type: int
+        self.stderr_truncated_bytes = 0     # type: int
+        # True if the response was returned from a result cache, without running the command
+        self.from_cache = False             # type: bool
+        # wall time, cpu times, peak memory and the phases of the last attempt
+        self.resource_usage = lib_shell_resource.ShellCommandResourceUsage()     # type: lib_shell_resource.ShellCommandResourceUsage
+
+    @property
+    def stdout(self) -> str:
+        if self._stdout is None:
+            self.decode_output()
+        return self._stdout     # type: ignore
+
+    @stdout.setter
+    def stdout(self, value: str) -> None:
+        self._stdout = value
+
+    @property
+    def stderr(self) -> str:
+        if self._stderr is None:
+            self.decode_output()
+        return self._stderr     # type: ignore
+
+    @stderr.setter
+    def stderr(self, value: str) -> None:
+        self._stderr = value
+
+    def set_output_bytes(self, stdout: bytes, stderr: bytes) -> None:
+        """ sets the raw output, stdout and stderr will be decoded on first access """
+        self.stdout_bytes = stdout
+        self.stderr_bytes = stderr
+        self._stdout = None
+        self._stderr = None
+
+    def set_output_files(self, stdout_file: Optional[lib_shell_spill.ShellCommandOutputFile],
+                         stderr_file: Optional[lib_shell_spill.ShellCommandOutputFile]) -> None:
+        """ sets the output spilled to disk, stdout and stderr will be decoded on first access """
+        self.stdout_file = stdout_file
+        self.stderr_file = stderr_file
+        self._stdout = None
+        self._stderr = None
+
+    def decode_output(self, keep_output_bytes: bool = True) -> None:
+        """ decodes the raw output - if keep_output_bytes is False, the raw output is released after decoding """
+        stdout_bytes = self.stdout_file.read_bytes() if self.stdout_file else self.stdout_bytes
+        stderr_bytes = self.stderr_file.read_bytes() if self.stderr_file else self.stderr_bytes
+        self._stdout, self._stderr, self.encoding = lib_shell_encoding.decode_stdout_stderr(stdout_bytes, stderr_bytes, self.executable)
+        if not keep_output_bytes:
+            self.stdout_bytes = b''
+            self.stderr_bytes = b''
+
+    def get_is_spilled(self) -> bool:
+        return self.stdout_file is not None or self.stderr_file is not None
+
+    def close(self) -> None:
+        """ deletes the output spilled to disk """
+        for output_file in (self.stdout_file, self.stderr_file):
+            if output_file is not None:
+                output_file.close()
 
 
 def run_shell_command(command: str,
@@ -47,7 +158,22 @@ def run_shell_command(command: str,
                       retries: int = conf_lib_shell.retries,
                       use_sudo: bool = False,
                       run_as_user: str = '',
-                      quiet: bool = False) -> ShellCommandResponse:
+                      quiet: bool = False,
+                      decode: bool = True,
+                      spill_threshold: Optional[int] = None,
+                      env: Optional[Dict[str, str]] = None,
+                      env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                      cwd: Optional[str] = None,
+                      retry_policy: Optional[lib_shell_retry.RetryPolicy] = None,
+                      timeout: Optional[float] = None,
+                      deadline: Optional[float] = None,
+                      input: Any = None,
+                      max_stdout_bytes: Optional[int] = None,
+                      max_stderr_bytes: Optional[int] = None,
+                      stdout_retention: str = 'head',
+                      stderr_retention: str = 'tail',
+                      result_cache: Optional[lib_shell_result_cache.ShellResultCache] = None,
+                      cache_dependencies: Iterable[Union[str, 'os.PathLike[str]']] = ()) -> ShellCommandResponse:
     """
     >>> import unittest
     >>> response = run_shell_command('echo test', shell=True)
@@ -87,7 +213,22 @@ def run_shell_command(command: str,
                                             retries=retries,
                                             use_sudo=use_sudo,
                                             run_as_user=run_as_user,
-                                            quiet=quiet)
+                                            quiet=quiet,
+                                            decode=decode,
+                                            spill_threshold=spill_threshold,
+                                            env=env,
+                                            env_overrides=env_overrides,
+                                            cwd=cwd,
+                                            retry_policy=retry_policy,
+                                            timeout=timeout,
+                                            deadline=deadline,
+                                            input=input,
+                                            max_stdout_bytes=max_stdout_bytes,
+                                            max_stderr_bytes=max_stderr_bytes,
+                                            stdout_retention=stdout_retention,
+                                            stderr_retention=stderr_retention,
+                                            result_cache=result_cache,
+                                            cache_dependencies=cache_dependencies)
     return command_response
 
 
@@ -102,7 +243,22 @@ def run_shell_ls_command(ls_command: List[str],
                          retries: int = conf_lib_shell.retries,
                          use_sudo: bool = False,
                          run_as_user: str = '',
-                         quiet: bool = False) -> ShellCommandResponse:
+                         quiet: bool = False,
+                         decode: bool = True,
+                         spill_threshold: Optional[int] = None,
+                         env: Optional[Dict[str, str]] = None,
+                         env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                         cwd: Optional[str] = None,
+                         retry_policy: Optional[lib_shell_retry.RetryPolicy] = None,
+                         timeout: Optional[float] = None,
+                         deadline: Optional[float] = None,
+                         input: Any = None,
+                         max_stdout_bytes: Optional[int] = None,
+                         max_stderr_bytes: Optional[int] = None,
+                         stdout_retention: str = 'head',
+                         stderr_retention: str = 'tail',
+                         result_cache: Optional[lib_shell_result_cache.ShellResultCache] = None,
+                         cache_dependencies: Iterable[Union[str, 'os.PathLike[str]']] = ()) -> ShellCommandResponse:
 
     """
     >>> log_settings = lib_shell_log.set_log_settings_to_level(level=logging.WARNING)
@@ -120,9 +276,38 @@ def run_shell_ls_command(ls_command: List[str],
     >>> assert response.returncode == 0
     """
 
-    response = ShellCommandResponse()
+    if retry_policy is None:
+        # the legacy parameter retries accepted 0 - the command is run once then
+        retry_policy = lib_shell_retry.RetryPolicy(max_attempts=max(1, retries))
+    shell_input = lib_shell_input.get_shell_command_input(input)
+
+    # only the collected output of commands without input is cached - the output of new sessions is not collected
+    cache_key = None    # type: Optional[str]
+    is_output_collected = communicate and wait_finish and not pass_stdout_stderr_to_sys and spill_threshold is None and not start_new_session
+    if result_cache is not None and is_output_collected and not shell_input.get_has_input():
+        cache_key = lib_shell_result_cache.get_cache_key(ls_command, dependencies=cache_dependencies, shell=shell, use_sudo=use_sudo,
+                                                         run_as_user=run_as_user, decode=decode, env=env, env_overrides=env_overrides, cwd=cwd,
+                                                         max_stdout_bytes=max_stdout_bytes, max_stderr_bytes=max_stderr_bytes,
+                                                         stdout_retention=stdout_retention, stderr_retention=stderr_retention)
+        cache_entry = result_cache.get(cache_key)   # type: ignore
+        if cache_entry is not None:
+            response = get_response_from_cache_entry(cache_entry, decode=decode)
+            if lib_shell_hooks.shell_command_hooks.get_has_hooks('on_complete'):
+                lib_shell_hooks.shell_command_hooks.call('on_complete', ls_command=ls_command, executable=response.executable, response=response)
+            return response
+    # input which can be read only once (iterators, pipes) is not retried
+    max_attempts = retry_policy.max_attempts if shell_input.is_replayable else 1
 
-    for n in range(retries):
+    response = ShellCommandResponse()
+    # the environment is resolved once for all tries
+    my_env = lib_shell_env.get_env_with_overrides(env=env, env_overrides=env_overrides)
+    l_attempt_durations = list()    # type: List[float]
+    start_time = time.monotonic()
+
+    for attempt in range(1, max_attempts + 1):
+        attempt_start_time = time.monotonic()
+        # the timeout of each attempt, not later than the deadline of all attempts
+        attempt_timeout = get_attempt_timeout(timeout=timeout, deadline=deadline)
         response = _run_shell_ls_command_one_try(ls_command=ls_command,
                                                  shell=shell,
                                                  communicate=communicate,
@@ -133,14 +318,45 @@ def run_shell_ls_command(ls_command: List[str],
                                                  start_new_session=start_new_session,
                                                  use_sudo=use_sudo,
                                                  run_as_user=run_as_user,
-                                                 quiet=quiet)
-        if response.returncode == 0:
+                                                 quiet=quiet,
+                                                 decode=decode,
+                                                 spill_threshold=spill_threshold,
+                                                 env=my_env,
+                                                 cwd=cwd,
+                                                 timeout=attempt_timeout,
+                                                 input=shell_input,
+                                                 max_stdout_bytes=max_stdout_bytes,
+                                                 max_stderr_bytes=max_stderr_bytes,
+                                                 stdout_retention=stdout_retention,
+                                                 stderr_retention=stderr_retention)
+        l_attempt_durations.append(time.monotonic() - attempt_start_time)
+        retry_delay = retry_policy.get_retry_delay(response=response, attempt=attempt, elapsed=time.monotonic() - start_time)
+        if retry_delay is None or attempt == max_attempts:
+            break
+        if deadline is not None and time.monotonic() + retry_delay >= deadline:
+            # the next attempt would start after the deadline
             break
+        if lib_shell_hooks.shell_command_hooks.get_has_hooks('on_retry'):
+            lib_shell_hooks.shell_command_hooks.call('on_retry', ls_command=ls_command, executable=response.executable,
+                                                     response=response, attempt=attempt, delay=retry_delay)
+        response.close()
+        if retry_delay:
+            time.sleep(retry_delay)
+
+    response.attempts = len(l_attempt_durations)
+    response.attempt_durations = l_attempt_durations
+    if lib_shell_hooks.shell_command_hooks.get_has_hooks('on_complete'):
+        lib_shell_hooks.shell_command_hooks.call('on_complete', ls_command=ls_command, executable=response.executable, response=response)
 
     if response.returncode != 0 and raise_on_returncode_not_zero:
         ls_command = prepend_sudo_and_run_as_user(ls_command=ls_command, shell=shell, run_as_user=run_as_user, use_sudo=use_sudo)
-        raise subprocess.CalledProcessError(returncode=response.returncode, cmd=' '.join(ls_command), output=response.stdout, stderr=response.stderr)
-    response.stdout = response.stdout.strip()
+        if response.timed_out:
+            raise_timeout_expired(response=response, str_command=' '.join(ls_command), timeout=attempt_timeout, decode=decode)    # type: ignore
+        raise_called_process_error(response=response, str_command=' '.join(ls_command), decode=decode)
+    if decode and not response.get_is_spilled():
+        response.stdout = response.stdout.strip()
+    if cache_key is not None and response.returncode == 0 and not response.timed_out:
+        result_cache.set(cache_key, response, decode=decode)    # type: ignore
     return response
 
 
@@ -154,7 +370,18 @@ def _run_shell_ls_command_one_try(ls_command: List[str],
                                   start_new_session: bool = False,
                                   use_sudo: bool = False,
                                   run_as_user: str = '',
-                                  quiet: bool = False) -> ShellCommandResponse:
+                                  quiet: bool = False,
+                                  decode: bool = True,
+                                  spill_threshold: Optional[int] = None,
+                                  env: Optional[Mapping[str, str]] = None,
+                                  env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                                  cwd: Optional[str] = None,
+                                  timeout: Optional[float] = None,
+                                  input: Any = None,
+                                  max_stdout_bytes: Optional[int] = None,
+                                  max_stderr_bytes: Optional[int] = None,
+                                  stdout_retention: str = 'head',
+                                  stderr_retention: str = 'tail') -> ShellCommandResponse:
     """
     when using shell=True pass the commands as string in the first element of the list - not tested under windows until now
 
@@ -243,6 +470,206 @@ def _run_shell_ls_command_one_try(ls_command: List[str],
     ...     unittest.TestCase().assertRaises(subprocess.CalledProcessError,
     ...         run_shell_ls_command, ['cmd','/C', 'dir /unknown'], pass_stdout_stderr_to_sys=True, shell=False)
 
+    >>> # test binary output, decode=False
+    >>> response = run_shell_ls_command([sys.executable, '-c', 'import sys; sys.stdout.buffer.write(bytes(range(256)))'], decode=False)
+    >>> assert response.stdout_bytes == bytes(range(256))
+    >>> assert response.encoding == ''
+
+    >>> # test binary output, decode=False, the text is decoded on access and not stripped
+    >>> response = run_shell_ls_command([sys.executable, '-c', 'print("test")'], decode=False)
+    >>> assert response.stdout_bytes.strip() == b'test'
+    >>> assert response.stdout.strip() == 'test' and response.stdout != 'test'
+
+    >>> # test spill to disk
+    >>> program = 'import sys; sys.stdout.write("mäßig" * 10000); sys.stderr.write("error")'
+    >>> response = run_shell_ls_command([sys.executable, '-c', program], spill_threshold=1000)
+    >>> assert response.stdout_file.size == 70000
+    >>> assert response.stderr_file is None
+    >>> assert response.stderr == 'error'
+    >>> assert response.stdout == 'mäßig' * 10000
+    >>> with response.stdout_file.mmap() as stdout_mmap:
+    ...     assert stdout_mmap[:7] == 'mäßig'.encode('utf-8')
+    >>> response.close()
+
+    >>> # test spill to disk, pass stdout to sys, output below the threshold
+    >>> response = run_shell_ls_command([sys.executable, '-c', 'print("test")'], spill_threshold=1000,
+    ...                                 pass_stdout_stderr_to_sys=True)  # doctest: +ELLIPSIS, +NORMALIZE_WHITESPACE
+    te...
+    >>> assert response.stdout == 'test'
+    >>> assert not response.get_is_spilled()
+
+    >>> # test retries=0, the command is run once
+    >>> response = run_shell_ls_command(['echo', 'test'], retries=0)
+    >>> assert response.stdout == 'test' and response.attempts == 1
+
+    >>> # test the spill files are deleted, if the command can not be started
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as spill_directory:
+    ...     conf_lib_shell.spill_directory = spill_directory
+    ...     try:
+    ...         unittest.TestCase().assertRaises(FileNotFoundError, run_shell_ls_command, ['no_such_executable'], spill_threshold=10, quiet=True)
+    ...     finally:
+    ...         conf_lib_shell.spill_directory = ''
+    ...     os.listdir(spill_directory)
+    []
+
+    >>> # test bounded output, the first bytes of stdout and the last bytes of stderr are kept
+    >>> program = 'import sys; [print(n) for n in range(100000)]; [print(n, file=sys.stderr) for n in range(100000)]; sys.exit(1)'
+    >>> response = run_shell_ls_command([sys.executable, '-c', program], max_stdout_bytes=10, max_stderr_bytes=12,
+    ...                                 raise_on_returncode_not_zero=False, quiet=True)
+    >>> response.stdout.split(), response.stderr.split()
+    (['0', '1', '2', '3', '4'], ['99998', '99999'])
+    >>> response.stdout_truncated_bytes, response.stderr_truncated_bytes, response.resource_usage.stdout_size
+    (588880, 588878, 588890)
+    >>> # the exception carries only the bounded output
+    >>> try:
+    ...     run_shell_ls_command([sys.executable, '-c', program], max_stdout_bytes=10, stderr_retention='head_tail', max_stderr_bytes=12, quiet=True)
+    ... except subprocess.CalledProcessError as exc:
+    ...     print(exc.stderr)
+    0
+    1
+    2
+    ... 588878 bytes truncated ...
+    99999
+    >>> unittest.TestCase().assertRaises(ValueError, run_shell_ls_command, ['echo', 'test'], max_stdout_bytes=10, spill_threshold=1000)
+
+    >>> # test result cache, the command runs once - changed dependencies and failed commands are not cached
+    >>> import tempfile
+    >>> result_cache = lib_shell_result_cache.ShellResultCache()
+    >>> program = 'import sys; print(open(sys.argv[1]).read())'
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     path = os.path.join(directory, 'test.txt')
+    ...     for content in ('test', None, 'test2'):
+    ...         if content is not None:
+    ...             with open(path, 'w') as test_file:
+    ...                 _ = test_file.write(content)
+    ...         response = run_shell_ls_command([sys.executable, '-c', program, path], result_cache=result_cache, cache_dependencies=[path])
+    ...         print(response.stdout, response.from_cache)
+    test False
+    test True
+    test2 False
+    >>> response = run_shell_ls_command([sys.executable, '-c', 'import sys; sys.exit(1)'], result_cache=result_cache,
+    ...                                 raise_on_returncode_not_zero=False, quiet=True)
+    >>> result_cache.get_stats()
+    {'hits': 1, 'misses': 3, 'disk_hits': 0, 'stores': 2, 'evictions': 0, 'expirations': 0, 'size': 2}
+    >>> # the output of new sessions is not collected, so it is not cached
+    >>> for _ in range(2):
+    ...     response = run_shell_ls_command(['echo', 'test'], result_cache=result_cache, start_new_session=True)
+    >>> result_cache.get_stats()['stores']
+    2
+    >>> # cache hits are reported to the hook on_complete
+    >>> collector = lib_shell_hooks.ShellMetricsCollector()
+    >>> collector.register()
+    >>> for _ in range(2):
+    ...     response = run_shell_ls_command(['echo', 'test'], result_cache=result_cache)
+    >>> collector.unregister()
+    >>> metrics = collector.get_metrics()['echo']
+    >>> metrics['count'], metrics['cache_hits']
+    (2, 1)
+
+    >>> # test env, env_overrides and cwd
+    >>> program = 'import os; print(os.environ.get("LIB_SHELL_TEST_ENV")); print(os.environ.get("PATH")); print(os.getcwd())'
+    >>> test_directory = os.path.realpath(os.path.dirname(__file__))
+    >>> response = run_shell_ls_command([sys.executable, '-c', program], env_overrides={'LIB_SHELL_TEST_ENV': 'test', 'PATH': None},
+    ...                                 cwd=test_directory)
+    >>> assert response.stdout.splitlines() == ['test', 'None', test_directory]
+    >>> response = run_shell_ls_command([sys.executable, '-c', program], env={'LIB_SHELL_TEST_ENV': 'test2'})
+    >>> assert response.stdout.splitlines()[:2] == ['test2', 'None']
+
+    >>> # test retry policy
+    >>> program = 'import sys; print("%s", file=sys.stderr); sys.exit(1)'
+    >>> retry_policy = lib_shell_retry.RetryPolicy(max_attempts=3, backoff_initial=0.01, retry_on_stderr_patterns=['lock'])
+    >>> response = run_shell_ls_command([sys.executable, '-c', program % 'lock'], retry_policy=retry_policy, raise_on_returncode_not_zero=False, quiet=True)
+    >>> assert response.attempts == 3 and len(response.attempt_durations) == 3
+    >>> response = run_shell_ls_command([sys.executable, '-c', program % 'error'], retry_policy=retry_policy, raise_on_returncode_not_zero=False, quiet=True)
+    >>> assert response.attempts == 1
+
+    >>> # test timeout, the whole process tree is killed
+    >>> program = 'import subprocess, sys, time; print("test", flush=True); subprocess.call([sys.executable, "-c", "import time; time.sleep(10)"])'
+    >>> response = run_shell_ls_command([sys.executable, '-c', program], timeout=0.5, retries=1, raise_on_returncode_not_zero=False, quiet=True)
+    >>> assert response.timed_out and response.returncode != 0
+    >>> assert response.stdout == 'test'
+    >>> unittest.TestCase().assertRaises(subprocess.TimeoutExpired, run_shell_ls_command, [sys.executable, '-c', program],
+    ...                                  timeout=0.5, retries=1, pass_stdout_stderr_to_sys=True)  # doctest: +ELLIPSIS, +NORMALIZE_WHITESPACE
+    te...
+
+    >>> # test deadline over all retries
+    >>> start_time = time.monotonic()
+    >>> response = run_shell_ls_command([sys.executable, '-c', program], timeout=0.5, deadline=time.monotonic() + 0.8, retries=3,
+    ...                                 raise_on_returncode_not_zero=False, quiet=True)
+    >>> assert response.timed_out and response.attempts == 2
+    >>> assert time.monotonic() - start_time < 2
+
+    >>> # test resource usage - the cpu times and max_rss are collected with conf_lib_shell.collect_rusage
+    >>> program = 'import time\\ndata = b"x" * 50 * 1024 * 1024\\nwhile time.process_time() < 0.3:\\n    pass'
+    >>> response = run_shell_ls_command([sys.executable, '-c', program])
+    >>> resource_usage = response.resource_usage
+    >>> assert resource_usage.wall_time >= resource_usage.spawn_time + resource_usage.communicate_time
+    >>> assert resource_usage.max_rss is None
+    >>> conf_lib_shell.collect_rusage = True
+    >>> for ls_command in ([sys.executable, '-c', program], [sys.executable, '-c', program + '\\nprint("test")']):
+    ...     response = run_shell_ls_command(ls_command, spill_threshold=None if 'print' in ls_command[-1] else 1000)
+    ...     resource_usage = response.resource_usage
+    ...     if hasattr(os, 'wait4'):
+    ...         assert resource_usage.user_time + resource_usage.system_time >= 0.2
+    ...         assert resource_usage.max_rss >= 50 * 1024 * 1024
+    >>> assert response.stdout == 'test'
+    >>> conf_lib_shell.collect_rusage = False
+
+    >>> # test hooks and metrics
+    >>> l_events = list()
+    >>> hooks = lib_shell_hooks.shell_command_hooks
+    >>> for event in ('pre_spawn', 'post_spawn', 'on_output_chunk', 'on_retry'):
+    ...     hook = hooks.register(event, lambda event=event, **kwargs: l_events.append(event))
+    >>> collector = lib_shell_hooks.ShellMetricsCollector()
+    >>> collector.register()
+    >>> program = 'import sys\\nprint("test")\\nsys.exit(1)'
+    >>> response = run_shell_ls_command([sys.executable, '-c', program], retries=2, raise_on_returncode_not_zero=False, quiet=True)
+    >>> l_events
+    ['pre_spawn', 'post_spawn', 'on_output_chunk', 'on_retry', 'pre_spawn', 'post_spawn', 'on_output_chunk']
+    >>> metrics = collector.get_metrics()[response.executable]
+    >>> metrics['count'], metrics['failures'], metrics['retries'], metrics['stdout_bytes'] == 2 * len('test' + os.linesep)
+    (1, 1, 1, True)
+    >>> hooks.clear()
+
+    >>> # test input - bytes, str, path, file, iterables
+    >>> import io
+    >>> import pathlib
+    >>> import tempfile
+    >>> program = 'import sys; data = sys.stdin.buffer.read(); print(len(data), data[:4])'
+    >>> run_shell_ls_command([sys.executable, '-c', program], input=b'test').stdout
+    "4 b'test'"
+    >>> run_shell_ls_command([sys.executable, '-c', program], input='mäßig').stdout
+    "7 b'm\\\\xc3\\\\xa4\\\\xc3'"
+    >>> run_shell_ls_command([sys.executable, '-c', program], input=b'test', pass_stdout_stderr_to_sys=True)  # doctest: +ELLIPSIS
+    4 b'test'
+    ...
+    >>> with tempfile.TemporaryDirectory() as test_directory:
+    ...     test_path = pathlib.Path(test_directory) / 'input.txt'
+    ...     _ = test_path.write_bytes(b'0123456789')
+    ...     print(run_shell_ls_command([sys.executable, '-c', program], input=test_path).stdout)
+    ...     with open(str(test_path), mode='rb') as input_file:
+    ...         _ = input_file.read(2)
+    ...         print(run_shell_ls_command([sys.executable, '-c', program], input=input_file).stdout)
+    10 b'0123'
+    8 b'2345'
+    >>> chunks = (b'x' * 65536 for _ in range(100))
+    >>> run_shell_ls_command([sys.executable, '-c', program], input=chunks).stdout
+    "6553600 b'xxxx'"
+    >>> run_shell_ls_command([sys.executable, '-c', program], input=io.BytesIO(b'test')).stdout
+    "4 b'test'"
+
+    >>> # input which can be read only once is not retried, other input is fed again on each attempt
+    >>> program = 'import sys; print(sys.stdin.read()); sys.exit(1)'
+    >>> response = run_shell_ls_command([sys.executable, '-c', program], input=iter(['te', 'st']), retries=3,
+    ...                                 raise_on_returncode_not_zero=False, quiet=True)
+    >>> response.attempts, response.stdout
+    (1, 'test')
+    >>> response = run_shell_ls_command([sys.executable, '-c', program], input=['te', 'st'], retries=2,
+    ...                                 raise_on_returncode_not_zero=False, quiet=True)
+    >>> response.attempts, response.stdout
+    (2, 'test')
+
     >>> # test std operation without communication, shell=True
     >>> if lib_platform.get_is_platform_posix():
     ...     response = run_shell_ls_command(['echo', 'test'], shell=True, communicate=False)
@@ -281,69 +708,316 @@ def _run_shell_ls_command_one_try(ls_command: List[str],
     else:
         actual_log_settings = log_settings
 
+    executable = lib_shell_encoding.get_executable_key(ls_command, use_sudo=use_sudo, run_as_user=run_as_user)
+    # the hooks get the command as passed by the caller
+    hook_ls_command = ls_command
     ls_command = prepend_sudo_and_run_as_user(ls_command=ls_command, shell=shell, run_as_user=run_as_user, use_sudo=use_sudo)
 
-    my_env = os.environ.copy()
-    my_env['PYTHONIOENCODING'] = 'utf-8'
-    my_env['PYTHONLEGACYWINDOWSIOENCODING'] = 'utf-8'
+    # the environment is resolved already if called from run_shell_ls_command
+    if env is None or env_overrides:
+        my_env = lib_shell_env.get_env_with_overrides(env=env, env_overrides=env_overrides)
+    else:
+        my_env = env
+
+    if start_new_session:
+        communicate = False
+
+    shell_input = lib_shell_input.get_shell_command_input(input)
+    if start_new_session and shell_input.get_has_input():
+        raise ValueError('input can not be passed to a command started in a new session')
 
     startupinfo = get_startup_info(start_new_session)
     subprocess_stdin, subprocess_stdout, subprocess_stderr = get_pipes(start_new_session)
+    if not communicate and not wait_finish and not start_new_session:
+        # nobody reads the output - it is discarded, so there is no pipe which might fill up, or be held open by a daemon
+        subprocess_stdout, subprocess_stderr = subprocess.DEVNULL, subprocess.DEVNULL
+    if shell_input.get_has_input():
+        subprocess_stdin = shell_input.get_popen_stdin()
+
+    # only max_stdout_bytes and max_stderr_bytes of the output are kept, the rest is read and dropped
+    bounded = communicate and (max_stdout_bytes is not None or max_stderr_bytes is not None)
+    if bounded and spill_threshold is not None:
+        raise ValueError('spill_threshold can not be combined with max_stdout_bytes or max_stderr_bytes')
+    # the output is read by lib_shell_capture if it is bounded - or to reap the process with os.wait4, see lib_shell_spawn.wait_process
+    captured = bounded or (communicate and lib_shell_spawn.get_is_rusage_collected())
+    if captured:
+        stdout_buffer = lib_shell_capture.BoundedOutputBuffer(max_bytes=max_stdout_bytes, retention=stdout_retention)
+        stderr_buffer = lib_shell_capture.BoundedOutputBuffer(max_bytes=max_stderr_bytes, retention=stderr_retention)
+
+    spill = communicate and spill_threshold is not None
+    if spill:
+        stdout_sink, stderr_sink = lib_shell_spill.create_spill_file(), lib_shell_spill.create_spill_file()
+        if not pass_stdout_stderr_to_sys:
+            # the process writes directly to the files, we dont copy the data through pipes
+            subprocess_stdout, subprocess_stderr = stdout_sink, stderr_sink     # type: ignore
+    elif captured:
+        stdout_sink, stderr_sink = stdout_buffer, stderr_buffer     # type: ignore
+    else:
+        stdout_sink, stderr_sink = None, None
+
+    hooks = lib_shell_hooks.shell_command_hooks
+    if hooks.get_has_hooks('pre_spawn'):
+        hooks.call('pre_spawn', ls_command=hook_ls_command, executable=executable)
+
+    resource_usage = lib_shell_resource.ShellCommandResourceUsage()
+    spawn_start_time = time.perf_counter()
+    try:
+        my_process = lib_shell_spawn.popen(ls_command,
+                                           startupinfo=startupinfo,
+                                           stdin=subprocess_stdin,
+                                           stdout=subprocess_stdout,
+                                           stderr=subprocess_stderr,
+                                           shell=shell,
+                                           env=my_env,
+                                           cwd=cwd)
+    except BaseException:
+        if spill:
+            lib_shell_spill.discard_spill_file(stdout_sink)
+            lib_shell_spill.discard_spill_file(stderr_sink)
+        raise
+    finally:
+        shell_input.close()
+    resource_usage.spawn_time = time.perf_counter() - spawn_start_time
+    # the data is passed to communicate, other input is written by a thread
+    communicate_input = shell_input.start(my_process, communicate=communicate and not pass_stdout_stderr_to_sys and not captured)
+    if hooks.get_has_hooks('post_spawn'):
+        hooks.call('post_spawn', ls_command=hook_ls_command, executable=executable, process=my_process)
 
-    my_process = subprocess.Popen(ls_command,
-                                  startupinfo=startupinfo,
-                                  stdin=subprocess_stdin,
-                                  stdout=subprocess_stdout,
-                                  stderr=subprocess_stderr,
-                                  shell=shell,
-                                  env=my_env)
-
-    if start_new_session:
-        communicate = False
+    command_response = ShellCommandResponse()
+    command_response.executable = executable
+    command_response.resource_usage = resource_usage
 
     if communicate:
-        encoding = lib_detect_encoding.get_system_preferred_encoding()
+        encoding = lib_shell_encoding.get_system_preferred_encoding()
+        on_output_chunk = hooks.get_output_chunk_callback(ls_command=hook_ls_command, executable=executable)
 
-        if pass_stdout_stderr_to_sys:
-            # Read data from stdout and stderr and passes it to the caller, until end-of-file is reached. Wait for process to terminate.
-            stdout, stderr = lib_shell_pass_output.pass_stdout_stderr_to_sys(my_process, encoding)
-        else:
-            # Send data to stdin. Read data from stdout and stderr, until end-of-file is reached. Wait for process to terminate.
-            stdout, stderr = my_process.communicate()
-
-        encoding = lib_detect_encoding.get_file_encoding(stdout + stderr)
+        communicate_start_time = time.perf_counter()
         try:
-            stdout_str = stdout.decode(encoding)
-            stderr_str = stderr.decode(encoding)
-        # on Wine, we might get Windows encoded response
-        except UnicodeDecodeError:
-            encoding = lib_detect_encoding.get_system_preferred_encoding_windows()
-            stdout_str = stdout.decode(encoding)
-            stderr_str = stderr.decode(encoding)
+            if pass_stdout_stderr_to_sys:
+                # Read data from stdout and stderr and passes it to the caller, until end-of-file is reached. Wait for process to terminate.
+                stdout, stderr = lib_shell_pass_output.pass_stdout_stderr_to_sys(my_process, encoding, stdout_sink, stderr_sink,
+                                                                                 timeout=timeout, on_chunk=on_output_chunk)
+            elif captured:
+                # Read data from stdout and stderr into the bounded buffers, until end-of-file is reached. Wait for process to terminate.
+                lib_shell_capture.capture_output(my_process, stdout_buffer, stderr_buffer, timeout=timeout, on_chunk=on_output_chunk)
+                stdout, stderr = b'', b''
+            else:
+                # Send data to stdin. Read data from stdout and stderr, until end-of-file is reached. Wait for process to terminate.
+                stdout, stderr = my_process.communicate(input=communicate_input, timeout=timeout)
+        except subprocess.TimeoutExpired as exc:
+            command_response.timed_out = True
+            lib_shell_helpers.kill_process_tree(my_process)
+            if pass_stdout_stderr_to_sys or captured:
+                # we keep the output passed or captured so far
+                stdout, stderr = exc.output or b'', exc.stderr or b''
+                lib_shell_spawn.wait_process(my_process)
+                for pipe in (my_process.stdout, my_process.stderr):
+                    if pipe is not None:
+                        pipe.close()
+            else:
+                # communicate can be called again after the timeout, to collect the rest of the output
+                stdout, stderr = my_process.communicate()
+
+        shell_input.join()
+        resource_usage.communicate_time = time.perf_counter() - communicate_start_time
+        resource_usage.wall_time = time.perf_counter() - spawn_start_time
+
+        if on_output_chunk is not None and not pass_stdout_stderr_to_sys and not captured:
+            # communicate reads the output at once - output written directly to the spill files is not passed
+            for pipe_name, chunk in (('stdout', stdout), ('stderr', stderr)):
+                if chunk:
+                    on_output_chunk(pipe_name, chunk)
+
+        if spill:
+            stdout, stdout_file = lib_shell_spill.get_spilled_output(stdout_sink, spill_threshold)   # type: ignore
+            stderr, stderr_file = lib_shell_spill.get_spilled_output(stderr_sink, spill_threshold)   # type: ignore
+        else:
+            stdout_file, stderr_file = None, None
+        if captured and not spill:
+            stdout, stderr = stdout_buffer.get_bytes(), stderr_buffer.get_bytes()
+            command_response.stdout_truncated_bytes = stdout_buffer.truncated_bytes
+            command_response.stderr_truncated_bytes = stderr_buffer.truncated_bytes
+            resource_usage.stdout_size, resource_usage.stderr_size = stdout_buffer.size, stderr_buffer.size
+        else:
+            resource_usage.stdout_size = stdout_file.size if stdout_file else len(stdout or b'')
+            resource_usage.stderr_size = stderr_file.size if stderr_file else len(stderr or b'')
+        command_response.set_output_bytes(stdout, stderr)
+        if spill and (stdout_file or stderr_file):
+            # spilled output is decoded only on access
+            command_response.set_output_files(stdout_file, stderr_file)
+        elif decode:
+            decode_start_time = time.perf_counter()
+            command_response.decode_output(keep_output_bytes=False)
+            resource_usage.decode_time = time.perf_counter() - decode_start_time
         returncode = my_process.returncode
 
     else:
-        stdout_str = ''
-        stderr_str = ''
         if wait_finish:
-            my_process.wait()
+            try:
+                lib_shell_spawn.wait_process(my_process, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                command_response.timed_out = True
+                lib_shell_helpers.kill_process_tree(my_process)
+                lib_shell_spawn.wait_process(my_process)
+            shell_input.join()
             returncode = my_process.returncode
+            resource_usage.communicate_time = time.perf_counter() - spawn_start_time - resource_usage.spawn_time
+            resource_usage.wall_time = time.perf_counter() - spawn_start_time
         else:
+            # nobody waits for the process - the reaper reaps the process when it exited, and closes stdin
+            lib_shell_reaper.shell_process_reaper.watch(lib_shell_reaper.WatchedProcess(my_process))
             returncode = 0
 
-    str_command = ' '.join(ls_command)
-    lib_shell_log.log_results(str_command, stdout_str, stderr_str, returncode, wait_finish, actual_log_settings)
+    command_response.returncode = returncode
+    resource_usage.set_rusage(getattr(my_process, 'rusage', None))
+
+    if lib_shell_log.get_is_log_enabled(returncode, actual_log_settings):
+        stdout_log, stderr_log = get_output_for_log(command_response, decode)
+        lib_shell_log.log_results(ls_command, stdout_log, stderr_log, returncode, wait_finish, actual_log_settings)
 
     if raise_on_returncode_not_zero and returncode:
-        raise subprocess.CalledProcessError(returncode=returncode, cmd=str_command, output=stdout_str, stderr=stderr_str)
+        raise_called_process_error(response=command_response, str_command=' '.join(ls_command), decode=decode)
 
-    command_response = ShellCommandResponse()
-    command_response.stdout = stdout_str
-    command_response.stderr = stderr_str
-    command_response.returncode = returncode
     return command_response
 
 
+def get_response_from_cache_entry(cache_entry: Dict[str, Any], decode: bool) -> ShellCommandResponse:
+    """
+    returns a new response for an entry of lib_shell_result_cache.ShellResultCache
+
+    >>> response = ShellCommandResponse()
+    >>> response.set_output_bytes(b'test', b'')
+    >>> response = get_response_from_cache_entry(lib_shell_result_cache.get_entry(response, decode=False), decode=False)
+    >>> response.stdout_bytes, response.stdout, response.from_cache
+    (b'test', 'test', True)
+
+    """
+    response = ShellCommandResponse()
+    response.returncode = cache_entry['returncode']
+    response.executable = cache_entry['executable']
+    response.stdout_truncated_bytes = cache_entry['stdout_truncated_bytes']
+    response.stderr_truncated_bytes = cache_entry['stderr_truncated_bytes']
+    if decode:
+        response.stdout, response.stderr, response.encoding = cache_entry['stdout'], cache_entry['stderr'], cache_entry['encoding']
+    else:
+        response.set_output_bytes(cache_entry['stdout_bytes'], cache_entry['stderr_bytes'])
+    response.from_cache = True
+    return response
+
+
+def get_output_for_log(response: ShellCommandResponse, decode: bool) -> Tuple[str, str]:
+    """
+    returns stdout and stderr for logging - the raw output of binary responses is not decoded for logging
+
+    >>> response = ShellCommandResponse()
+    >>> response.set_output_bytes(b'test', b'')
+    >>> get_output_for_log(response, decode=False)
+    ('<binary output, 4 bytes>', '')
+
+    """
+    if decode and not response.get_is_spilled():
+        return response.stdout, response.stderr
+    l_output = list()   # type: List[str]
+    for output, output_file in ((response.stdout_bytes, response.stdout_file), (response.stderr_bytes, response.stderr_file)):
+        if output_file is not None:
+            l_output.append(f'<output spilled to "{output_file.path}", {output_file.size} bytes>')
+        elif decode:
+            l_output.append(output.decode(response.encoding or 'utf-8', errors='replace'))
+        else:
+            l_output.append(f'<binary output, {len(output)} bytes>' if output else '')
+    return l_output[0], l_output[1]
+
+
+def raise_called_process_error(response: ShellCommandResponse, str_command: str, decode: bool) -> None:
+    """
+    raises subprocess.CalledProcessError - for binary responses with the raw output, like subprocess does
+
+    >>> import unittest
+    >>> response = ShellCommandResponse()
+    >>> response.set_output_bytes(b'test', b'')
+    >>> response.returncode = 1
+    >>> unittest.TestCase().assertRaises(subprocess.CalledProcessError, raise_called_process_error, response, 'test', False)
+
+    """
+    stdout, stderr = get_output_for_exception(response=response, decode=decode)
+    raise subprocess.CalledProcessError(returncode=response.returncode, cmd=str_command, output=stdout, stderr=stderr)
+
+
+def raise_timeout_expired(response: ShellCommandResponse, str_command: str, timeout: float, decode: bool) -> None:
+    """
+    raises subprocess.TimeoutExpired with the output collected until the command was killed
+
+    >>> import unittest
+    >>> response = ShellCommandResponse()
+    >>> response.set_output_bytes(b'test', b'')
+    >>> unittest.TestCase().assertRaises(subprocess.TimeoutExpired, raise_timeout_expired, response, 'test', 1.0, True)
+
+    """
+    stdout, stderr = get_output_for_exception(response=response, decode=decode)
+    raise subprocess.TimeoutExpired(cmd=str_command, timeout=timeout, output=stdout, stderr=stderr)
+
+
+def get_output_for_exception(response: ShellCommandResponse, decode: bool) -> Tuple[Union[str, bytes], Union[str, bytes]]:
+    """
+    returns stdout and stderr for the exceptions raised - decoded, or the raw output for binary responses, like subprocess does.
+    for output spilled to disk, only the end of the output is returned.
+
+    >>> response = ShellCommandResponse()
+    >>> response.set_output_bytes(b'test', b'')
+    >>> get_output_for_exception(response, decode=False)
+    (b'test', b'')
+    >>> get_output_for_exception(response, decode=True)
+    ('test', '')
+
+    """
+    if response.get_is_spilled():
+        # we pass only the end of the output spilled to disk
+        stdout_bytes, stderr_bytes = [output_file.read_tail_bytes(conf_lib_shell.spill_error_excerpt_bytes) if output_file else output
+                                      for output, output_file in ((response.stdout_bytes, response.stdout_file),
+                                                                  (response.stderr_bytes, response.stderr_file))]
+        if decode:
+            stdout, stderr, encoding = lib_shell_encoding.decode_stdout_stderr(stdout_bytes, stderr_bytes, response.executable)
+            return stdout, stderr
+        return stdout_bytes, stderr_bytes
+    if decode:
+        return response.stdout, response.stderr
+    return response.stdout_bytes, response.stderr_bytes
+
+
+def get_attempt_timeout(timeout: Optional[float], deadline: Optional[float]) -> Optional[float]:
+    """
+    returns the timeout for the next attempt - the timeout, but not later than the deadline (a time.monotonic() value)
+
+    >>> get_attempt_timeout(None, None)
+    >>> get_attempt_timeout(10, None)
+    10
+    >>> get_attempt_timeout(10, time.monotonic() - 1)
+    0.0
+    >>> assert get_attempt_timeout(None, time.monotonic() + 5) <= 5
+
+    """
+    return lib_shell_pass_output.get_wait_timeout(timeout=timeout, deadline=deadline)
+
+
+def get_subprocess_env(env: Optional[Dict[str, str]] = None, env_overrides: Optional[Dict[str, Optional[str]]] = None) -> Dict[str, str]:
+    """ returns the environment for the subprocess - we force utf-8 encoding for python subprocesses
+    env           : the complete environment, instead of os.environ
+    env_overrides : variables to set or (with value None) to remove
+    a new dict is returned, the caller might modify it - lib_shell itself passes the shared env template (see lib_shell_env)
+
+    >>> my_env = get_subprocess_env()
+    >>> assert my_env['PYTHONIOENCODING'] == 'utf-8'
+    >>> assert my_env is not os.environ
+    >>> my_env['LIB_SHELL_TEST_ENV'] = 'test'
+    >>> assert 'LIB_SHELL_TEST_ENV' not in get_subprocess_env()
+    >>> my_env = get_subprocess_env(env={'TEST': 'test'}, env_overrides={'TEST2': 'test2'})
+    >>> assert my_env['TEST'] == 'test' and my_env['TEST2'] == 'test2' and my_env['PYTHONIOENCODING'] == 'utf-8'
+
+    """
+    my_env = dict(lib_shell_env.get_env_with_overrides(env=env, env_overrides=env_overrides))
+    return my_env
+
+
 def get_startup_info(start_new_session: bool):    # type: ignore  # is subprocess.STARTUPINFO - only available on windows !
     """
     >>> if lib_platform.get_is_platform_windows():
@@ -0,0 +1,362 @@
+# STDLIB
+import codecs
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Mapping, Optional, TYPE_CHECKING
+
+# asyncio is imported in the coroutines - whoever runs them has imported asyncio already
+if TYPE_CHECKING:
+    import asyncio  # pragma: no cover
+
+# OWN
+import lib_platform
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+    from . import lib_shell                     # type: ignore # pragma: no cover
+    from . import lib_shell_encoding            # type: ignore # pragma: no cover
+    from . import lib_shell_env                 # type: ignore # pragma: no cover
+    from . import lib_shell_log                 # type: ignore # pragma: no cover
+    from . import lib_shell_pass_output         # type: ignore # pragma: no cover
+    from . import lib_shell_retry               # type: ignore # pragma: no cover
+    from . import lib_shell_shlex               # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+    import lib_shell                            # type: ignore # pragma: no cover
+    import lib_shell_encoding                   # type: ignore # pragma: no cover
+    import lib_shell_env                        # type: ignore # pragma: no cover
+    import lib_shell_log                        # type: ignore # pragma: no cover
+    import lib_shell_pass_output                # type: ignore # pragma: no cover
+    import lib_shell_retry                      # type: ignore # pragma: no cover
+    import lib_shell_shlex                      # type: ignore # pragma: no cover
+
+
+async def run_shell_command_async(command: str,
+                                  shell: bool = False,
+                                  communicate: bool = True,
+                                  wait_finish: bool = True,
+                                  raise_on_returncode_not_zero: bool = True,
+                                  log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                                  pass_stdout_stderr_to_sys: bool = False,
+                                  start_new_session: bool = False,
+                                  retries: int = conf_lib_shell.retries,
+                                  use_sudo: bool = False,
+                                  run_as_user: str = '',
+                                  quiet: bool = False,
+                                  decode: bool = True,
+                                  env: Optional[Dict[str, str]] = None,
+                                  env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                                  cwd: Optional[str] = None,
+                                  retry_policy: Optional[lib_shell_retry.RetryPolicy] = None) -> lib_shell.ShellCommandResponse:
+    """
+    the coroutine version of lib_shell.run_shell_command, built on asyncio subprocesses
+
+    >>> import asyncio
+    >>> response = asyncio.run(run_shell_command_async('echo test', shell=True))
+    >>> assert 'test' in response.stdout
+
+    >>> response = asyncio.run(run_shell_command_async('echo test', shell=False))
+    >>> assert 'test' in response.stdout
+
+    >>> user = lib_shell.lib_shell_helpers.get_current_username()
+    >>> response = asyncio.run(run_shell_command_async('echo test', run_as_user=user))
+    >>> assert 'test' in response.stdout
+
+    """
+
+    command = command.strip()
+
+    if shell and lib_platform.get_is_platform_posix():
+        # when shell = True we need to pass the command in one string
+        ls_command = [command]
+    else:
+        ls_command = lib_shell_shlex.shlex_split_multi_platform(command)
+
+    command_response = await run_shell_ls_command_async(ls_command=ls_command,
+                                                        shell=shell,
+                                                        communicate=communicate,
+                                                        wait_finish=wait_finish,
+                                                        raise_on_returncode_not_zero=raise_on_returncode_not_zero,
+                                                        log_settings=log_settings,
+                                                        pass_stdout_stderr_to_sys=pass_stdout_stderr_to_sys,
+                                                        start_new_session=start_new_session,
+                                                        retries=retries,
+                                                        use_sudo=use_sudo,
+                                                        run_as_user=run_as_user,
+                                                        quiet=quiet,
+                                                        decode=decode,
+                                                        env=env,
+                                                        env_overrides=env_overrides,
+                                                        cwd=cwd,
+                                                        retry_policy=retry_policy)
+    return command_response
+
+
+async def run_shell_ls_command_async(ls_command: List[str],
+                                     shell: bool = False,
+                                     communicate: bool = True,
+                                     wait_finish: bool = True,
+                                     raise_on_returncode_not_zero: bool = True,
+                                     log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                                     pass_stdout_stderr_to_sys: bool = False,
+                                     start_new_session: bool = False,
+                                     retries: int = conf_lib_shell.retries,
+                                     use_sudo: bool = False,
+                                     run_as_user: str = '',
+                                     quiet: bool = False,
+                                     decode: bool = True,
+                                     env: Optional[Dict[str, str]] = None,
+                                     env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                                     cwd: Optional[str] = None,
+                                     retry_policy: Optional[lib_shell_retry.RetryPolicy] = None) -> lib_shell.ShellCommandResponse:
+    """
+    the coroutine version of lib_shell.run_shell_ls_command, built on asyncio subprocesses
+
+    >>> import asyncio
+    >>> import unittest
+    >>> # test std operation
+    >>> response = asyncio.run(run_shell_ls_command_async([sys.executable, '-c', 'print("test")']))
+    >>> assert response.stdout == 'test'
+
+    >>> # test many commands concurrently on one event loop
+    >>> async def run_many():
+    ...     return await asyncio.gather(*[run_shell_ls_command_async([sys.executable, '-c', f'print({n})']) for n in range(10)])
+    >>> responses = asyncio.run(run_many())
+    >>> assert [response.stdout for response in responses] == [str(n) for n in range(10)]
+
+    >>> # test pass stdout to sys
+    >>> response = asyncio.run(run_shell_ls_command_async([sys.executable, '-c', 'print("test")'],
+    ...                        pass_stdout_stderr_to_sys=True))  # doctest: +ELLIPSIS, +NORMALIZE_WHITESPACE
+    te...
+    >>> assert response.stdout == 'test'
+
+    >>> # test returncode not zero, without raising Exception
+    >>> response = asyncio.run(run_shell_ls_command_async([sys.executable, '-c', 'import sys; sys.exit(2)'],
+    ...                        raise_on_returncode_not_zero=False, retries=1, quiet=True))
+    >>> assert response.returncode == 2
+
+    >>> # test returncode not zero, raising Exception
+    >>> unittest.TestCase().assertRaises(subprocess.CalledProcessError, asyncio.run,
+    ...     run_shell_ls_command_async([sys.executable, '-c', 'import sys; sys.exit(2)'], retries=1, quiet=True))
+
+    >>> # test binary output
+    >>> response = asyncio.run(run_shell_ls_command_async([sys.executable, '-c', 'import sys; sys.stdout.buffer.write(bytes(range(256)))'],
+    ...                        decode=False))
+    >>> assert response.stdout_bytes == bytes(range(256))
+
+    >>> # test std operation without communication, no_wait
+    >>> response = asyncio.run(run_shell_ls_command_async([sys.executable, '-c', 'print("test")'], communicate=False, wait_finish=False))
+    >>> assert response.returncode == 0
+
+    >>> # the process is not killed when the event loop is closed
+    >>> import os
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     path = os.path.join(directory, 'test.txt')
+    ...     program = f'import time; time.sleep(0.2); open({path!r}, "w").close()'
+    ...     response = asyncio.run(run_shell_ls_command_async([sys.executable, '-c', program], communicate=False, wait_finish=False))
+    ...     for _ in range(100):
+    ...         if os.path.exists(path):
+    ...             break
+    ...         time.sleep(0.05)
+    ...     assert os.path.exists(path)
+
+    """
+
+    import asyncio
+
+    if retry_policy is None:
+        # the legacy parameter retries accepted 0 - the command is run once then
+        retry_policy = lib_shell_retry.RetryPolicy(max_attempts=max(1, retries))
+
+    response = lib_shell.ShellCommandResponse()
+    # the environment is resolved once for all tries
+    my_env = lib_shell_env.get_env_with_overrides(env=env, env_overrides=env_overrides)
+    l_attempt_durations = list()    # type: List[float]
+    start_time = time.monotonic()
+
+    for attempt in range(1, retry_policy.max_attempts + 1):
+        attempt_start_time = time.monotonic()
+        response = await _run_shell_ls_command_one_try_async(ls_command=ls_command,
+                                                             shell=shell,
+                                                             communicate=communicate,
+                                                             wait_finish=wait_finish,
+                                                             log_settings=log_settings,
+                                                             pass_stdout_stderr_to_sys=pass_stdout_stderr_to_sys,
+                                                             start_new_session=start_new_session,
+                                                             use_sudo=use_sudo,
+                                                             run_as_user=run_as_user,
+                                                             quiet=quiet,
+                                                             decode=decode,
+                                                             env=my_env,
+                                                             cwd=cwd)
+        l_attempt_durations.append(time.monotonic() - attempt_start_time)
+        retry_delay = retry_policy.get_retry_delay(response=response, attempt=attempt, elapsed=time.monotonic() - start_time)
+        if retry_delay is None:
+            break
+        if retry_delay:
+            await asyncio.sleep(retry_delay)
+
+    response.attempts = len(l_attempt_durations)
+    response.attempt_durations = l_attempt_durations
+
+    if response.returncode != 0 and raise_on_returncode_not_zero:
+        ls_command = lib_shell.prepend_sudo_and_run_as_user(ls_command=ls_command, shell=shell, run_as_user=run_as_user, use_sudo=use_sudo)
+        lib_shell.raise_called_process_error(response=response, str_command=' '.join(ls_command), decode=decode)
+    if decode:
+        response.stdout = response.stdout.strip()
+    return response
+
+
+async def _run_shell_ls_command_one_try_async(ls_command: List[str],
+                                              shell: bool = False,
+                                              communicate: bool = True,
+                                              wait_finish: bool = True,
+                                              log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                                              pass_stdout_stderr_to_sys: bool = False,
+                                              start_new_session: bool = False,
+                                              use_sudo: bool = False,
+                                              run_as_user: str = '',
+                                              quiet: bool = False,
+                                              decode: bool = True,
+                                              env: Optional[Mapping[str, str]] = None,
+                                              env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                                              cwd: Optional[str] = None) -> lib_shell.ShellCommandResponse:
+
+    import asyncio
+
+    if start_new_session:
+        communicate = False
+
+    if not communicate and not wait_finish:
+        # an asyncio process belongs to the event loop, which kills it when the loop is closed, and nobody would await it.
+        # the process is started like in lib_shell instead - the output is discarded, and the reaper reaps the process when it exited
+        return lib_shell._run_shell_ls_command_one_try(ls_command=ls_command,
+                                                       shell=shell,
+                                                       communicate=False,
+                                                       wait_finish=False,
+                                                       raise_on_returncode_not_zero=False,
+                                                       log_settings=log_settings,
+                                                       start_new_session=start_new_session,
+                                                       use_sudo=use_sudo,
+                                                       run_as_user=run_as_user,
+                                                       quiet=quiet,
+                                                       decode=decode,
+                                                       env=env,
+                                                       env_overrides=env_overrides,
+                                                       cwd=cwd)
+
+    if quiet:
+        actual_log_settings = conf_lib_shell.log_settings_quiet
+        pass_stdout_stderr_to_sys = False
+    else:
+        actual_log_settings = log_settings
+
+    executable = lib_shell_encoding.get_executable_key(ls_command, use_sudo=use_sudo, run_as_user=run_as_user)
+    ls_command = lib_shell.prepend_sudo_and_run_as_user(ls_command=ls_command, shell=shell, run_as_user=run_as_user, use_sudo=use_sudo)
+
+    # the environment is resolved already if called from run_shell_ls_command_async
+    if env is None or env_overrides:
+        my_env = lib_shell_env.get_env_with_overrides(env=env, env_overrides=env_overrides)
+    else:
+        my_env = env
+
+    startupinfo = lib_shell.get_startup_info(start_new_session)
+    subprocess_stdin, subprocess_stdout, subprocess_stderr = lib_shell.get_pipes(start_new_session)
+
+    my_process = await create_subprocess(ls_command=ls_command,
+                                         shell=shell,
+                                         startupinfo=startupinfo,
+                                         stdin=subprocess_stdin,
+                                         stdout=subprocess_stdout,
+                                         stderr=subprocess_stderr,
+                                         env=my_env,
+                                         cwd=cwd)
+
+    command_response = lib_shell.ShellCommandResponse()
+    command_response.executable = executable
+
+    if communicate:
+        if pass_stdout_stderr_to_sys:
+            encoding = lib_shell_encoding.get_system_preferred_encoding()
+            # we dont write to stdin - close it, so the process can not wait for input
+            my_process.stdin.close()    # type: ignore
+            stdout, stderr = await asyncio.gather(pass_stream_to_sys(my_process.stdout, sys.stdout, encoding),
+                                                  pass_stream_to_sys(my_process.stderr, sys.stderr, encoding))
+            await my_process.wait()
+        else:
+            stdout, stderr = await my_process.communicate()
+
+        command_response.set_output_bytes(stdout, stderr)
+        if decode:
+            command_response.decode_output(keep_output_bytes=False)
+        returncode = my_process.returncode
+
+    else:
+        returncode = await my_process.wait()
+
+    command_response.returncode = returncode
+
+    if lib_shell_log.get_is_log_enabled(returncode, actual_log_settings):
+        stdout_log, stderr_log = lib_shell.get_output_for_log(command_response, decode)
+        lib_shell_log.log_results(ls_command, stdout_log, stderr_log, returncode, wait_finish, actual_log_settings)
+
+    return command_response
+
+
+async def create_subprocess(ls_command: List[str], shell: bool, **kwargs: Any) -> 'asyncio.subprocess.Process':
+    """
+    creates the asyncio subprocess with the same semantics as subprocess.Popen(ls_command, shell=shell)
+
+    >>> import asyncio
+    >>> async def get_returncode():
+    ...     process = await create_subprocess([sys.executable, '-c', 'pass'], shell=False)
+    ...     return await process.wait()
+    >>> assert asyncio.run(get_returncode()) == 0
+
+    """
+    import asyncio
+
+    if shell:
+        if lib_platform.get_is_platform_posix():
+            s_command = ' '.join(ls_command)
+        else:
+            s_command = subprocess.list2cmdline(ls_command)         # pragma: no cover
+        process = await asyncio.create_subprocess_shell(s_command, **kwargs)
+    else:
+        process = await asyncio.create_subprocess_exec(*ls_command, **kwargs)
+    return process
+
+
+async def pass_stream_to_sys(stream: 'asyncio.StreamReader', target_pipe: Any, encoding: str) -> bytes:
+    """
+    reads the stream until end-of-file is reached, passes the decoded data to the target_pipe and returns the collected bytes
+
+    >>> import asyncio
+    >>> import io
+    >>> async def read_stream():
+    ...     stream = asyncio.StreamReader()
+    ...     stream.feed_data('mäßig'.encode('utf-8'))
+    ...     stream.feed_eof()
+    ...     target_pipe = io.StringIO()
+    ...     result = await pass_stream_to_sys(stream, target_pipe, 'utf-8')
+    ...     return result, target_pipe.getvalue()
+    >>> asyncio.run(read_stream())
+    (b'm\\xc3\\xa4\\xc3\\x9fig', 'mäßig')
+
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    l_chunks = list()   # type: List[bytes]
+    while True:
+        chunk = await stream.read(lib_shell_pass_output.chunk_size)
+        if not chunk:
+            break
+        l_chunks.append(chunk)
+        lib_shell_pass_output.write_to_target_pipe(target_pipe, decoder.decode(chunk))
+    lib_shell_pass_output.write_to_target_pipe(target_pipe, decoder.decode(b'', final=True))
+    return b''.join(l_chunks)
@@ -0,0 +1,125 @@
+# STDLIB
+import collections
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class LruTtlCache(object):
+    """
+    a thread safe mapping with bounded size and time to live.
+    if the cache is full, the least recently used entry is evicted - entries older than ttl seconds are not returned.
+    the statistics count hits, misses, evictions (because the cache was full) and expirations (because of the ttl).
+
+    max_size       : the maximum number of entries, 0 disables the cache
+    ttl            : the time to live of an entry in seconds, None for no expiry
+    clock          : returns the current time in seconds - time.monotonic by default
+    max_total_size : the maximum sum of the sizes of the values, None for no limit - values larger than that are not cached
+    get_value_size : returns the size of a value, used with max_total_size - len by default
+
+    >>> now = [0.0]
+    >>> cache = LruTtlCache(max_size=2, ttl=10, clock=lambda: now[0])
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> # 'b' is the least recently used entry, it is evicted
+    >>> cache.set('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> now[0] = 11.0
+    >>> cache.get('a', 'expired')
+    'expired'
+    >>> cache.get_stats()
+    {'hits': 1, 'misses': 2, 'evictions': 1, 'expirations': 1, 'size': 1}
+    >>> cache.clear()
+    >>> len(cache)
+    0
+
+    >>> # test max_total_size
+    >>> cache = LruTtlCache(max_size=10, max_total_size=8)
+    >>> cache.set('a', 'test')
+    >>> cache.set('b', 'test')
+    >>> cache.set('c', 'test')
+    >>> cache.set('d', 'too large')
+    >>> sorted(cache._entries), cache.total_size, cache.evictions
+    (['b', 'c'], 8, 1)
+    >>> cache.delete('b')
+    >>> cache.total_size
+    4
+
+    """
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic,
+                 max_total_size: Optional[int] = None, get_value_size: Callable[[Any], int] = len) -> None:
+        self.max_size = max_size        # type: int
+        self.ttl = ttl                  # type: Optional[float]
+        self.clock = clock              # type: Callable[[], float]
+        self.max_total_size = max_total_size    # type: Optional[int]
+        self.get_value_size = get_value_size    # type: Callable[[Any], int]
+        # the sum of the sizes of the values, if max_total_size is set
+        self.total_size = 0             # type: int
+        # key : (value, time the value was set, size of the value)
+        self._entries = collections.OrderedDict()    # type: collections.OrderedDict[Hashable, Tuple[Any, float, int]]
+        self._lock = threading.Lock()
+        self.hits = 0                   # type: int
+        self.misses = 0                 # type: int
+        self.evictions = 0              # type: int
+        self.expirations = 0            # type: int
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ returns the value of the key, or default if the key is not cached or expired """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses = self.misses + 1
+                return default
+            value, set_time, value_size = entry
+            if self.ttl is not None and self.clock() - set_time > self.ttl:
+                del self._entries[key]
+                self.total_size = self.total_size - value_size
+                self.expirations = self.expirations + 1
+                self.misses = self.misses + 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """ caches the value - the least recently used entries are evicted, if the cache is full """
+        if self.max_size <= 0:
+            return
+        value_size = 0 if self.max_total_size is None else self.get_value_size(value)
+        with self._lock:
+            self._pop(key)
+            if self.max_total_size is not None and value_size > self.max_total_size:
+                return
+            self._entries[key] = (value, self.clock(), value_size)
+            self.total_size = self.total_size + value_size
+            while len(self._entries) > self.max_size or (self.max_total_size is not None and self.total_size > self.max_total_size):
+                evicted_key, evicted_entry = self._entries.popitem(last=False)
+                self.total_size = self.total_size - evicted_entry[2]
+                self.evictions = self.evictions + 1
+
+    def delete(self, key: Hashable) -> None:
+        """ removes the entry of the key, if it is cached """
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_size = self.total_size - entry[2]
+
+    def clear(self) -> None:
+        """ removes all entries and resets the statistics """
+        with self._lock:
+            self._entries.clear()
+            self.total_size = 0
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'expirations': self.expirations, 'size': len(self._entries)}
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,212 @@
+# STDLIB
+import subprocess
+import sys
+import time
+from typing import Callable, Optional, Tuple
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from . import lib_shell_pass_output         # type: ignore # pragma: no cover
+    from . import lib_shell_spawn               # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    import lib_shell_pass_output                # type: ignore # pragma: no cover
+    import lib_shell_spawn                      # type: ignore # pragma: no cover
+
+
+# the parts of the output kept, if the output is larger than max_bytes
+output_retentions = ('head', 'tail', 'head_tail')
+
+
+class BoundedOutputBuffer(object):
+    """
+    collects the output of a pipe, but keeps only max_bytes of it - the rest is counted in truncated_bytes, and dropped.
+    a binary file like object, it can be passed as sink to lib_shell_pass_output.pass_stdout_stderr_to_sys.
+
+    retention='head'      : keeps the first max_bytes
+    retention='tail'      : keeps the last max_bytes
+    retention='head_tail' : keeps the first and the last max_bytes / 2, joined by a line which tells the number of bytes truncated
+    max_bytes=None        : keeps all output
+
+    the output is cut at utf-8 character boundaries, so a truncated excerpt still decodes like the complete output would.
+
+    >>> output_buffer = BoundedOutputBuffer(max_bytes=4, retention='head')
+    >>> _ = output_buffer.write(b'test1\\ntest2\\n')
+    >>> output_buffer.get_bytes(), output_buffer.size, output_buffer.truncated_bytes
+    (b'test', 12, 8)
+
+    >>> output_buffer = BoundedOutputBuffer(max_bytes=6, retention='tail')
+    >>> for chunk in (b'test1\\n', b'test2\\n', b'test3\\n'):
+    ...     _ = output_buffer.write(chunk)
+    >>> output_buffer.get_bytes(), output_buffer.truncated_bytes
+    (b'test3\\n', 12)
+
+    >>> output_buffer = BoundedOutputBuffer(max_bytes=12, retention='head_tail')
+    >>> _ = output_buffer.write(b'test1\\n' + b'x' * 100 + b'\\ntest2\\n')
+    >>> output_buffer.get_bytes()
+    b'test1\\n\\n... 101 bytes truncated ...\\ntest2\\n'
+
+    >>> # utf-8 characters are not cut
+    >>> output_buffer = BoundedOutputBuffer(max_bytes=2, retention='tail')
+    >>> _ = output_buffer.write('mäßig'.encode('utf-8'))
+    >>> output_buffer.get_bytes().decode('utf-8'), output_buffer.truncated_bytes
+    ('ig', 5)
+    >>> output_buffer = BoundedOutputBuffer(max_bytes=2, retention='head')
+    >>> _ = output_buffer.write('mäßig'.encode('utf-8'))
+    >>> output_buffer.get_bytes().decode('utf-8'), output_buffer.truncated_bytes
+    ('m', 6)
+
+    >>> import unittest
+    >>> unittest.TestCase().assertRaises(ValueError, BoundedOutputBuffer, 10, 'middle')
+
+    """
+    def __init__(self, max_bytes: Optional[int] = None, retention: str = 'tail') -> None:
+        if retention not in output_retentions:
+            raise ValueError(f'the retention must be one of {output_retentions}, not "{retention}"')
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError(f'max_bytes must not be negative, not {max_bytes}')
+        self.max_bytes = max_bytes          # type: Optional[int]
+        self.retention = retention          # type: str
+        # the number of bytes written, including the bytes dropped
+        self.size = 0                       # type: int
+        if max_bytes is None:
+            self.head_size, self.tail_size = sys.maxsize, 0
+        elif retention == 'head':
+            self.head_size, self.tail_size = max_bytes, 0
+        elif retention == 'tail':
+            self.head_size, self.tail_size = 0, max_bytes
+        else:
+            self.head_size = max_bytes // 2
+            self.tail_size = max_bytes - self.head_size
+        self._head = bytearray()
+        # the tail is trimmed only when it grew to twice its size - so the bytes are not moved on every write
+        self._tail = bytearray()
+
+    def write(self, chunk: bytes) -> int:
+        self.size = self.size + len(chunk)
+        data = memoryview(chunk)
+        n_head_bytes = min(len(data), self.head_size - len(self._head))
+        if n_head_bytes > 0:
+            self._head += data[:n_head_bytes]
+            data = data[n_head_bytes:]
+        if data and self.tail_size:
+            self._tail += data[-self.tail_size:]
+            if len(self._tail) > 2 * self.tail_size:
+                del self._tail[:len(self._tail) - self.tail_size]
+        return len(chunk)
+
+    def flush(self) -> None:
+        pass
+
+    @property
+    def truncated_bytes(self) -> int:
+        """ the number of bytes written, but not kept """
+        head, tail = self._get_head_tail()
+        return self.size - len(head) - len(tail)
+
+    def get_bytes(self) -> bytes:
+        """ returns the output kept - with retention 'head_tail' and truncated output, the line telling the number of bytes truncated is inserted """
+        head, tail = self._get_head_tail()
+        truncated_bytes = self.size - len(head) - len(tail)
+        if self.retention == 'head_tail' and truncated_bytes:
+            return b''.join((head, f'\n... {truncated_bytes} bytes truncated ...\n'.encode('ascii'), tail))
+        return head + tail
+
+    def _get_head_tail(self) -> Tuple[bytes, bytes]:
+        head = bytes(self._head)
+        tail = bytes(self._tail[-self.tail_size:]) if self.tail_size else b''
+        n_not_kept = self.size - len(head) - len(tail)
+        if n_not_kept and head:
+            head = head[:_get_utf8_complete_length(head)]
+        if n_not_kept and tail:
+            tail = tail[_get_utf8_start_offset(tail):]
+        return head, tail
+
+
+def capture_output(process: subprocess.Popen,       # type: ignore
+                   stdout_buffer: BoundedOutputBuffer,
+                   stderr_buffer: BoundedOutputBuffer,
+                   timeout: Optional[float] = None,
+                   on_chunk: Optional[Callable[[str, bytes], None]] = None) -> None:
+    """
+    reads stdout and stderr of the process into the buffers until end-of-file is reached, and waits for the process to terminate.
+    the output beyond the bounds of the buffers is read and dropped - so the process never blocks on a full pipe.
+    if the output is not complete after timeout seconds, subprocess.TimeoutExpired is raised, the process is not killed.
+    on_chunk is called with (pipe_name, chunk) for each chunk read, pipe_name is 'stdout' or 'stderr'.
+
+    >>> program = 'import sys; sys.stdout.write("x" * 1000000); print("error", file=sys.stderr)'
+    >>> process = subprocess.Popen([sys.executable, '-c', program], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> stdout_buffer, stderr_buffer = BoundedOutputBuffer(100, 'head'), BoundedOutputBuffer()
+    >>> capture_output(process, stdout_buffer, stderr_buffer)
+    >>> stdout_buffer.get_bytes() == b'x' * 100, stdout_buffer.truncated_bytes, stderr_buffer.get_bytes().strip()
+    (True, 999900, b'error')
+    >>> process.returncode
+    0
+
+    >>> # test timeout
+    >>> import unittest
+    >>> process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(10)'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> unittest.TestCase().assertRaises(subprocess.TimeoutExpired, capture_output, process, stdout_buffer, stderr_buffer, 0.1)
+    >>> process.kill()
+    >>> assert process.wait() != 0
+
+    """
+    buffers = {'stdout': stdout_buffer, 'stderr': stderr_buffer}
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        for pipe_name, chunk in lib_shell_pass_output.iter_process_output(process, deadline=deadline):
+            if on_chunk is not None:
+                on_chunk(pipe_name, chunk)
+            buffers[pipe_name].write(chunk)
+    except subprocess.TimeoutExpired:
+        raise subprocess.TimeoutExpired(cmd=process.args, timeout=timeout)    # type: ignore
+    lib_shell_spawn.wait_process(process)
+
+
+def _get_utf8_complete_length(data: bytes) -> int:
+    """
+    returns the length of data without an incomplete utf-8 character at the end
+
+    >>> _get_utf8_complete_length('mä'.encode('utf-8'))
+    3
+    >>> _get_utf8_complete_length('mä'.encode('utf-8')[:2])
+    1
+    >>> _get_utf8_complete_length(b'test')
+    4
+
+    """
+    for n_bytes_back in range(1, min(4, len(data)) + 1):
+        byte = data[-n_bytes_back]
+        if byte & 0xC0 == 0x80:
+            # a continuation byte - we look for the start of the character
+            continue
+        if byte >= 0xF0:
+            character_length = 4
+        elif byte >= 0xE0:
+            character_length = 3
+        elif byte >= 0xC0:
+            character_length = 2
+        else:
+            character_length = 1
+        if character_length > n_bytes_back:
+            return len(data) - n_bytes_back
+        return len(data)
+    return len(data)
+
+
+def _get_utf8_start_offset(data: bytes) -> int:
+    """
+    returns the offset of the first complete utf-8 character - up to 3 continuation bytes at the start are skipped
+
+    >>> _get_utf8_start_offset('ä'.encode('utf-8')[1:] + b'test')
+    1
+    >>> _get_utf8_start_offset(b'test')
+    0
+
+    """
+    offset = 0
+    while offset < min(3, len(data)) and data[offset] & 0xC0 == 0x80:
+        offset = offset + 1
+    return offset
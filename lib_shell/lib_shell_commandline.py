@@ -1,31 +1,46 @@
 # stdlib
+import itertools
 import os
 import pathlib
 import subprocess
-from typing import List, Union
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, Union, TYPE_CHECKING
 
 # ext
-import psutil   # type: ignore
+# psutil is imported on first use, to keep the import of lib_shell cheap
+if TYPE_CHECKING:
+    import psutil   # type: ignore # pragma: no cover
 
 # own
 import btx_lib_list
-import lib_path
 import lib_platform
 
 # PROJ
 try:                                            # type: ignore # pragma: no cover
     # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+    from . import lib_shell_cache               # type: ignore # pragma: no cover
     from . import lib_shell_shlex               # type: ignore # pragma: no cover
 except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
     # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+    import lib_shell_cache                      # type: ignore # pragma: no cover
     import lib_shell_shlex                      # type: ignore # pragma: no cover
 
 
+# the parsed commandlines per (pid, create time) - a reused pid has a different create time, so it is never confused with the old process.
+# the size and the time to live can be adjusted with commandline_cache.max_size and commandline_cache.ttl
+commandline_cache = lib_shell_cache.LruTtlCache(max_size=4096, ttl=300.0)
+
+# the number of command variations checked with os.path.exists, before the directory listings are used - see _get_executable_file
+_n_variations_checked_directly = 16
+
+
 def get_l_commandline_from_pid(pid: int) -> List[str]:
     """
     if there are blanks in the parameters, psutil.cmdline does not work correctly on linux.
     see Error Report for PSUTIL : https://github.com/giampaolo/psutil/issues/1179
 
+    >>> import psutil
     >>> if lib_platform.get_is_platform_posix():
     ...     process = subprocess.Popen(['nano', './mäßig böse büßer', './müßige bärtige blödmänner'])
     ...     pid = process.pid
@@ -38,13 +53,124 @@ def get_l_commandline_from_pid(pid: int) -> List[str]:
     ...     psutil.Process(pid).kill()
 
     """
+    import psutil   # type: ignore
 
     process = psutil.Process(pid)
     l_commands = get_l_commandline_from_psutil_process(process=process)
     return l_commands
 
 
-def get_l_commandline_from_psutil_process(process: psutil.Process) -> List[str]:
+class ProcessCommandline(object):
+    """
+    the commandline, the working directory and the executable of a process, as read by snapshot_commandlines.
+    cwd and exe are None, if they can not be read - for processes of other users, or kernel threads.
+
+    """
+    __slots__ = ('pid', 'l_commandline', 'cwd', 'exe')
+
+    def __init__(self, pid: int, l_commandline: List[str], cwd: Optional[str], exe: Optional[str]) -> None:
+        self.pid = pid                                  # type: int
+        self.l_commandline = l_commandline              # type: List[str]
+        self.cwd = cwd                                  # type: Optional[str]
+        self.exe = exe                                  # type: Optional[str]
+
+    def __repr__(self) -> str:
+        return f'ProcessCommandline(pid={self.pid}, l_commandline={self.l_commandline!r}, cwd={self.cwd!r}, exe={self.exe!r})'
+
+
+def snapshot_commandlines(pids: Optional[Iterable[int]] = None) -> Dict[int, ProcessCommandline]:
+    """
+    returns the commandlines of the processes as dict {pid: ProcessCommandline} - of all processes if pids is None.
+    processes which terminate during the snapshot, or which can not be read, are missing in the result.
+
+    on linux /proc is scanned once, and cmdline, cwd and exe are read once for each process - without psutil.
+    that is much cheaper than get_l_commandline_from_pid for each process, see benchmarks/bench_commandline_snapshot.py.
+    on other platforms psutil is used.
+
+    >>> import psutil
+    >>> import time
+    >>> if lib_platform.get_is_platform_posix():
+    ...     process = subprocess.Popen(['sleep', '10'])
+    ...     # wait for the exec of the child
+    ...     while psutil.Process(process.pid).cmdline() != ['sleep', '10']:
+    ...         time.sleep(0.01)
+    ...     snapshot = snapshot_commandlines()
+    ...     assert snapshot[process.pid].l_commandline == ['sleep', '10']
+    ...     assert snapshot[process.pid].cwd == os.getcwd()
+    ...     snapshot = snapshot_commandlines(pids=[process.pid, os.getpid()])
+    ...     assert sorted(snapshot) == sorted([process.pid, os.getpid()])
+    ...     assert snapshot[os.getpid()].l_commandline == get_l_commandline_from_pid(os.getpid())
+    ...     assert snapshot[os.getpid()].exe == psutil.Process().exe()
+    ...     process.kill()
+    ...     assert process.wait() != 0
+
+    """
+    if not lib_platform.get_is_platform_linux():
+        return _snapshot_commandlines_psutil(pids)      # pragma: no cover
+
+    if pids is None:
+        pids = (int(entry.name) for entry in os.scandir('/proc') if entry.name.isdigit())
+
+    snapshot = dict()       # type: Dict[int, ProcessCommandline]
+    for pid in pids:
+        process_commandline = _read_proc_commandline(pid)
+        if process_commandline is not None:
+            snapshot[pid] = process_commandline
+    return snapshot
+
+
+def _read_proc_commandline(pid: int) -> Optional[ProcessCommandline]:
+    """ reads the commandline of the process from /proc, None if the process is gone """
+    proc_directory = f'/proc/{pid}'
+    try:
+        with open(f'{proc_directory}/cmdline', mode='rb') as proc_commandline:
+            l_commands = [os.fsdecode(command) for command in proc_commandline.read().split(b'\x00')]
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    cwd = _read_proc_link(f'{proc_directory}/cwd')
+    exe = _read_proc_link(f'{proc_directory}/exe')
+    try:
+        l_commandline = _get_l_commandline_from_l_commands(l_commands, get_cwd=lambda: cwd)
+    except (RuntimeError, ValueError):  # pragma: no cover
+        # the executable with blanks can not be found (anymore), or the commandline can not be parsed
+        l_commandline = btx_lib_list.ls_del_empty_elements(btx_lib_list.ls_strip_elements(l_commands))
+    return ProcessCommandline(pid=pid, l_commandline=l_commandline, cwd=cwd, exe=exe)
+
+
+def _read_proc_link(path: str) -> Optional[str]:
+    try:
+        return os.readlink(path)
+    except OSError:
+        # the process is gone, it is a process of another user, or a kernel thread
+        return None
+
+
+def _snapshot_commandlines_psutil(pids: Optional[Iterable[int]] = None) -> Dict[int, ProcessCommandline]:    # pragma: no cover
+    import psutil   # type: ignore
+
+    if pids is None:
+        pids = psutil.pids()
+    snapshot = dict()       # type: Dict[int, ProcessCommandline]
+    for pid in pids:
+        try:
+            process = psutil.Process(pid)
+            l_commandline = get_l_commandline_from_psutil_process(process)
+        except (psutil.Error, RuntimeError, ValueError):
+            continue
+        cwd = exe = None        # type: Optional[str]
+        try:
+            cwd = process.cwd()
+        except psutil.Error:
+            pass
+        try:
+            exe = process.exe()
+        except psutil.Error:
+            pass
+        snapshot[pid] = ProcessCommandline(pid=pid, l_commandline=l_commandline, cwd=cwd, exe=exe)
+    return snapshot
+
+
+def get_l_commandline_from_psutil_process(process: 'psutil.Process') -> List[str]:
     """
     if there are blanks in the parameters, psutil.cmdline does not work correctly on linux, even if they are '\x00' separated
     see Error Report for PSUTIL : https://github.com/giampaolo/psutil/issues/1179
@@ -53,6 +179,8 @@ def get_l_commandline_from_psutil_process(process: psutil.Process) -> List[str]:
     in Linux for instance postgrey, or some other scripts started with systemd services
     that happens also on some windows programs
 
+    >>> import lib_path
+    >>> import psutil
     >>> # test the "good" commandline, '\x00' terminated and '\x00' separated
     >>> import getpass
     >>> import importlib
@@ -91,6 +219,61 @@ def get_l_commandline_from_psutil_process(process: psutil.Process) -> List[str]:
     else:
         l_commands = process.cmdline()
 
+    # the raw commandline is part of the key - it changes with exec, or if the process rewrites its arguments
+    process_cache_key = get_process_cache_key(process)
+    cache_key = None if process_cache_key is None else ('commandline', ) + process_cache_key + tuple(l_commands)
+    if cache_key is not None:
+        cached_l_commands = commandline_cache.get(cache_key)
+        if cached_l_commands is not None:
+            return list(cached_l_commands)
+
+    l_commands = _get_l_commandline_from_l_commands(l_commands, get_cwd=process.cwd)
+
+    if cache_key is not None:
+        commandline_cache.set(cache_key, tuple(l_commands))
+    return l_commands
+
+
+def get_process_cache_key(process: 'psutil.Process') -> Optional[Tuple[int, float]]:
+    """
+    returns the key of the process for the commandline_cache : (pid, create time),
+    None if the cache is disabled or the create time is not available
+
+    >>> import psutil
+    >>> import time
+    >>> if lib_platform.get_is_platform_posix():
+    ...     process = subprocess.Popen(['sleep', '10'])
+    ...     psutil_process = psutil.Process(process.pid)
+    ...     # wait for the exec of the child
+    ...     while psutil_process.cmdline() != ['sleep', '10']:
+    ...         time.sleep(0.01)
+    ...     assert get_process_cache_key(psutil_process) == (process.pid, psutil_process.create_time())
+    ...     commandline_cache.clear()
+    ...     assert get_l_commandline_from_psutil_process(psutil_process) == ['sleep', '10']
+    ...     l_commandline = get_l_commandline_from_psutil_process(psutil.Process(process.pid))
+    ...     assert l_commandline == ['sleep', '10']
+    ...     assert commandline_cache.get_stats()['hits'] == 1
+    ...     # the cached value is not changed by the caller
+    ...     l_commandline.append('test')
+    ...     assert get_l_commandline_from_psutil_process(psutil_process) == ['sleep', '10']
+    ...     process.kill()
+    ...     assert process.wait() != 0
+
+    """
+    if not conf_lib_shell.commandline_cache_enabled:
+        return None
+
+    import psutil   # type: ignore
+
+    try:
+        # psutil reads the create time once, when the process object is created
+        return process.pid, process.create_time()
+    except psutil.Error:    # pragma: no cover
+        return None
+
+
+def _get_l_commandline_from_l_commands(l_commands: List[str], get_cwd: Callable[[], Optional[str]]) -> List[str]:
+    """ the commandline from the raw '\x00' separated parts - get_cwd is only called, if the working directory of the process is needed """
     l_commands = btx_lib_list.ls_strip_elements(l_commands)
     l_commands = btx_lib_list.ls_del_empty_elements(l_commands)
     if len(l_commands) == 1:                                                                # pragma: no cover
@@ -98,13 +281,15 @@ def get_l_commandline_from_psutil_process(process: psutil.Process) -> List[str]:
         # for the case the command executable contains blank, the part after the blank would be interpreted as parameter
         # for instance "/home/user/test test.sh parameter1 parameter2"
         if lib_platform.get_is_platform_linux():
-            s_command = get_quoted_command(s_command, process)
+            s_command = _get_quoted_command(s_command, get_cwd)
         l_commands = lib_shell_shlex.shlex_split_multi_platform(s_command)                  # pragma: no cover
     return l_commands
 
 
-def get_quoted_command(s_command: Union[str, pathlib.Path], process: psutil.Process) -> str:
+def get_quoted_command(s_command: Union[str, pathlib.Path], process: 'psutil.Process') -> str:
     """ for the case the command executable contains blank, it would be interpreted as parameter
+    >>> import lib_path
+    >>> import psutil
     >>> if lib_platform.get_is_platform_linux():
     ...     import importlib
     ...     import importlib.util
@@ -164,12 +349,26 @@ def get_quoted_command(s_command: Union[str, pathlib.Path], process: psutil.Proc
     ...         os.chdir(save_actual_directory)
 
     """
+    process_cache_key = get_process_cache_key(process)
+    if process_cache_key is not None:
+        cache_key = ('quoted_command', ) + process_cache_key + (str(s_command), )
+        quoted_command = commandline_cache.get(cache_key)
+        if quoted_command is None:
+            quoted_command = _get_quoted_command(s_command, get_cwd=process.cwd)
+            commandline_cache.set(cache_key, quoted_command)
+        return quoted_command     # type: ignore
+    return _get_quoted_command(s_command, get_cwd=process.cwd)
+
+
+def _get_quoted_command(s_command: Union[str, pathlib.Path], get_cwd: Callable[[], Optional[str]]) -> str:
     s_command = str(s_command)
     if " " not in s_command:
         return s_command
 
-    l_command_variations = get_l_command_variations(s_command)
-    s_executable_file = get_executable_file(l_command_variations, process)
+    # the working directory of the process is needed only for relative paths, and asked only once
+    cwd = None if get_is_absolute_path(s_command) else get_cwd()
+    # the variations are created one by one, until the executable is found
+    s_executable_file = _get_executable_file(iter_command_variations(s_command), cwd)
     s_parameters = s_command.split(s_executable_file, 1)[1]
 
     # if there is no blank in the executable, the lexer will work anyway - but might fail if blank in parameters
@@ -177,13 +376,14 @@ def get_quoted_command(s_command: Union[str, pathlib.Path], process: psutil.Proc
         return s_command
 
     # if s_command is just the executable with a blank in the absolute path
+    # os.path.exists returns False for paths longer than the maximum path length, pathlib raises
     if get_is_absolute_path(s_command):
-        if pathlib.Path(s_command).exists():
+        if os.path.exists(s_command):
             return quote_string(s_command)
 
     # if s_command is just the executable with a blank in the relative path
     else:
-        if (pathlib.Path(process.cwd()) / s_command).exists():
+        if os.path.exists(os.path.join(cwd, s_command)):     # type: ignore
             return quote_string(s_command)
 
     # return "executable with blanks" parameter1 parameter2 parameter3
@@ -221,16 +421,36 @@ def get_is_absolute_path(s_command: str) -> bool:
 def get_l_command_variations(s_command: str) -> List[str]:
     """
     >>> assert get_l_command_variations('a b c') == ['a b c', 'a b', 'a']
+    >>> assert get_l_command_variations('a  b') == ['a  b', 'a ', 'a']
+    >>> assert get_l_command_variations('a') == ['a']
+
+    """
+    return list(iter_command_variations(s_command))
+
+
+def iter_command_variations(s_command: str) -> Iterator[str]:
+    """
+    yields the command, and the command cut at each blank - from the longest to the shortest variation.
+    the blanks are searched backwards in one pass, and each variation is only created when it is requested.
+
+    >>> list(iter_command_variations('a b c'))
+    ['a b c', 'a b', 'a']
+    >>> # many blanks, like a java classpath or json parameters
+    >>> s_command = ' '.join(str(n) for n in range(10000))
+    >>> assert list(iter_command_variations(s_command)) == [s_command.rsplit(' ', n)[0] for n in range(10000)]
 
     """
-    l_command_variations = list()
-    for n_variation in range(s_command.count(" ") + 1):
-        l_command_variations.append(s_command.rsplit(' ', n_variation)[0])
-    return l_command_variations
+    yield s_command
+    position = s_command.rfind(' ')
+    while position >= 0:
+        yield s_command[:position]
+        position = s_command.rfind(' ', 0, position)
 
 
-def get_executable_file(l_command_variations: List[str], process: psutil.Process) -> str:
+def get_executable_file(l_command_variations: List[str], process: 'psutil.Process') -> str:
     """
+    >>> import lib_path
+    >>> import psutil
     >>> if lib_platform.get_is_platform_linux():
     ...     import getpass
     ...     import unittest
@@ -259,13 +479,92 @@ def get_executable_file(l_command_variations: List[str], process: psutil.Process
     ...         os.chdir(save_actual_directory)
 
     """
-    is_absolute_path = get_is_absolute_path(l_command_variations[0])
-    for command_variation in l_command_variations:
+    cwd = None if get_is_absolute_path(l_command_variations[0]) else process.cwd()
+    return _get_executable_file(l_command_variations, cwd)
+
+
+def _get_executable_file(command_variations: Iterable[str], cwd: Optional[str]) -> str:
+    """
+    returns the first command variation which exists as file or directory.
+    cwd : the working directory of the process, needed for relative paths
+
+    the first candidates are checked with os.path.exists. The further candidates of a long commandline (with blanks in
+    json parameters for instance) are checked against the listing of their directory first, each directory is listed only once -
+    so they do not cost a stat call each. Only a candidate found in the listing is checked with os.path.exists.
+
+    >>> import tempfile
+    >>> import unittest
+    >>> with tempfile.TemporaryDirectory() as temp_directory:
+    ...     os.mkdir(os.path.join(temp_directory, 'test test'))
+    ...     with open(os.path.join(temp_directory, 'test test', 'test test.sh'), 'w'):
+    ...         pass
+    ...     # absolute path, with pathological parameters
+    ...     s_executable = os.path.join(temp_directory, 'test test', 'test test.sh')
+    ...     s_command = s_executable + ' --json {"a": 1, "b": [1, 2, 3]}' + ' x' * 10000
+    ...     assert _get_executable_file(iter_command_variations(s_command), cwd=None) == s_executable
+    ...     # relative path
+    ...     s_command = 'test test/test test.sh' + ' -cp /opt/lib/a.jar:/opt/lib/b.jar' * 1000
+    ...     assert _get_executable_file(iter_command_variations(s_command), cwd=temp_directory) == 'test test/test test.sh'
+    ...     # the root directory has no name in its directory listing, it is checked with os.path.exists
+    ...     assert _get_executable_file(iter_command_variations('/ p1 p2'), cwd=None) == '/'
+    ...     # candidates longer than the maximum path length do not raise
+    ...     s_command = 'test test/test test.sh ' + '/x' * 10000
+    ...     assert _get_executable_file(iter_command_variations(s_command), cwd=temp_directory) == 'test test/test test.sh'
+    ...     # not existing
+    ...     unittest.TestCase().assertRaises(RuntimeError, _get_executable_file, iter_command_variations('test x/test.sh p1'), temp_directory)
+    >>> # the working directory is not known
+    >>> unittest.TestCase().assertRaises(RuntimeError, _get_executable_file, ['test test.sh p1'], None)
+
+    """
+    iter_variations = iter(command_variations)
+    s_command = next(iter_variations)
+    is_absolute_path = get_is_absolute_path(s_command)
+    if not is_absolute_path and cwd is None:
+        raise RuntimeError(f'can not parse the command line, the working directory of the process is unknown: "{s_command}"')
+
+    # the casefolded names in each directory, None if the directory can not be listed
+    directory_entries = dict()      # type: Dict[str, Optional[FrozenSet[str]]]
+    for n_variation, command_variation in enumerate(itertools.chain((s_command, ), iter_variations)):
         if is_absolute_path:
-            if pathlib.Path(command_variation).exists():
-                return command_variation
+            executable_path = command_variation
         else:
-            executable_path = pathlib.Path(process.cwd()) / command_variation
-            if executable_path.exists():
-                return command_variation
-    raise RuntimeError(f'can not parse the command line, maybe the executable not present anymore: "{l_command_variations[0]}"')
+            executable_path = os.path.join(cwd, command_variation)     # type: ignore
+        if n_variation >= _n_variations_checked_directly and not _get_is_in_directory_listing(executable_path, directory_entries):
+            continue
+        if os.path.exists(executable_path):
+            return command_variation
+    raise RuntimeError(f'can not parse the command line, maybe the executable not present anymore: "{s_command}"')
+
+
+def _get_is_in_directory_listing(path: str, directory_entries: Dict[str, Optional[FrozenSet[str]]]) -> bool:
+    """
+    returns False if the path is not in the listing of its directory, True if it is or we can not tell.
+    the names are compared casefolded, because the filesystem might be case insensitive - os.path.exists decides then.
+
+    >>> directory_entries = dict()      # type: Dict[str, Optional[FrozenSet[str]]]
+    >>> directory, name = os.path.split(os.path.abspath(__file__))
+    >>> _get_is_in_directory_listing(os.path.join(directory, name), directory_entries)
+    True
+    >>> _get_is_in_directory_listing(os.path.join(directory, name.upper()), directory_entries)
+    True
+    >>> _get_is_in_directory_listing(os.path.join(directory, 'not_existing'), directory_entries)
+    False
+
+    """
+    directory, name = os.path.split(path)
+    if not name or name in ('.', '..'):
+        return True
+    if len(name) > 255:
+        # longer than the maximum file name length of common filesystems - it is not casefolded for nothing
+        return False
+    if directory not in directory_entries:
+        try:
+            directory_entries[directory] = frozenset(entry.casefold() for entry in os.listdir(directory or '.'))
+        except PermissionError:
+            # we might be allowed to access the directory, but not to list it
+            directory_entries[directory] = None
+        except OSError:
+            # not existing, not a directory or the name is too long
+            directory_entries[directory] = frozenset()
+    entries = directory_entries[directory]
+    return entries is None or name.casefold() in entries
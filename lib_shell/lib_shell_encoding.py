@@ -0,0 +1,259 @@
+# STDLIB
+import codecs
+import locale
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+
+
+# the detected encodings per executable - only strict multibyte encodings are cached (see is_strict_encoding)
+_encoding_cache = dict()            # type: Dict[str, str]
+_encoding_cache_lock = threading.Lock()
+
+# This sets the locale for all categories to the user’s default setting (typically specified in the LANG environment variable).
+# it is done once on import, because setlocale is not thread safe - the decoding might happen first in a worker thread.
+locale.setlocale(locale.LC_ALL, '')
+
+# lib_detect_encoding is imported on first use - see get_lib_detect_encoding
+_lib_detect_encoding = None         # type: Any
+_lib_detect_encoding_lock = threading.Lock()
+
+
+def get_lib_detect_encoding() -> Any:
+    """
+    imports lib_detect_encoding on first use, so importing lib_shell stays cheap.
+
+    >>> assert get_lib_detect_encoding() is get_lib_detect_encoding()
+
+    """
+    global _lib_detect_encoding
+    if _lib_detect_encoding is None:
+        with _lib_detect_encoding_lock:
+            if _lib_detect_encoding is None:
+                import lib_detect_encoding
+                _lib_detect_encoding = lib_detect_encoding
+    return _lib_detect_encoding
+
+
+def get_system_preferred_encoding() -> str:
+    """
+    >>> assert get_system_preferred_encoding()
+
+    """
+    return str(get_lib_detect_encoding().get_system_preferred_encoding())
+
+
+def decode_stdout_stderr(stdout: bytes, stderr: bytes, executable: str = '') -> Tuple[str, str, str]:
+    """
+    decodes stdout and stderr and returns the decoded strings and the encoding used.
+    the encoding is detected from a prefix of the output (conf_lib_shell.encoding_detection_sample_size bytes of each pipe),
+    and cached per executable - if the cached encoding does not fit the prefix, the encoding is detected again.
+    the encoding is chosen on the prefix, so the output is decoded once - twice only if the output does not fit after the prefix.
+    a single byte encoding like cp1252 decodes any output, so it is never cached - a later utf-8 output would be garbled.
+
+    >>> decode_stdout_stderr(b'test', b'error')
+    ('test', 'error', 'utf-8')
+
+    >>> # test the cache per executable
+    >>> clear_encoding_cache()
+    >>> decode_stdout_stderr('mäßig'.encode('utf-8'), b'', executable='test_executable')
+    ('mäßig', '', 'utf-8')
+    >>> assert get_cached_encoding('test_executable') == 'utf-8'
+    >>> decode_stdout_stderr('mäßig'.encode('utf-8'), b'', executable='test_executable')
+    ('mäßig', '', 'utf-8')
+
+    >>> # test the cached encoding is checked against the prefix
+    >>> stdout, stderr, encoding = decode_stdout_stderr('mäßig'.encode('utf-16'), b'', executable='test_executable')
+    >>> assert encoding != 'utf-8'
+    >>> clear_encoding_cache()
+
+    >>> # test a single byte encoding is not cached
+    >>> set_cached_encoding('test_executable', 'cp1252')
+    >>> get_cached_encoding('test_executable') is None
+    True
+
+    >>> # test empty output, no detection needed
+    >>> decode_stdout_stderr(b'', b'')
+    ('', '', '')
+
+    """
+    if not stdout and not stderr:
+        return '', '', ''
+
+    encoding = get_cached_encoding(executable)
+    if not encoding or not _get_is_prefix_decodable(stdout, stderr, encoding):
+        encoding = detect_encoding(get_sample(stdout, stderr))
+    try:
+        stdout_str = stdout.decode(encoding)
+        stderr_str = stderr.decode(encoding)
+        set_cached_encoding(executable, encoding)
+    # on Wine, we might get Windows encoded response
+    except UnicodeDecodeError:
+        encoding = get_lib_detect_encoding().get_system_preferred_encoding_windows()
+        stdout_str = stdout.decode(encoding)
+        stderr_str = stderr.decode(encoding)
+    return stdout_str, stderr_str, encoding
+
+
+def _get_is_prefix_decodable(stdout: bytes, stderr: bytes, encoding: str) -> bool:
+    # the prefixes might end within a character - the incremental decoder keeps the incomplete character instead of failing
+    sample_size = conf_lib_shell.encoding_detection_sample_size
+    try:
+        for data in (stdout, stderr):
+            codecs.getincrementaldecoder(encoding)().decode(data[:sample_size], final=len(data) <= sample_size)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    detects the encoding of a sample of the output. If the sample is pure ascii, we assume utf-8,
+    because the rest of the output might contain non-ascii characters and utf-8 is a superset of ascii.
+
+    >>> detect_encoding(b'test')
+    'utf-8'
+    >>> detect_encoding('mäßig'.encode('utf-8'))
+    'utf-8'
+
+    """
+    encoding = get_lib_detect_encoding().get_file_encoding(sample)
+    if not encoding or codecs.lookup(encoding).name == 'ascii':
+        encoding = 'utf-8'
+    return str(encoding)
+
+
+def get_sample(stdout: bytes, stderr: bytes) -> bytes:
+    """
+    returns the prefix of stdout and stderr to detect the encoding from.
+    if the prefix cuts a multibyte character, the incomplete character at the end is removed.
+
+    >>> get_sample(b'test', b'error')
+    b'testerror'
+    >>> sample_size = conf_lib_shell.encoding_detection_sample_size
+    >>> stdout = b'a' * (sample_size - 1) + 'ä'.encode('utf-8')
+    >>> assert get_sample(stdout, b'') == b'a' * (sample_size - 1)
+    >>> stdout = b'a' * (sample_size - 2) + 'ä'.encode('utf-8') + b'a'
+    >>> assert get_sample(stdout, b'') == stdout[:sample_size]
+
+    """
+    sample_size = conf_lib_shell.encoding_detection_sample_size
+    l_samples = list()      # type: List[bytes]
+    for data in (stdout, stderr):
+        sample = data[:sample_size]
+        if len(data) > sample_size:
+            sample = _strip_incomplete_utf8_character(sample)
+        l_samples.append(sample)
+    return b''.join(l_samples)
+
+
+def _strip_incomplete_utf8_character(sample: bytes) -> bytes:
+    # a utf-8 character has at most 4 bytes, the lead byte has the bits 11xxxxxx, continuation bytes 10xxxxxx
+    for n_position in range(1, min(4, len(sample)) + 1):
+        byte = sample[-n_position]
+        if byte & 0xC0 == 0xC0:
+            n_character_length = 4 if byte >= 0xF0 else 3 if byte >= 0xE0 else 2
+            if n_position < n_character_length:
+                return sample[:-n_position]
+            break
+        if byte & 0x80 == 0:
+            break
+    return sample
+
+
+def get_incremental_decoder(first_chunk: bytes, executable: str = '', errors: str = 'replace') -> Tuple[Any, str]:
+    """
+    returns an incremental decoder for a pipe and its encoding - the encoding is the cached encoding of the executable,
+    if the first chunk read from the pipe decodes with it, otherwise detected from the first chunk.
+
+    >>> decoder, encoding = get_incremental_decoder('mäßig'.encode('utf-8'))
+    >>> encoding
+    'utf-8'
+    >>> decoder.decode('mä'.encode('utf-8')[:2])
+    'm'
+    >>> decoder.decode('mä'.encode('utf-8')[2:], final=True)
+    'ä'
+
+    >>> # test the cached encoding is checked against the first chunk
+    >>> set_cached_encoding('test_executable', 'utf-8')
+    >>> get_incremental_decoder('mäßig'.encode('cp1252'), executable='test_executable')[1] != 'utf-8'
+    True
+    >>> clear_encoding_cache()
+
+    """
+    sample = get_sample(first_chunk, b'')
+    encoding = get_cached_encoding(executable)
+    if encoding:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample)
+        except UnicodeDecodeError:
+            encoding = None
+    if not encoding:
+        encoding = detect_encoding(sample)
+    return codecs.getincrementaldecoder(encoding)(errors=errors), encoding
+
+
+def get_cached_encoding(executable: str) -> Optional[str]:
+    if not executable or not conf_lib_shell.encoding_cache_enabled:
+        return None
+    return _encoding_cache.get(executable)
+
+
+def set_cached_encoding(executable: str, encoding: str) -> None:
+    """ caches the encoding of the executable - encodings which are not strict (see is_strict_encoding) are not cached """
+    if not executable or not conf_lib_shell.encoding_cache_enabled or not is_strict_encoding(encoding):
+        return
+    with _encoding_cache_lock:
+        _encoding_cache[executable] = encoding
+
+
+def clear_encoding_cache() -> None:
+    with _encoding_cache_lock:
+        _encoding_cache.clear()
+
+
+def is_strict_encoding(encoding: str) -> bool:
+    """
+    returns True for the utf-8, utf-16 and utf-32 encodings - they reject most output which is encoded differently.
+    single byte encodings like cp1252 or latin-1 decode any output without an error, so a mismatch would go unnoticed.
+
+    >>> is_strict_encoding('UTF8'), is_strict_encoding('utf-16-le'), is_strict_encoding('cp1252'), is_strict_encoding('unknown')
+    (True, True, False, False)
+
+    """
+    try:
+        codec_name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+    return codec_name.startswith(('utf-8', 'utf-16', 'utf-32'))
+
+
+def get_executable_key(ls_command: List[str], use_sudo: bool = False, run_as_user: str = '') -> str:
+    """
+    returns the executable of the command, used as key for the encoding cache.
+    the same executable might use another locale for another user, so sudo and the user are part of the key.
+
+    >>> get_executable_key(['echo', 'test'])
+    'echo'
+    >>> get_executable_key(['echo test'])
+    'echo'
+    >>> get_executable_key(['echo', 'test'], use_sudo=True, run_as_user='www-data')
+    'sudo:www-data:echo'
+    >>> get_executable_key([])
+    ''
+
+    """
+    if not ls_command:
+        return ''
+    executable = str(ls_command[0]).strip().split(' ', 1)[0]
+    if use_sudo or run_as_user:
+        executable = ':'.join(('sudo' if use_sudo else '', run_as_user, executable))
+    return executable
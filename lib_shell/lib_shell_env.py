@@ -0,0 +1,95 @@
+# STDLIB
+import os
+import threading
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
+
+
+# the environment for the child processes, rebuilt only if os.environ changed - read only, because it is shared
+_env_template = MappingProxyType(dict())    # type: Mapping[str, str]
+# the snapshot of os.environ the template was built from, None if not built yet
+_env_template_source = None                 # type: Optional[Dict[str, str]]
+_env_template_version = 0           # type: int
+_env_template_lock = threading.Lock()
+
+# the environment variables set for every child process - we force utf-8 encoding for python subprocesses
+python_io_encoding_env = {'PYTHONIOENCODING': 'utf-8', 'PYTHONLEGACYWINDOWSIOENCODING': 'utf-8'}   # type: Dict[str, str]
+
+
+def get_env_template() -> Mapping[str, str]:
+    """
+    returns the environment for child processes : a copy of os.environ with python_io_encoding_env applied.
+    the template is cached, and rebuilt only if os.environ changed since the last call.
+    The returned mapping is shared and read only - use get_env_with_overrides to change variables.
+
+    >>> env_template = get_env_template()
+    >>> assert env_template['PYTHONIOENCODING'] == 'utf-8'
+    >>> assert get_env_template() is env_template
+    >>> import operator
+    >>> import unittest
+    >>> unittest.TestCase().assertRaises(TypeError, operator.setitem, env_template, 'LIB_SHELL_TEST_ENV', 'test')
+    >>> env_template_version = get_env_template_version()
+
+    >>> # the template is rebuilt if os.environ changed
+    >>> os.environ['LIB_SHELL_TEST_ENV'] = 'test'
+    >>> assert get_env_template()['LIB_SHELL_TEST_ENV'] == 'test'
+    >>> assert get_env_template_version() == env_template_version + 1
+    >>> del os.environ['LIB_SHELL_TEST_ENV']
+    >>> assert 'LIB_SHELL_TEST_ENV' not in get_env_template()
+
+    """
+    global _env_template, _env_template_source, _env_template_version
+    environ = dict(os.environ)
+    if environ == _env_template_source:
+        return _env_template
+    with _env_template_lock:
+        if environ != _env_template_source:
+            env_template = dict(environ)
+            env_template.update(python_io_encoding_env)
+            # the template is published before the source, so a concurrent reader never gets an outdated template
+            _env_template = MappingProxyType(env_template)
+            _env_template_source = environ
+            _env_template_version = _env_template_version + 1
+    return _env_template
+
+
+def get_env_template_version() -> int:
+    """ returns the version of the env template, it is incremented each time the template is rebuilt """
+    return _env_template_version
+
+
+def get_env_with_overrides(env: Optional[Mapping[str, str]] = None, env_overrides: Optional[Mapping[str, Optional[str]]] = None) -> Mapping[str, str]:
+    """
+    returns the environment for a child process
+    env           : the complete environment, instead of os.environ - python_io_encoding_env is added if not set
+    env_overrides : variables to set or (with value None) to remove, applied on top of env or os.environ
+
+    without env and env_overrides, the shared and read only env template is returned, otherwise a new dict.
+
+    >>> assert get_env_with_overrides() is get_env_template()
+    >>> env = get_env_with_overrides(env={'TEST': 'test', 'PYTHONIOENCODING': 'latin-1'})
+    >>> assert env == {'TEST': 'test', 'PYTHONIOENCODING': 'latin-1', 'PYTHONLEGACYWINDOWSIOENCODING': 'utf-8'}
+    >>> env = get_env_with_overrides(env={'TEST': 'test', 'TEST2': 'test2'}, env_overrides={'TEST': None, 'TEST3': 'test3'})
+    >>> assert env['TEST3'] == 'test3' and 'TEST' not in env and 'TEST2' in env
+    >>> env = get_env_with_overrides(env_overrides={'LIB_SHELL_TEST_ENV': 'test'})
+    >>> assert env['LIB_SHELL_TEST_ENV'] == 'test'
+    >>> assert 'LIB_SHELL_TEST_ENV' not in get_env_template()
+
+    """
+    if env is None and not env_overrides:
+        return get_env_template()
+
+    if env is None:
+        my_env = dict(get_env_template())
+    else:
+        my_env = dict(env)
+        for key, value in python_io_encoding_env.items():
+            my_env.setdefault(key, value)
+
+    if env_overrides:
+        for key, value in env_overrides.items():
+            if value is None:
+                my_env.pop(key, None)
+            else:
+                my_env[key] = str(value)
+    return my_env
@@ -1,5 +1,6 @@
 # STDLIB
 import getpass
+import subprocess
 from typing import List
 
 # PROJ
@@ -59,3 +60,43 @@ def get_current_username() -> str:
     """
     username = getpass.getuser()
     return username
+
+
+def kill_process_tree(process: subprocess.Popen) -> None:     # type: ignore
+    """
+    kills the process and all its descendants - processes which are gone already, or which we are not allowed to kill
+    (like children started with sudo) are skipped. The process is not waited for.
+
+    >>> import sys
+    >>> program = 'import subprocess, sys, time; subprocess.Popen([sys.executable, "-c", "import time; time.sleep(10)"]); time.sleep(10)'
+    >>> process = subprocess.Popen([sys.executable, '-c', program])
+    >>> import time
+    >>> time.sleep(0.5)
+    >>> import psutil
+    >>> children = psutil.Process(process.pid).children(recursive=True)
+    >>> kill_process_tree(process)
+    >>> assert process.wait() != 0
+    >>> gone, alive = psutil.wait_procs(children, timeout=5)
+    >>> assert not alive
+
+    """
+    # imported here, to keep the import of lib_shell cheap
+    import psutil   # type: ignore
+
+    # we collect the descendants first - after the parent is killed, they are reparented and can not be found anymore
+    try:
+        l_processes = psutil.Process(process.pid).children(recursive=True)
+    except psutil.Error:
+        l_processes = list()
+
+    try:
+        process.kill()
+    except OSError:     # pragma: no cover
+        # we are not allowed to kill the process, for instance if it runs with sudo
+        pass
+
+    for child_process in l_processes:
+        try:
+            child_process.kill()
+        except psutil.Error:    # pragma: no cover
+            pass
@@ -0,0 +1,266 @@
+# STDLIB
+import bisect
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# the events and the keyword arguments passed to the hooks - ls_command is the command as passed by the caller, without sudo :
+# pre_spawn       : ls_command, executable                       - before the process is started
+# post_spawn      : ls_command, executable, process              - after the process was started
+# on_output_chunk : ls_command, executable, pipe_name, chunk     - for each chunk of output read, pipe_name is 'stdout' or 'stderr'
+# on_complete     : ls_command, executable, response             - after the last attempt of a command, before an exception is raised,
+#                                                                  or when the response is served from the result cache (response.from_cache)
+# on_retry        : ls_command, executable, response, attempt, delay - before a failed attempt is retried after delay seconds
+hook_events = ('pre_spawn', 'post_spawn', 'on_output_chunk', 'on_complete', 'on_retry')
+
+# the upper bounds of the latency histogram buckets in seconds
+default_latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class ShellCommandHooks(object):
+    """
+    a registry of callables, which are called on the events of each command run by run_shell_command / run_shell_ls_command.
+    the hooks get keyword arguments only (see hook_events) - they should accept **kwargs, so further arguments can be added later.
+    the hooks are called in the thread which runs the command, in the order they were registered.
+    an exception raised by a hook is logged and otherwise ignored, so instrumentation can not break a command.
+
+    the callables of an event are kept as tuple, which is replaced on change - so the hot path needs no lock,
+    and without hooks registered an event costs only a dict lookup.
+
+    >>> l_events = list()
+    >>> hooks = ShellCommandHooks()
+    >>> hook = hooks.register('pre_spawn', lambda **kwargs: l_events.append(kwargs['executable']))
+    >>> hooks.get_has_hooks('pre_spawn'), hooks.get_has_hooks('post_spawn')
+    (True, False)
+    >>> hooks.call('pre_spawn', ls_command=['echo', 'test'], executable='echo')
+    >>> l_events
+    ['echo']
+    >>> # an exception in a hook is logged, and not raised
+    >>> hook_failing = hooks.register('pre_spawn', lambda **kwargs: 1 / 0)
+    >>> hooks.call('pre_spawn', ls_command=['echo', 'test'], executable='echo')
+    >>> l_events
+    ['echo', 'echo']
+    >>> hooks.unregister('pre_spawn', hook)
+    >>> hooks.clear()
+    >>> hooks.get_has_hooks('pre_spawn')
+    False
+
+    >>> import unittest
+    >>> unittest.TestCase().assertRaises(ValueError, hooks.register, 'unknown', hook)
+
+    """
+    def __init__(self) -> None:
+        self._hooks = {event: tuple() for event in hook_events}   # type: Dict[str, Tuple[Callable[..., Any], ...]]
+        self._lock = threading.Lock()
+
+    def register(self, event: str, hook: Callable[..., Any]) -> Callable[..., Any]:
+        """ registers the hook for the event, and returns the hook """
+        self._check_event(event)
+        with self._lock:
+            self._hooks[event] = self._hooks[event] + (hook, )
+        return hook
+
+    def unregister(self, event: str, hook: Callable[..., Any]) -> None:
+        """ removes the hook from the event - hooks which are not registered are ignored """
+        self._check_event(event)
+        with self._lock:
+            self._hooks[event] = tuple(registered_hook for registered_hook in self._hooks[event] if registered_hook is not hook)
+
+    def clear(self) -> None:
+        """ removes all hooks """
+        with self._lock:
+            self._hooks = {event: tuple() for event in hook_events}
+
+    def get_has_hooks(self, event: str) -> bool:
+        """ returns True if hooks are registered for the event - check that before building expensive arguments """
+        return bool(self._hooks[event])
+
+    def call(self, event: str, **kwargs: Any) -> None:
+        """ calls the hooks of the event with the keyword arguments """
+        for hook in self._hooks[event]:
+            try:
+                hook(**kwargs)
+            except Exception:   # noqa - a failing hook must not break the command
+                logger.warning(f'the hook {hook!r} for the event "{event}" failed', exc_info=True)
+
+    def get_output_chunk_callback(self, **kwargs: Any) -> Optional[Callable[[str, bytes], None]]:
+        """
+        returns a callable(pipe_name, chunk), which calls the on_output_chunk hooks with the keyword arguments,
+        pipe_name and chunk - or None if no hooks are registered for on_output_chunk
+
+        >>> hooks = ShellCommandHooks()
+        >>> assert hooks.get_output_chunk_callback(ls_command=['echo', 'test'], executable='echo') is None
+        >>> hook = hooks.register('on_output_chunk', lambda **kwargs: print(kwargs['pipe_name'], kwargs['chunk']))
+        >>> hooks.get_output_chunk_callback(ls_command=['echo', 'test'], executable='echo')('stdout', b'test')
+        stdout b'test'
+
+        """
+        if not self.get_has_hooks('on_output_chunk'):
+            return None
+
+        def on_output_chunk(pipe_name: str, chunk: bytes) -> None:
+            self.call('on_output_chunk', pipe_name=pipe_name, chunk=chunk, **kwargs)
+        return on_output_chunk
+
+    @staticmethod
+    def _check_event(event: str) -> None:
+        if event not in hook_events:
+            raise ValueError(f'unknown hook event "{event}", valid events are {hook_events}')
+
+
+# the hooks called by run_shell_command and run_shell_ls_command
+shell_command_hooks = ShellCommandHooks()
+
+
+class ShellExecutableMetrics(object):
+    """
+    the metrics of the commands of one executable, collected by ShellMetricsCollector
+
+    count               : the number of commands completed
+    failures            : the number of commands completed with returncode not zero
+    timeouts            : the number of commands killed, because the timeout or the deadline was reached
+    retries             : the number of attempts retried
+    cache_hits          : the number of commands served from the result cache - counted in count, but not in the latency and the bytes
+    latency_sum         : the sum of the latency of all commands in seconds - the durations of all attempts, without the delays between them
+    latency_buckets     : the upper bounds of the histogram buckets in seconds
+    latency_counts      : the number of commands per bucket (not cumulative), the last element counts the commands above the last bound
+    stdout_bytes        : the number of bytes read from stdout, by all attempts
+    stderr_bytes        : the number of bytes read from stderr, by all attempts
+
+    >>> metrics = ShellExecutableMetrics(latency_buckets=(0.1, 1.0))
+    >>> for latency in (0.05, 0.5, 0.5, 5):
+    ...     metrics.observe_latency(latency)
+    >>> metrics.get_latency_histogram()
+    [(0.1, 1), (1.0, 3), (inf, 4)]
+
+    """
+    def __init__(self, latency_buckets: Sequence[float] = default_latency_buckets) -> None:
+        self.count = 0                                              # type: int
+        self.failures = 0                                           # type: int
+        self.timeouts = 0                                           # type: int
+        self.retries = 0                                            # type: int
+        self.cache_hits = 0                                         # type: int
+        self.latency_sum = 0.0                                      # type: float
+        self.latency_buckets = tuple(sorted(latency_buckets))       # type: Tuple[float, ...]
+        self.latency_counts = [0] * (len(self.latency_buckets) + 1)  # type: List[int]
+        self.stdout_bytes = 0                                       # type: int
+        self.stderr_bytes = 0                                       # type: int
+
+    def observe_latency(self, latency: float) -> None:
+        self.latency_sum = self.latency_sum + latency
+        self.latency_counts[bisect.bisect_left(self.latency_buckets, latency)] += 1
+
+    def get_latency_histogram(self) -> List[Tuple[float, int]]:
+        """ returns the cumulative histogram as list of (upper bound, count) - like prometheus, the last bound is infinity """
+        l_histogram = list()    # type: List[Tuple[float, int]]
+        cumulative_count = 0
+        for upper_bound, count in zip(self.latency_buckets + (float('inf'), ), self.latency_counts):
+            cumulative_count = cumulative_count + count
+            l_histogram.append((upper_bound, cumulative_count))
+        return l_histogram
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'count': self.count,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'retries': self.retries,
+                'cache_hits': self.cache_hits,
+                'latency_sum': self.latency_sum,
+                'latency_histogram': self.get_latency_histogram(),
+                'stdout_bytes': self.stdout_bytes,
+                'stderr_bytes': self.stderr_bytes}
+
+
+class ShellMetricsCollector(object):
+    """
+    collects in-process metrics per executable (see ShellExecutableMetrics) from the hooks on_complete and on_retry.
+    get_metrics returns a snapshot as plain dicts, which can be fed into an exporter (like prometheus_client).
+
+    >>> collector = ShellMetricsCollector(latency_buckets=(0.1, 1.0), hooks=ShellCommandHooks())
+    >>> collector.register()
+    >>> class Response(object):
+    ...     returncode = 1
+    ...     timed_out = False
+    ...     attempt_durations = [0.5, 0.25]
+    ...     class resource_usage(object):
+    ...         wall_time = 0.25
+    ...         stdout_size = 4
+    ...         stderr_size = 2
+    >>> collector.hooks.call('on_retry', ls_command=['false'], executable='false', response=Response(), attempt=1, delay=0.0)
+    >>> collector.hooks.call('on_complete', ls_command=['false'], executable='false', response=Response())
+    >>> metrics = collector.get_metrics()['false']
+    >>> metrics['count'], metrics['failures'], metrics['retries'], metrics['latency_sum'], metrics['stdout_bytes']
+    (1, 1, 1, 0.75, 8)
+    >>> metrics['latency_histogram']
+    [(0.1, 0), (1.0, 1), (inf, 1)]
+    >>> collector.unregister()
+    >>> collector.reset()
+    >>> collector.get_metrics()
+    {}
+
+    """
+    def __init__(self, latency_buckets: Sequence[float] = default_latency_buckets, hooks: Optional[ShellCommandHooks] = None) -> None:
+        if hooks is None:
+            hooks = shell_command_hooks
+        self.latency_buckets = tuple(latency_buckets)               # type: Tuple[float, ...]
+        self.hooks = hooks                                          # type: ShellCommandHooks
+        self._metrics = dict()                                      # type: Dict[str, ShellExecutableMetrics]
+        self._lock = threading.Lock()
+
+    def register(self) -> None:
+        """ registers the collector on the hooks """
+        self.hooks.register('on_complete', self.on_complete)
+        self.hooks.register('on_retry', self.on_retry)
+
+    def unregister(self) -> None:
+        self.hooks.unregister('on_complete', self.on_complete)
+        self.hooks.unregister('on_retry', self.on_retry)
+
+    def on_complete(self, executable: str, response: Any, **kwargs: Any) -> None:
+        if getattr(response, 'from_cache', False):
+            with self._lock:
+                metrics = self._get_executable_metrics(executable)
+                metrics.count = metrics.count + 1
+                metrics.cache_hits = metrics.cache_hits + 1
+            return
+        resource_usage = response.resource_usage
+        # the latency the caller observed, over all attempts - the wall time of the only attempt otherwise
+        latency = sum(response.attempt_durations) if response.attempt_durations else resource_usage.wall_time
+        with self._lock:
+            metrics = self._get_executable_metrics(executable)
+            metrics.count = metrics.count + 1
+            if response.returncode != 0:
+                metrics.failures = metrics.failures + 1
+            if response.timed_out:
+                metrics.timeouts = metrics.timeouts + 1
+            metrics.observe_latency(latency)
+            metrics.stdout_bytes = metrics.stdout_bytes + resource_usage.stdout_size
+            metrics.stderr_bytes = metrics.stderr_bytes + resource_usage.stderr_size
+
+    def on_retry(self, executable: str, response: Any, **kwargs: Any) -> None:
+        # the output of the attempt retried - the output of the last attempt is counted in on_complete
+        resource_usage = response.resource_usage
+        with self._lock:
+            metrics = self._get_executable_metrics(executable)
+            metrics.retries = metrics.retries + 1
+            metrics.stdout_bytes = metrics.stdout_bytes + resource_usage.stdout_size
+            metrics.stderr_bytes = metrics.stderr_bytes + resource_usage.stderr_size
+
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """ returns a snapshot of the metrics per executable """
+        with self._lock:
+            return {executable: metrics.as_dict() for executable, metrics in self._metrics.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._metrics = dict()
+
+    def _get_executable_metrics(self, executable: str) -> ShellExecutableMetrics:
+        metrics = self._metrics.get(executable)
+        if metrics is None:
+            metrics = ShellExecutableMetrics(latency_buckets=self.latency_buckets)
+            self._metrics[executable] = metrics
+        return metrics
@@ -0,0 +1,194 @@
+# STDLIB
+import collections.abc
+import io
+import os
+import subprocess
+import threading
+from typing import Any, BinaryIO, Iterable, Iterator, Optional, Union
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from . import lib_shell_pass_output         # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    import lib_shell_pass_output                # type: ignore # pragma: no cover
+
+
+# str input is encoded like the output of python child processes - see lib_shell_env.python_io_encoding_env
+input_encoding = 'utf-8'
+
+
+class ShellCommandInput(object):
+    """
+    the input fed to stdin of a command :
+
+    None                           : no input - stdin is a pipe which is closed without data, like before
+    bytes, str                     : written to the process with communicate, str is encoded with input_encoding
+    os.PathLike (pathlib.Path)     : the file is opened and passed as stdin of the process - the data is not copied through python
+    seekable file with fileno()    : passed as stdin of the process, the process reads from the current position of the file
+    other file objects             : read in chunks of lib_shell_pass_output.chunk_size, and written to the process by a thread
+    iterable of bytes or str       : written to the process by a thread, chunk by chunk
+
+    the thread blocks on the pipe if the process does not read - so the chunks are read from the iterable or the file
+    only as fast as the process consumes them, and the input is never held in memory as a whole.
+    iterators and not seekable files can be consumed only once - is_replayable is False then, and the command is not retried.
+
+    >>> shell_input = ShellCommandInput(['a', b'b'])
+    >>> shell_input.is_replayable, shell_input.get_has_input()
+    (True, True)
+    >>> ShellCommandInput(iter([b'test'])).is_replayable
+    False
+    >>> ShellCommandInput(None).get_has_input()
+    False
+
+    >>> import unittest
+    >>> unittest.TestCase().assertRaises(TypeError, ShellCommandInput, 1)
+
+    """
+    def __init__(self, input: Any = None) -> None:
+        # the data written with communicate
+        self.data = None                    # type: Optional[bytes]
+        # the file opened and passed as stdin
+        self.path = None                    # type: Optional[str]
+        # the file passed as stdin, and the position the process reads from
+        self.file = None                    # type: Optional[BinaryIO]
+        self.file_position = 0              # type: int
+        # the chunks written to stdin by a thread
+        self.chunks = None                  # type: Optional[Iterable[Union[bytes, str]]]
+        self.is_replayable = True           # type: bool
+        # the file opened from path, it is closed after the process was started
+        self._path_file = None              # type: Optional[BinaryIO]
+        self._writer = None                 # type: Optional[threading.Thread]
+        self._writer_exception = None       # type: Optional[BaseException]
+
+        if input is None:
+            pass
+        elif isinstance(input, (bytes, bytearray, memoryview)):
+            self.data = bytes(input)
+        elif isinstance(input, str):
+            self.data = input.encode(input_encoding)
+        elif isinstance(input, os.PathLike):
+            self.path = os.fspath(input)
+        elif hasattr(input, 'read'):
+            if _get_is_seekable_file_with_fileno(input):
+                self.file = input
+                self.file_position = input.tell()
+            else:
+                self.chunks = _iter_file_chunks(input)
+                self.is_replayable = False
+        elif isinstance(input, collections.abc.Iterable):
+            self.chunks = input
+            self.is_replayable = not isinstance(input, collections.abc.Iterator)
+        else:
+            raise TypeError(f'the input must be bytes, str, a path, a file or an iterable of bytes or str, not {type(input).__name__}')
+
+    def get_has_input(self) -> bool:
+        return self.data is not None or self.path is not None or self.file is not None or self.chunks is not None
+
+    def get_popen_stdin(self) -> Any:
+        """ returns stdin for subprocess.Popen - for each attempt, files are read from the start position again """
+        if self.path is not None:
+            self._path_file = open(self.path, mode='rb')
+            return self._path_file
+        if self.file is not None:
+            # the file descriptor is shared with the process - a buffered file might have read ahead of its position
+            self.file.seek(self.file_position)
+            os.lseek(self.file.fileno(), self.file_position, os.SEEK_SET)
+            return self.file
+        return subprocess.PIPE
+
+    def start(self, process: subprocess.Popen, communicate: bool) -> Optional[bytes]:     # type: ignore
+        """
+        called after the process was started - closes the file opened for the process, and starts the thread writing the chunks.
+        if communicate is True, the data is returned to be passed to process.communicate, otherwise it is written by the thread.
+        the thread owns stdin of the process then, process.stdin is set to None - so communicate does not touch it.
+        """
+        self.close()
+        if process.stdin is None:
+            return None
+        if self.data is not None and communicate:
+            return self.data
+        if self.data is not None:
+            chunks = [self.data]            # type: Iterable[Union[bytes, str]]
+        elif self.chunks is not None:
+            chunks = self.chunks
+        else:
+            return None
+        stdin_pipe = process.stdin
+        process.stdin = None
+        self._writer_exception = None
+        self._writer = threading.Thread(target=self._write_chunks, args=(stdin_pipe, chunks), name='lib_shell_input_writer', daemon=True)
+        self._writer.start()
+        return None
+
+    def join(self) -> None:
+        """ waits until all chunks are written, and raises the exception raised while reading the chunks - call it after the process ended """
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        if self._writer_exception is not None:
+            exception, self._writer_exception = self._writer_exception, None
+            raise exception
+
+    def close(self) -> None:
+        """ closes the file opened from path - the process has its own file descriptor """
+        if self._path_file is not None:
+            self._path_file.close()
+            self._path_file = None
+
+    def _write_chunks(self, stdin_pipe: BinaryIO, chunks: Iterable[Union[bytes, str]]) -> None:
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode(input_encoding)
+                try:
+                    stdin_pipe.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the process exited (or was killed) without reading all input - like subprocess.communicate
+                    return
+        except BaseException as exc:     # noqa - raised in the calling thread by join
+            self._writer_exception = exc
+        finally:
+            try:
+                stdin_pipe.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+
+def get_shell_command_input(input: Any) -> ShellCommandInput:
+    """
+    returns the input as ShellCommandInput - a ShellCommandInput is returned as it is
+
+    >>> shell_input = get_shell_command_input(b'test')
+    >>> assert get_shell_command_input(shell_input) is shell_input
+
+    """
+    if isinstance(input, ShellCommandInput):
+        return input
+    return ShellCommandInput(input)
+
+
+def _get_is_seekable_file_with_fileno(input_file: Any) -> bool:
+    """
+    >>> import tempfile
+    >>> with tempfile.TemporaryFile() as test_file:
+    ...     assert _get_is_seekable_file_with_fileno(test_file)
+    >>> assert not _get_is_seekable_file_with_fileno(io.BytesIO(b'test'))
+
+    """
+    try:
+        input_file.fileno()
+        return bool(input_file.seekable())
+    except (AttributeError, OSError, ValueError):
+        # io.UnsupportedOperation is an OSError and a ValueError
+        return False
+
+
+def _iter_file_chunks(input_file: Any) -> Iterator[Union[bytes, str]]:
+    while True:
+        chunk = input_file.read(lib_shell_pass_output.chunk_size)
+        if not chunk:
+            break
+        yield chunk
@@ -0,0 +1,360 @@
+# STDLIB
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# OWN
+import lib_platform
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+    from . import lib_shell                     # type: ignore # pragma: no cover
+    from . import lib_shell_encoding            # type: ignore # pragma: no cover
+    from . import lib_shell_env                 # type: ignore # pragma: no cover
+    from . import lib_shell_helpers             # type: ignore # pragma: no cover
+    from . import lib_shell_hooks               # type: ignore # pragma: no cover
+    from . import lib_shell_input               # type: ignore # pragma: no cover
+    from . import lib_shell_log                 # type: ignore # pragma: no cover
+    from . import lib_shell_reaper              # type: ignore # pragma: no cover
+    from . import lib_shell_resource            # type: ignore # pragma: no cover
+    from . import lib_shell_shlex               # type: ignore # pragma: no cover
+    from . import lib_shell_spawn               # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+    import lib_shell                            # type: ignore # pragma: no cover
+    import lib_shell_encoding                   # type: ignore # pragma: no cover
+    import lib_shell_env                        # type: ignore # pragma: no cover
+    import lib_shell_helpers                    # type: ignore # pragma: no cover
+    import lib_shell_hooks                      # type: ignore # pragma: no cover
+    import lib_shell_input                      # type: ignore # pragma: no cover
+    import lib_shell_log                        # type: ignore # pragma: no cover
+    import lib_shell_reaper                     # type: ignore # pragma: no cover
+    import lib_shell_resource                   # type: ignore # pragma: no cover
+    import lib_shell_shlex                      # type: ignore # pragma: no cover
+    import lib_shell_spawn                      # type: ignore # pragma: no cover
+
+
+class ShellJob(lib_shell_reaper.WatchedProcess):
+    """
+    a command running in the background - the output is collected, and the process is reaped by
+    lib_shell_reaper.shell_process_reaper as soon as it exited, even if nobody waits for the job.
+
+    poll()        : the returncode, or None while the job is running
+    wait()        : waits for the job and returns the returncode
+    kill()        : kills the process and all its descendants
+    read_output() : the output collected since the last call - that output is released, and not part of the response
+    get_response(): waits for the job, and returns the ShellCommandResponse with the output not read by read_output
+                    the on_complete hooks get that response when the job completes, with the output not read until then
+
+    the job is complete when the process was reaped, and stdout and stderr are closed.
+    ls_command is the command as started (with sudo), hook_ls_command the command passed to the hooks (as passed by the caller).
+
+    """
+    report_pipes_not_closed = True              # type: bool
+
+    def __init__(self,
+                 ls_command: List[str],
+                 process: subprocess.Popen,     # type: ignore
+                 executable: str = '',
+                 decode: bool = True,
+                 log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                 timeout: Optional[float] = None,
+                 shell_input: Optional[lib_shell_input.ShellCommandInput] = None,
+                 resource_usage: Optional[lib_shell_resource.ShellCommandResourceUsage] = None,
+                 start_time: float = 0.0,
+                 hook_ls_command: Optional[List[str]] = None) -> None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        super().__init__(process=process, deadline=deadline)
+        self.ls_command = ls_command                    # type: List[str]
+        self.hook_ls_command = ls_command if hook_ls_command is None else hook_ls_command     # type: List[str]
+        self.executable = executable                    # type: str
+        self.pid = process.pid                          # type: int
+        self.returncode = None                          # type: Optional[int]
+        self.decode = decode                            # type: bool
+        self.log_settings = log_settings                # type: lib_shell_log.RunShellCommandLogSettings
+        self.timeout = timeout                          # type: Optional[float]
+        self.shell_input = shell_input                  # type: Optional[lib_shell_input.ShellCommandInput]
+        self.resource_usage = resource_usage or lib_shell_resource.ShellCommandResourceUsage()     # type: lib_shell_resource.ShellCommandResourceUsage
+        # time.perf_counter() before the process was started
+        self.start_time = start_time or time.perf_counter()     # type: float
+        self._lock = threading.Lock()
+        self._completed = threading.Event()
+        self._chunks = {'stdout': list(), 'stderr': list()}     # type: Dict[str, List[bytes]]
+        hooks = lib_shell_hooks.shell_command_hooks
+        self._on_output_chunk = hooks.get_output_chunk_callback(ls_command=self.hook_ls_command, executable=executable)
+        self._response = None                           # type: Optional[lib_shell.ShellCommandResponse]
+        self._is_response_final = False                 # type: bool
+
+    def poll(self) -> Optional[int]:
+        """ returns the returncode if the job is complete, otherwise None """
+        if self._completed.is_set():
+            return self.returncode
+        return None
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        """ waits until the job is complete and returns the returncode - raises subprocess.TimeoutExpired if it is still running after timeout seconds """
+        if not self._completed.wait(timeout=timeout):
+            raise subprocess.TimeoutExpired(cmd=' '.join(self.ls_command), timeout=timeout)     # type: ignore
+        if self.shell_input is not None:
+            # raises the exception raised while reading the input - once
+            shell_input, self.shell_input = self.shell_input, None
+            shell_input.join()
+        return self.returncode      # type: ignore
+
+    def kill(self) -> None:
+        """ kills the process and all its descendants, if it is still running - the job completes, after the reaper reaped it """
+        if self.process.returncode is None:
+            lib_shell_helpers.kill_process_tree(self.process)
+
+    def read_output(self) -> Tuple[bytes, bytes]:
+        """ returns (stdout, stderr) collected since the last call - the output is released, and not part of the response """
+        with self._lock:
+            return self._pop_output()
+
+    def get_response(self, timeout: Optional[float] = None) -> lib_shell.ShellCommandResponse:
+        """ waits until the job is complete, and returns the response - with decode=True the output is decoded once, and stdout is stripped """
+        self.wait(timeout=timeout)
+        response = self._response
+        assert response is not None
+        with self._lock:
+            if not self._is_response_final:
+                # the output might have been read with read_output, after the job completed
+                stdout, stderr = self._pop_output()
+                response.set_output_bytes(stdout, stderr)
+                if self.decode:
+                    decode_start_time = time.perf_counter()
+                    response.decode_output(keep_output_bytes=False)
+                    response.stdout = response.stdout.strip()
+                    self.resource_usage.decode_time = time.perf_counter() - decode_start_time
+                self._is_response_final = True
+        return response
+
+    def on_output(self, pipe_name: str, chunk: bytes) -> None:
+        with self._lock:
+            self._chunks[pipe_name].append(chunk)
+        if pipe_name == 'stdout':
+            self.resource_usage.stdout_size += len(chunk)
+        else:
+            self.resource_usage.stderr_size += len(chunk)
+        if self._on_output_chunk is not None:
+            self._on_output_chunk(pipe_name, chunk)
+
+    def on_complete(self) -> None:
+        returncode = self.process.returncode
+        self.resource_usage.wall_time = time.perf_counter() - self.start_time
+        self.resource_usage.communicate_time = self.resource_usage.wall_time - self.resource_usage.spawn_time
+        self.resource_usage.set_rusage(getattr(self.process, 'rusage', None))
+
+        response = lib_shell.ShellCommandResponse()
+        response.executable = self.executable
+        response.returncode = returncode
+        response.timed_out = self.timed_out
+        response.attempts = 1
+        response.attempt_durations = [self.resource_usage.wall_time]
+        response.resource_usage = self.resource_usage
+        with self._lock:
+            # the output stays readable with read_output - joined once, so it is not held twice
+            stdout, stderr = self._pop_output()
+            self._chunks['stdout'].append(stdout)
+            self._chunks['stderr'].append(stderr)
+            response.set_output_bytes(stdout, stderr)
+            self._response = response
+            self.returncode = returncode
+        # the job is complete, before hooks and logging - they might wait for it
+        self._completed.set()
+
+        hooks = lib_shell_hooks.shell_command_hooks
+        if hooks.get_has_hooks('on_complete'):
+            hooks.call('on_complete', ls_command=self.hook_ls_command, executable=self.executable, response=response)
+        if lib_shell_log.get_is_log_enabled(returncode, self.log_settings):
+            stdout_log, stderr_log = lib_shell.get_output_for_log(response, self.decode)
+            lib_shell_log.log_results(self.ls_command, stdout_log, stderr_log, returncode, True, self.log_settings)
+
+    def _pop_output(self) -> Tuple[bytes, bytes]:
+        """ returns and releases the output collected so far - call it with the lock held """
+        stdout, stderr = b''.join(self._chunks['stdout']), b''.join(self._chunks['stderr'])
+        self._chunks['stdout'].clear()
+        self._chunks['stderr'].clear()
+        return stdout, stderr
+
+    def __enter__(self) -> 'ShellJob':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        """ kills the job if it is still running, and waits until it is reaped """
+        self.kill()
+        self.wait()
+
+
+def start_shell_command(command: str,
+                        shell: bool = False,
+                        capture_output: bool = True,
+                        start_new_session: bool = False,
+                        use_sudo: bool = False,
+                        run_as_user: str = '',
+                        quiet: bool = False,
+                        decode: bool = True,
+                        log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                        env: Optional[Dict[str, str]] = None,
+                        env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                        cwd: Optional[str] = None,
+                        input: Any = None,
+                        timeout: Optional[float] = None) -> ShellJob:
+    """
+    starts the command in the background and returns a ShellJob - see start_shell_ls_command
+
+    >>> with start_shell_command('echo test') as job:
+    ...     returncode = job.wait(timeout=10)
+    >>> assert returncode == 0
+    >>> assert job.get_response().stdout == 'test'
+
+    """
+    command = command.strip()
+
+    if shell and lib_platform.get_is_platform_posix():
+        # when shell = True we need to pass the command in one string
+        ls_command = [command]
+    else:
+        ls_command = lib_shell_shlex.shlex_split_multi_platform(command)
+
+    job = start_shell_ls_command(ls_command=ls_command,
+                                 shell=shell,
+                                 capture_output=capture_output,
+                                 start_new_session=start_new_session,
+                                 use_sudo=use_sudo,
+                                 run_as_user=run_as_user,
+                                 quiet=quiet,
+                                 decode=decode,
+                                 log_settings=log_settings,
+                                 env=env,
+                                 env_overrides=env_overrides,
+                                 cwd=cwd,
+                                 input=input,
+                                 timeout=timeout)
+    return job
+
+
+def start_shell_ls_command(ls_command: List[str],
+                           shell: bool = False,
+                           capture_output: bool = True,
+                           start_new_session: bool = False,
+                           use_sudo: bool = False,
+                           run_as_user: str = '',
+                           quiet: bool = False,
+                           decode: bool = True,
+                           log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                           env: Optional[Dict[str, str]] = None,
+                           env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                           cwd: Optional[str] = None,
+                           input: Any = None,
+                           timeout: Optional[float] = None) -> ShellJob:
+    """
+    starts the command in the background and returns a ShellJob - the job is watched by lib_shell_reaper.shell_process_reaper,
+    which collects the output and reaps the process, so no zombies and no open pipes are left behind, even if nobody waits for the job.
+
+    capture_output=False : stdout and stderr are discarded (os.devnull)
+    start_new_session    : the command is started in a new session (posix) or process group (windows), it is still watched
+    input                : fed to stdin by a thread - see lib_shell_input.ShellCommandInput
+    timeout              : the command and its descendants are killed after timeout seconds, job.timed_out is True then
+
+    >>> import sys
+    >>> import unittest
+    >>> program = 'import sys; print("test", flush=True); sys.stdin.readline(); print("error", file=sys.stderr); sys.exit(3)'
+    >>> job = start_shell_ls_command([sys.executable, '-c', program], input=iter([b'go\\n']), quiet=True)
+    >>> returncode = job.wait(timeout=10)
+    >>> job.poll(), job.read_output()
+    (3, (b'test\\n', b'error\\n'))
+    >>> response = job.get_response()
+    >>> response.returncode, response.stdout, response.attempts
+    (3, '', 1)
+
+    >>> # test poll, wait with timeout and kill
+    >>> job = start_shell_ls_command([sys.executable, '-c', 'import time; time.sleep(10)'])
+    >>> assert job.poll() is None
+    >>> unittest.TestCase().assertRaises(subprocess.TimeoutExpired, job.wait, 0.1)
+    >>> job.kill()
+    >>> assert job.wait(timeout=10) != 0
+    >>> assert not job.timed_out
+
+    >>> # test timeout
+    >>> job = start_shell_ls_command([sys.executable, '-c', 'import time; time.sleep(10)'], timeout=0.2, quiet=True)
+    >>> assert job.wait(timeout=10) != 0
+    >>> assert job.timed_out and job.get_response().timed_out
+
+    >>> # test many jobs - all are reaped, no pipes are left open
+    >>> l_jobs = [start_shell_ls_command([sys.executable, '-c', 'print("test")'], start_new_session=True) for _ in range(20)]
+    >>> assert all(job.wait(timeout=30) == 0 for job in l_jobs)
+    >>> assert all(job.process.returncode == 0 for job in l_jobs)
+    >>> assert all(job.process.stdout.closed and job.process.stderr.closed for job in l_jobs)
+    >>> assert all(job.get_response().stdout == 'test' for job in l_jobs)
+
+    >>> # test the hooks get the command as passed by the caller, without sudo
+    >>> l_hook_commands = list()
+    >>> hook = lib_shell_hooks.shell_command_hooks.register('on_output_chunk', lambda **kwargs: l_hook_commands.append(kwargs['ls_command']))
+    >>> process = subprocess.Popen([sys.executable, '-c', 'print("test")'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> job = ShellJob(ls_command=['sudo', sys.executable, '-c', 'print("test")'], process=process,
+    ...                log_settings=conf_lib_shell.log_settings_quiet, hook_ls_command=[sys.executable, '-c', 'print("test")'])
+    >>> lib_shell_reaper.shell_process_reaper.watch(job)
+    >>> job.wait(timeout=10)
+    0
+    >>> lib_shell_hooks.shell_command_hooks.unregister('on_output_chunk', hook)
+    >>> assert l_hook_commands and all(ls_command == [sys.executable, '-c', 'print("test")'] for ls_command in l_hook_commands)
+
+    """
+    if quiet:
+        actual_log_settings = conf_lib_shell.log_settings_quiet
+    else:
+        actual_log_settings = log_settings
+
+    executable = lib_shell_encoding.get_executable_key(ls_command, use_sudo=use_sudo, run_as_user=run_as_user)
+    # the hooks get the command as passed by the caller
+    hook_ls_command = ls_command
+    ls_command = lib_shell.prepend_sudo_and_run_as_user(ls_command=ls_command, shell=shell, run_as_user=run_as_user, use_sudo=use_sudo)
+
+    shell_input = lib_shell_input.get_shell_command_input(input)
+    subprocess_stdin = shell_input.get_popen_stdin() if shell_input.get_has_input() else subprocess.DEVNULL
+    subprocess_output = subprocess.PIPE if capture_output else subprocess.DEVNULL
+    popen_kwargs = dict()   # type: Dict[str, Any]
+    if start_new_session and lib_platform.get_is_platform_posix():
+        popen_kwargs['start_new_session'] = True
+
+    hooks = lib_shell_hooks.shell_command_hooks
+    if hooks.get_has_hooks('pre_spawn'):
+        hooks.call('pre_spawn', ls_command=hook_ls_command, executable=executable)
+
+    resource_usage = lib_shell_resource.ShellCommandResourceUsage()
+    start_time = time.perf_counter()
+    try:
+        process = lib_shell_spawn.popen(ls_command,
+                                        startupinfo=lib_shell.get_startup_info(start_new_session),
+                                        stdin=subprocess_stdin,
+                                        stdout=subprocess_output,
+                                        stderr=subprocess_output,
+                                        shell=shell,
+                                        env=lib_shell_env.get_env_with_overrides(env=env, env_overrides=env_overrides),
+                                        cwd=cwd,
+                                        **popen_kwargs)
+    finally:
+        shell_input.close()
+    resource_usage.spawn_time = time.perf_counter() - start_time
+    shell_input.start(process, communicate=False)
+    if hooks.get_has_hooks('post_spawn'):
+        hooks.call('post_spawn', ls_command=hook_ls_command, executable=executable, process=process)
+
+    job = ShellJob(ls_command=ls_command,
+                   process=process,
+                   executable=executable,
+                   decode=decode,
+                   log_settings=actual_log_settings,
+                   timeout=timeout,
+                   shell_input=shell_input,
+                   resource_usage=resource_usage,
+                   start_time=start_time,
+                   hook_ls_command=hook_ls_command)
+    lib_shell_reaper.shell_process_reaper.watch(job)
+    return job
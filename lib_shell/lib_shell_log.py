@@ -1,13 +1,26 @@
 # stdlib
 import logging
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
 
 logger = logging.getLogger(__name__)
 
-# OWN
-import btx_lib_list
+log_formats = ('text', 'json')
 
 
 class RunShellCommandLogSettings(object):
+    """
+    the log levels for the command, stdout and stderr - for returncode zero and not zero. logging.NOTSET means not logged.
+
+    max_command_chars : the maximum number of characters of the command logged, None for no limit
+    max_output_chars  : the maximum number of characters of stdout and stderr logged each, None for no limit.
+                        the beginning and the end of the output are kept - the end usually tells why a command failed
+    log_format        : 'text' - one log record each for the command, stdout and stderr
+                        'json' - one log record with a json object, for log processors which parse structured records
+
+    each log record carries the attributes shell_command, shell_returncode and shell_stream ('command', 'stdout', 'stderr' or 'json'),
+    so handlers and formatters can use them - like a json formatter.
+
+    """
     def __init__(self) -> None:
         self.log_level_command = logging.NOTSET                 # type: int
         self.log_level_command_on_error = logging.WARNING       # type: int
@@ -17,6 +30,9 @@ class RunShellCommandLogSettings(object):
         self.log_level_stderr_on_error = logging.WARNING        # type: int
         self.log_level_returncode = logging.NOTSET              # type: int
         self.log_level_returncode_on_error = logging.WARNING    # type: int
+        self.max_command_chars = None                           # type: Optional[int]
+        self.max_output_chars = None                            # type: Optional[int]
+        self.log_format = 'text'                                # type: str
 
 
 def set_log_settings_returncode_zero_to_level(
@@ -76,38 +92,140 @@ def set_log_settings_to_level(
     return log_settings
 
 
-def log_results(s_command: str, stdout: str, stderr: str, returncode: int, wait_finish: bool, log_settings: RunShellCommandLogSettings) -> None:
-    if returncode:
-        log_level_command = log_settings.log_level_command_on_error
-        log_level_stderr = log_settings.log_level_stderr_on_error
-        log_level_stdout = log_settings.log_level_stdout_on_error
-    else:
-        log_level_command = log_settings.log_level_command
-        log_level_stderr = log_settings.log_level_stderr
-        log_level_stdout = log_settings.log_level_stdout
+def log_results(s_command: Union[str, Sequence[str]],
+                stdout: str,
+                stderr: str,
+                returncode: int,
+                wait_finish: bool,
+                log_settings: RunShellCommandLogSettings) -> None:
+    """
+    logs the command, stdout and stderr with the levels of the log settings.
+    s_command can be passed as list, it is joined only if it is logged.
+    nothing is formatted, if the logger is not enabled for the levels.
+
+    >>> import unittest
+    >>> log_settings = set_log_settings_to_level(logging.WARNING, RunShellCommandLogSettings())
+    >>> log_settings.max_output_chars = 20
+    >>> with unittest.TestCase().assertLogs(logger, level=logging.WARNING) as log_context:
+    ...     log_results(['echo', 'test'], 'test\\n\\n' + 'x' * 100, '', 0, True, log_settings)
+    >>> [record.getMessage() for record in log_context.records]
+    ['shell[OK]: echo test', 'shell stdout:\\ntest\\nxxxx\\n... 86 characters truncated ...\\nxxxxxxxxxx']
+    >>> log_context.records[1].shell_stream
+    'stdout'
+
+    >>> log_settings.log_format = 'json'
+    >>> with unittest.TestCase().assertLogs(logger, level=logging.WARNING) as log_context:
+    ...     log_results(['false'], '', 'error', 1, True, log_settings)
+    >>> log_context.records[0].getMessage()
+    '{"command": "false", "status": "ERROR", "returncode": 1, "stderr": "error"}'
+
+    >>> # nothing is logged with the level NOTSET
+    >>> log_results('echo test', 'test', '', 0, True, RunShellCommandLogSettings())
 
-    if log_level_command == log_level_stderr == log_level_stdout == logging.NOTSET:
+    """
+    log_level_command, log_level_stdout, log_level_stderr = get_log_levels(returncode=returncode, log_settings=log_settings)
+    log_command = get_is_level_enabled(log_level_command)
+    log_stdout = bool(stdout) and get_is_level_enabled(log_level_stdout)
+    log_stderr = bool(stderr) and get_is_level_enabled(log_level_stderr)
+    if not (log_command or log_stdout or log_stderr):
         return
+
+    if not isinstance(s_command, str):
+        s_command = ' '.join(s_command)
+    s_command = truncate_text(s_command, log_settings.max_command_chars)
+    if wait_finish:
+        status = 'ERROR' if returncode else 'OK'
     else:
-        if wait_finish:
-            if returncode:
-                logger.log(level=log_level_command, msg=f'shell[ERROR#{returncode}]: {s_command}')
-            else:
-                logger.log(level=log_level_command, msg=f'shell[OK]: {s_command}')
+        status = 'Fire and Forget'
+
+    if log_settings.log_format == 'json':
+        _log_results_json(s_command, stdout, stderr, returncode, status, log_settings,
+                          log_levels=(log_level_command, log_level_stdout, log_level_stderr),
+                          log_enabled=(log_command, log_stdout, log_stderr))
+        return
+
+    extra = {'shell_command': s_command, 'shell_returncode': returncode}    # type: Dict[str, Any]
+    if log_command:
+        if returncode and wait_finish:
+            logger.log(log_level_command, 'shell[%s#%s]: %s', status, returncode, s_command, extra=dict(extra, shell_stream='command'))
         else:
-            logger.log(level=log_level_command, msg=f'shell[Fire and Forget]: {s_command}')
+            logger.log(log_level_command, 'shell[%s]: %s', status, s_command, extra=dict(extra, shell_stream='command'))
+    if log_stdout:
+        stdout = delete_empty_lines(truncate_text(stdout, log_settings.max_output_chars))
+        logger.log(log_level_stdout, 'shell stdout:\n%s', stdout, extra=dict(extra, shell_stream='stdout'))
+    if log_stderr:
+        stderr = delete_empty_lines(truncate_text(stderr, log_settings.max_output_chars))
+        logger.log(log_level_stderr, 'shell stderr:\n%s', stderr, extra=dict(extra, shell_stream='stderr'))
+
+
+def _log_results_json(s_command: str, stdout: str, stderr: str, returncode: int, status: str, log_settings: RunShellCommandLogSettings,
+                      log_levels: Tuple[int, int, int], log_enabled: Tuple[bool, bool, bool]) -> None:
+    # imported here, to keep the import of lib_shell cheap
+    import json
+
+    _, log_stdout, log_stderr = log_enabled
+    record = {'command': s_command, 'status': status}   # type: Dict[str, Any]
+    if status != 'Fire and Forget':
+        record['returncode'] = returncode
+    if log_stdout:
+        record['stdout'] = truncate_text(stdout, log_settings.max_output_chars)
+    if log_stderr:
+        record['stderr'] = truncate_text(stderr, log_settings.max_output_chars)
+    # one record, with the highest level of the parts logged
+    level = max(log_level for log_level, enabled in zip(log_levels, log_enabled) if enabled)
+    logger.log(level, '%s', json.dumps(record, ensure_ascii=False),
+               extra={'shell_command': s_command, 'shell_returncode': returncode, 'shell_stream': 'json'})
+
+
+def get_log_levels(returncode: int, log_settings: RunShellCommandLogSettings) -> Tuple[int, int, int]:
+    """ returns the log levels for the command, stdout and stderr """
+    if returncode:
+        return log_settings.log_level_command_on_error, log_settings.log_level_stdout_on_error, log_settings.log_level_stderr_on_error
+    return log_settings.log_level_command, log_settings.log_level_stdout, log_settings.log_level_stderr
 
-        if stdout:
-            stdout = delete_empty_lines(stdout)
-            logger.log(level=log_level_stdout, msg=f'shell stdout:\n{stdout}')
-        if stderr:
-            stderr = delete_empty_lines(stderr)
-            logger.log(level=log_level_stderr, msg=f'shell stderr:\n{stderr}')
+
+def get_is_level_enabled(level: int) -> bool:
+    """ returns True if the level is not NOTSET, and the logger is enabled for the level """
+    return level != logging.NOTSET and logger.isEnabledFor(level)
+
+
+def get_is_log_enabled(returncode: int, log_settings: RunShellCommandLogSettings) -> bool:
+    """
+    returns True if log_results would log anything for the returncode - check that before preparing the output for the log
+
+    >>> get_is_log_enabled(0, RunShellCommandLogSettings())
+    False
+    >>> get_is_log_enabled(1, RunShellCommandLogSettings())
+    True
+
+    """
+    return any(get_is_level_enabled(level) for level in get_log_levels(returncode=returncode, log_settings=log_settings))
+
+
+def truncate_text(text: str, max_chars: Optional[int]) -> str:
+    """
+    returns the text, if it is longer than max_chars the first and the last characters are kept, max_chars together - lines might be cut
+
+    >>> truncate_text('test', None)
+    'test'
+    >>> truncate_text('a' * 5 + 'b' * 5, 4)
+    'aa\\n... 6 characters truncated ...\\nbb'
+
+    """
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    head_chars = max_chars // 2
+    tail_chars = max_chars - head_chars
+    n_truncated = len(text) - head_chars - tail_chars
+    return f'{text[:head_chars]}\n... {n_truncated} characters truncated ...\n{text[len(text) - tail_chars:]}'
 
 
 def delete_empty_lines(text: str) -> str:
-    ls_lines = text.split('\n')
-    ls_lines = btx_lib_list.ls_strip_elements(ls_lines)
-    ls_lines = btx_lib_list.ls_del_empty_elements(ls_lines)
-    text_result = '\n'.join(ls_lines)
-    return text_result
+    """
+    strips the lines and deletes the empty lines, in one pass
+
+    >>> delete_empty_lines(' test \\n\\n test2\\n')
+    'test\\ntest2'
+
+    """
+    return '\n'.join(line for line in (line.strip() for line in text.split('\n')) if line)
@@ -0,0 +1,213 @@
+# STDLIB
+import subprocess
+import sys
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+    from . import lib_shell                     # type: ignore # pragma: no cover
+    from . import lib_shell_log                 # type: ignore # pragma: no cover
+    from . import lib_shell_retry               # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+    import lib_shell                            # type: ignore # pragma: no cover
+    import lib_shell_log                        # type: ignore # pragma: no cover
+    import lib_shell_retry                      # type: ignore # pragma: no cover
+
+
+def run_shell_commands_parallel(commands: Sequence[Union[str, List[str]]],
+                                max_workers: Optional[int] = None,
+                                fail_fast: bool = False,
+                                shell: bool = False,
+                                log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                                pass_stdout_stderr_to_sys: bool = False,
+                                retries: int = conf_lib_shell.retries,
+                                use_sudo: bool = False,
+                                run_as_user: str = '',
+                                quiet: bool = False,
+                                decode: bool = True,
+                                spill_threshold: Optional[int] = None,
+                                env: Optional[Dict[str, str]] = None,
+                                env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                                cwd: Optional[str] = None,
+                                retry_policy: Optional[lib_shell_retry.RetryPolicy] = None,
+                                timeout: Optional[float] = None,
+                                deadline: Optional[float] = None) -> List[lib_shell.ShellCommandResponse]:
+    """
+    runs the commands concurrently, at most max_workers child processes at once, and returns the responses in the order of the commands.
+    a command can be a string (like for run_shell_command) or a list (like for run_shell_ls_command).
+
+    fail_fast=False : all commands are run, failed commands are returned as responses with the returncode
+    fail_fast=True  : on the first command which failed after all retries, the commands not started yet are cancelled,
+                      and the subprocess.CalledProcessError of that command is raised
+
+    >>> import unittest
+    >>> commands = [[sys.executable, '-c', f'print({n})'] for n in range(10)]
+    >>> responses = run_shell_commands_parallel(commands, max_workers=4)
+    >>> assert [response.stdout for response in responses] == [str(n) for n in range(10)]
+
+    >>> # test mixed string and list commands
+    >>> responses = run_shell_commands_parallel(['echo test', ['echo', 'test2']])
+    >>> assert [response.stdout for response in responses] == ['test', 'test2']
+
+    >>> # test collect all
+    >>> commands = [[sys.executable, '-c', 'import sys; sys.exit(2)'], [sys.executable, '-c', 'print("test")']]
+    >>> responses = run_shell_commands_parallel(commands, retries=1, quiet=True)
+    >>> assert [response.returncode for response in responses] == [2, 0]
+
+    >>> # test fail fast
+    >>> unittest.TestCase().assertRaises(subprocess.CalledProcessError, run_shell_commands_parallel, commands,
+    ...                                  fail_fast=True, retries=1, quiet=True)
+
+    """
+    responses = dict()  # type: Dict[int, lib_shell.ShellCommandResponse]
+    for index, response in iter_shell_commands_parallel(commands=commands,
+                                                        max_workers=max_workers,
+                                                        fail_fast=fail_fast,
+                                                        shell=shell,
+                                                        log_settings=log_settings,
+                                                        pass_stdout_stderr_to_sys=pass_stdout_stderr_to_sys,
+                                                        retries=retries,
+                                                        use_sudo=use_sudo,
+                                                        run_as_user=run_as_user,
+                                                        quiet=quiet,
+                                                        decode=decode,
+                                                        spill_threshold=spill_threshold,
+                                                        env=env,
+                                                        env_overrides=env_overrides,
+                                                        cwd=cwd,
+                                                        retry_policy=retry_policy,
+                                                        timeout=timeout,
+                                                        deadline=deadline):
+        responses[index] = response
+    return [responses[index] for index in range(len(commands))]
+
+
+def iter_shell_commands_parallel(commands: Sequence[Union[str, List[str]]],
+                                 max_workers: Optional[int] = None,
+                                 fail_fast: bool = False,
+                                 shell: bool = False,
+                                 log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                                 pass_stdout_stderr_to_sys: bool = False,
+                                 retries: int = conf_lib_shell.retries,
+                                 use_sudo: bool = False,
+                                 run_as_user: str = '',
+                                 quiet: bool = False,
+                                 decode: bool = True,
+                                 spill_threshold: Optional[int] = None,
+                                 env: Optional[Dict[str, str]] = None,
+                                 env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                                 cwd: Optional[str] = None,
+                                 retry_policy: Optional[lib_shell_retry.RetryPolicy] = None,
+                                 timeout: Optional[float] = None,
+                                 deadline: Optional[float] = None) -> Iterator[Tuple[int, lib_shell.ShellCommandResponse]]:
+    """
+    like run_shell_commands_parallel, but yields tuples of (index of the command, response) as the commands complete.
+    if the iteration is stopped early, the commands not started yet are cancelled.
+
+    >>> # the first command waits for the file created by the second one - so both run at the same time
+    >>> import os
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     path = os.path.join(directory, 'started')
+    ...     commands = [[sys.executable, '-c', f'import os, time; [time.sleep(0.01) for _ in range(1000) if not os.path.exists({path!r})]'],
+    ...                 [sys.executable, '-c', f'open({path!r}, "w").close()']]
+    ...     l_indices = [index for index, response in iter_shell_commands_parallel(commands, max_workers=2, timeout=30)]
+    >>> assert sorted(l_indices) == [0, 1]
+
+    """
+    # imported here, to keep the import of lib_shell cheap
+    import concurrent.futures
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    futures = dict()    # type: Dict[concurrent.futures.Future, int]
+    try:
+        for index, command in enumerate(commands):
+            future = executor.submit(_run_command,
+                                     command=command,
+                                     shell=shell,
+                                     raise_on_returncode_not_zero=fail_fast,
+                                     log_settings=log_settings,
+                                     pass_stdout_stderr_to_sys=pass_stdout_stderr_to_sys,
+                                     retries=retries,
+                                     use_sudo=use_sudo,
+                                     run_as_user=run_as_user,
+                                     quiet=quiet,
+                                     decode=decode,
+                                     spill_threshold=spill_threshold,
+                                     env=env,
+                                     env_overrides=env_overrides,
+                                     cwd=cwd,
+                                     retry_policy=retry_policy,
+                                     timeout=timeout,
+                                     deadline=deadline)
+            futures[future] = index
+
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # cancel the commands not started yet, on fail fast or if the caller stopped the iteration
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _run_command(command: Union[str, List[str]],
+                 shell: bool,
+                 raise_on_returncode_not_zero: bool,
+                 log_settings: lib_shell_log.RunShellCommandLogSettings,
+                 pass_stdout_stderr_to_sys: bool,
+                 retries: int,
+                 use_sudo: bool,
+                 run_as_user: str,
+                 quiet: bool,
+                 decode: bool,
+                 spill_threshold: Optional[int],
+                 env: Optional[Dict[str, str]],
+                 env_overrides: Optional[Dict[str, Optional[str]]],
+                 cwd: Optional[str],
+                 retry_policy: Optional[lib_shell_retry.RetryPolicy],
+                 timeout: Optional[float],
+                 deadline: Optional[float]) -> lib_shell.ShellCommandResponse:
+
+    if isinstance(command, str):
+        response = lib_shell.run_shell_command(command=command,
+                                               shell=shell,
+                                               raise_on_returncode_not_zero=raise_on_returncode_not_zero,
+                                               log_settings=log_settings,
+                                               pass_stdout_stderr_to_sys=pass_stdout_stderr_to_sys,
+                                               retries=retries,
+                                               use_sudo=use_sudo,
+                                               run_as_user=run_as_user,
+                                               quiet=quiet,
+                                               decode=decode,
+                                               spill_threshold=spill_threshold,
+                                               env=env,
+                                               env_overrides=env_overrides,
+                                               cwd=cwd,
+                                               retry_policy=retry_policy,
+                                               timeout=timeout,
+                                               deadline=deadline)
+    else:
+        response = lib_shell.run_shell_ls_command(ls_command=command,
+                                                  shell=shell,
+                                                  raise_on_returncode_not_zero=raise_on_returncode_not_zero,
+                                                  log_settings=log_settings,
+                                                  pass_stdout_stderr_to_sys=pass_stdout_stderr_to_sys,
+                                                  retries=retries,
+                                                  use_sudo=use_sudo,
+                                                  run_as_user=run_as_user,
+                                                  quiet=quiet,
+                                                  decode=decode,
+                                                  spill_threshold=spill_threshold,
+                                                  env=env,
+                                                  env_overrides=env_overrides,
+                                                  cwd=cwd,
+                                                  retry_policy=retry_policy,
+                                                  timeout=timeout,
+                                                  deadline=deadline)
+    return response
@@ -1,93 +1,310 @@
 # STDLIB
+import codecs
 import logging
+import os
 import queue
+import selectors
 import subprocess
 import sys
 import threading
 import time
-from typing import Any, List, Tuple, TYPE_CHECKING, Union
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING, Union
+
+# OWN
+import lib_platform
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from . import lib_shell_spawn               # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    import lib_shell_spawn                      # type: ignore # pragma: no cover
 
 if TYPE_CHECKING:
-    ByteQueue = queue.Queue[bytes]  # pragma: no cover
+    ChunkQueue = queue.Queue[Tuple[str, bytes]]  # pragma: no cover
 else:
-    ByteQueue = queue.Queue
+    ChunkQueue = queue.Queue
 
 
 logger = logging.getLogger()
 
+# the maximum number of bytes read from a pipe at once
+chunk_size = 65536                      # type: int
+# the interval to check if the process is still alive, if the pipes are still open but no data arrives
+process_poll_interval = 0.1             # type: float
+
+
+def pass_stdout_stderr_to_sys(process: subprocess.Popen,       # type: ignore
+                              encoding: str,
+                              stdout_sink: Optional[BinaryIO] = None,
+                              stderr_sink: Optional[BinaryIO] = None,
+                              timeout: Optional[float] = None,
+                              on_chunk: Optional[Callable[[str, bytes], None]] = None) -> Tuple[bytes, bytes]:
+    """
+    Read data from stdout and stderr of the process and pass it to sys.stdout and sys.stderr, until end-of-file is reached.
+    Wait for process to terminate. Returns the collected stdout and stderr as bytes.
+    if a sink (a binary file) is given for a pipe, the data of that pipe is written to the sink instead of collecting it.
+    if the output is not complete after timeout seconds, subprocess.TimeoutExpired is raised with the output collected so far,
+    the process is not killed.
+    on_chunk is called with (pipe_name, chunk) for each chunk read, pipe_name is 'stdout' or 'stderr'.
+
+    on posix the pipes are multiplexed with selectors in the calling thread - no threads and no busy waiting.
+    on windows select does not work on pipes, there we use one reader thread per pipe and block on a queue.
+
+    >>> process = subprocess.Popen([sys.executable, '-c', 'import sys; print("test"); print("error", file=sys.stderr)'],
+    ...                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> stdout, stderr = pass_stdout_stderr_to_sys(process, 'utf-8')  # doctest: +ELLIPSIS, +NORMALIZE_WHITESPACE
+    test...
+    >>> assert stdout.strip() == b'test'
+    >>> assert stderr.strip() == b'error'
+    >>> assert process.returncode == 0
 
-# possible memory leak - processes might (and will) sometimes not close - but will close finally when program ends
-# we might end up with many many open threads
-# it works, but afraid to use it on long running programs - it might explode
-# select is also not an option in windows
-def pass_stdout_stderr_to_sys(process: subprocess.Popen, encoding: str) -> Tuple[bytes, bytes]:    # type: ignore
+    >>> # test sinks
+    >>> import io
+    >>> stdout_sink = io.BytesIO()
+    >>> process = subprocess.Popen([sys.executable, '-c', 'print("test")'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> stdout, stderr = pass_stdout_stderr_to_sys(process, 'utf-8', stdout_sink=stdout_sink)  # doctest: +ELLIPSIS, +NORMALIZE_WHITESPACE
+    test...
+    >>> assert stdout == b'' and stdout_sink.getvalue().strip() == b'test'
+
+    >>> # test on_chunk
+    >>> l_chunks = list()
+    >>> process = subprocess.Popen([sys.executable, '-c', 'print("test")'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> on_chunk = lambda pipe_name, chunk: l_chunks.append((pipe_name, chunk))
+    >>> stdout, stderr = pass_stdout_stderr_to_sys(process, 'utf-8', on_chunk=on_chunk)  # doctest: +ELLIPSIS, +NORMALIZE_WHITESPACE
+    test...
+    >>> assert b''.join(chunk for pipe_name, chunk in l_chunks if pipe_name == 'stdout') == stdout
+
+    >>> # test timeout
+    >>> import unittest
+    >>> process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(10)'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> unittest.TestCase().assertRaises(subprocess.TimeoutExpired, pass_stdout_stderr_to_sys, process, 'utf-8', timeout=0.1)
+    >>> process.kill()
+    >>> assert process.wait() != 0
+
+    """
     l_stdout = list()               # type: List[bytes]
     l_stderr = list()               # type: List[bytes]
 
-    queue_stdout = ByteQueue()
-    queue_stderr = ByteQueue()
+    decoder_stdout = codecs.getincrementaldecoder(encoding)(errors='replace')
+    decoder_stderr = codecs.getincrementaldecoder(encoding)(errors='replace')
 
-    thread_stdout = threading.Thread(target=enque_output, args=(process.stdout, queue_stdout))
-    thread_stderr = threading.Thread(target=enque_output, args=(process.stderr, queue_stderr))
-    thread_stdout.daemon = True
-    thread_stderr.daemon = True
-    thread_stdout.start()
-    thread_stderr.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        for pipe_name, chunk in iter_process_output(process, deadline=deadline):
+            if on_chunk is not None:
+                on_chunk(pipe_name, chunk)
+            if pipe_name == 'stdout':
+                collect_chunk(chunk, l_stdout, stdout_sink)
+                write_to_target_pipe(sys.stdout, decoder_stdout.decode(chunk))
+            else:
+                collect_chunk(chunk, l_stderr, stderr_sink)
+                write_to_target_pipe(sys.stderr, decoder_stderr.decode(chunk))
+    except subprocess.TimeoutExpired:
+        raise subprocess.TimeoutExpired(cmd=process.args, timeout=timeout, output=b''.join(l_stdout), stderr=b''.join(l_stderr))    # type: ignore
 
-    while True:
-        poll_queue(queue_stdout, sys.stdout, l_stdout, encoding)
-        poll_queue(queue_stderr, sys.stderr, l_stderr, encoding)
-        if process.poll() is not None:
-            break
+    write_to_target_pipe(sys.stdout, decoder_stdout.decode(b'', final=True))
+    write_to_target_pipe(sys.stderr, decoder_stderr.decode(b'', final=True))
 
-    time.sleep(0.1)
-    poll_queue(queue_stdout, sys.stdout, l_stdout, encoding)
-    poll_queue(queue_stderr, sys.stderr, l_stderr, encoding)
+    lib_shell_spawn.wait_process(process)
     stdout_complete = b''.join(l_stdout)
     stderr_complete = b''.join(l_stderr)
+    return stdout_complete, stderr_complete
 
-    if thread_stdout.is_alive():
-        # this should never happen
-        report_thread_not_closed(process=process, pipe_name='stdout')   # pragma: no cover
-    if thread_stderr.is_alive():
-        # this should never happen
-        report_thread_not_closed(process=process, pipe_name='stderr')   # pragma: no cover
 
-    return stdout_complete, stderr_complete
+def iter_process_output(process: subprocess.Popen, deadline: Optional[float] = None) -> Iterator[Tuple[str, bytes]]:     # type: ignore
+    """
+    yields tuples of (pipe_name, chunk) from stdout and stderr of the process as they arrive, pipe_name is 'stdout' or 'stderr'
+    deadline : see iter_pipes_output
 
+    >>> process = subprocess.Popen([sys.executable, '-c', 'print("test")'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> assert b''.join(chunk for pipe_name, chunk in iter_process_output(process) if pipe_name == 'stdout').strip() == b'test'
+    >>> assert process.wait() == 0
 
-def report_thread_not_closed(process: Union[subprocess.Popen, subprocess.CompletedProcess], pipe_name: str) -> None:    # type: ignore
     """
-    >>> process=subprocess.CompletedProcess(args=['a', 'b', 'c'], returncode=0)
-    >>> report_thread_not_closed(process=process, pipe_name='stdout')
+    pipes = {'stdout': process.stdout, 'stderr': process.stderr}
+    for pipe_name, chunk in iter_pipes_output(pipes=pipes, process=process, deadline=deadline):
+        yield pipe_name, chunk
+
 
+def iter_pipes_output(pipes: Dict[str, Any],
+                      process: Optional[subprocess.Popen] = None,   # type: ignore
+                      deadline: Optional[float] = None) -> Iterator[Tuple[str, bytes]]:
     """
+    yields tuples of (pipe_name, chunk) from the given pipes as they arrive, until all pipes reached end-of-file.
+    pipes which are None are ignored. The pipes are closed when end-of-file is reached.
 
-    cmd_args = [str(cmd_arg) for cmd_arg in process.args]   # type: List[str]
-    command = ' '.join(cmd_args)
-    error_msg = f'stalled I/O thread for "{pipe_name}" on command "{command}"'
-    error_msg = error_msg + ' - consider to call it without option pass_stdout_stderr_to_sys'
-    logger.error(error_msg)
+    if a process is given, and the process terminated but some pipe is still held open (by a grandchild for instance),
+    we stop reading after the pipes are drained and report the stalled pipe - on posix the stalled pipe is closed too.
 
+    if a deadline (a time.monotonic() value) is given, subprocess.TimeoutExpired is raised when the deadline is reached,
+    before all pipes reached end-of-file. The pipes are not closed in that case.
 
-def enque_output(out: Any, message_queue: ByteQueue) -> None:
-    while True:
-        msg = out.readline()
-        if msg != b'':
-            message_queue.put(msg)
+    """
+    pipes = {pipe_name: pipe for pipe_name, pipe in pipes.items() if pipe is not None}
+    if not pipes:
+        return
+    if lib_platform.get_is_platform_windows():
+        iter_output = _iter_pipes_output_threaded(pipes=pipes, process=process, deadline=deadline)     # pragma: no cover
+    else:
+        iter_output = _iter_pipes_output_selector(pipes=pipes, process=process, deadline=deadline)
+    for pipe_name, chunk in iter_output:
+        yield pipe_name, chunk
+
+
+def _iter_pipes_output_selector(pipes: Dict[str, Any],
+                                process: Optional[subprocess.Popen] = None,     # type: ignore
+                                deadline: Optional[float] = None) -> Iterator[Tuple[str, bytes]]:
+    with selectors.DefaultSelector() as selector:
+        for pipe_name, pipe in pipes.items():
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe, selectors.EVENT_READ, pipe_name)
+
+        # if we have no process to watch, we can block until some pipe is ready
+        select_timeout = None if process is None else process_poll_interval    # type: Optional[float]
+        process_finished = False
+
+        while selector.get_map():
+            check_deadline(deadline=deadline, process=process)
+            events = selector.select(timeout=get_wait_timeout(select_timeout, deadline))
+            if not events:
+                if process_finished:
+                    # the process is gone, but some pipe is still held open and drained
+                    for key in list(selector.get_map().values()):
+                        report_pipe_not_closed(process=process, pipe_name=key.data)     # type: ignore
+                        selector.unregister(key.fileobj)
+                        # we do not read it anymore - close our end, the process holding it open gets SIGPIPE on writing
+                        pipes[key.data].close()
+                    break
+                # after the process finished, we drain the pipes one more time before we give up
+                process_finished = process is not None and lib_shell_spawn.poll_process(process) is not None
+                continue
+
+            for key, _ in events:
+                try:
+                    chunk = os.read(key.fd, chunk_size)
+                except BlockingIOError:     # pragma: no cover
+                    continue
+                if chunk:
+                    yield key.data, chunk
+                else:
+                    selector.unregister(key.fileobj)
+                    pipes[key.data].close()
+
+
+def _iter_pipes_output_threaded(pipes: Dict[str, Any],                                  # pragma: no cover
+                                process: Optional[subprocess.Popen] = None,             # type: ignore
+                                deadline: Optional[float] = None) -> Iterator[Tuple[str, bytes]]:
+    # select does not work on pipes in windows - so we read each pipe in its own thread,
+    # and block on a common queue - no busy waiting
+    chunk_queue = ChunkQueue()
+    l_threads = list()      # type: List[threading.Thread]
+    for pipe_name, pipe in pipes.items():
+        thread = threading.Thread(target=enque_output, args=(pipe, pipe_name, chunk_queue))
+        thread.daemon = True
+        thread.start()
+        l_threads.append(thread)
+
+    pipes_open = len(l_threads)
+    process_finished = False
+    while pipes_open:
+        check_deadline(deadline=deadline, process=process)
+        try:
+            pipe_name, chunk = chunk_queue.get(timeout=get_wait_timeout(None if process is None else process_poll_interval, deadline))
+        except queue.Empty:
+            if process_finished:
+                for thread, pipe_name in zip(l_threads, pipes.keys()):
+                    if thread.is_alive():
+                        report_pipe_not_closed(process=process, pipe_name=pipe_name)    # type: ignore
+                break
+            process_finished = process is not None and lib_shell_spawn.poll_process(process) is not None
+            continue
+        if chunk:
+            yield pipe_name, chunk
         else:
+            pipes_open = pipes_open - 1
+
+
+def get_wait_timeout(timeout: Optional[float], deadline: Optional[float]) -> Optional[float]:
+    """
+    returns the timeout to wait, but not past the deadline (a time.monotonic() value) - None to wait forever
+
+    >>> get_wait_timeout(None, None)
+    >>> get_wait_timeout(0.1, None)
+    0.1
+    >>> assert 9 < get_wait_timeout(None, time.monotonic() + 10) <= 10
+    >>> get_wait_timeout(0.1, time.monotonic() - 1)
+    0.0
+
+    """
+    if deadline is None:
+        return timeout
+    remaining = max(0.0, deadline - time.monotonic())
+    if timeout is None:
+        return remaining
+    return min(timeout, remaining)
+
+
+def check_deadline(deadline: Optional[float], process: Optional[subprocess.Popen] = None) -> None:     # type: ignore
+    """
+    raises subprocess.TimeoutExpired if the deadline (a time.monotonic() value) is reached.
+    the deadline is not known as timeout here, so the exception carries a timeout of 0
+
+    >>> import unittest
+    >>> check_deadline(None)
+    >>> check_deadline(time.monotonic() + 10)
+    >>> unittest.TestCase().assertRaises(subprocess.TimeoutExpired, check_deadline, time.monotonic())
+
+    """
+    if deadline is not None and time.monotonic() >= deadline:
+        cmd = process.args if process is not None else ''
+        raise subprocess.TimeoutExpired(cmd=cmd, timeout=0)
+
+
+def enque_output(out: Any, pipe_name: str, chunk_queue: ChunkQueue) -> None:
+    """ reads chunks from the pipe and puts them into the queue, an empty chunk signals end-of-file
+
+    >>> import io
+    >>> chunk_queue = ChunkQueue()
+    >>> enque_output(io.BytesIO(b'test'), 'stdout', chunk_queue)
+    >>> assert chunk_queue.get_nowait() == ('stdout', b'test')
+    >>> assert chunk_queue.get_nowait() == ('stdout', b'')
+
+    """
+    read = out.read1 if hasattr(out, 'read1') else out.readline
+    while True:
+        chunk = read(chunk_size)
+        chunk_queue.put((pipe_name, chunk))
+        if not chunk:
             break
     out.close()
 
 
-def poll_queue(msg_queue: ByteQueue, target_pipe: Any, msg_list: List[bytes], encoding: str) -> None:
-    try:
-        while True:
-            msg_line = msg_queue.get_nowait()
-            msg_list.append(msg_line)
-            msg_line_decoded = msg_line.decode(encoding)
-            target_pipe.write(msg_line_decoded)
-            if hasattr(target_pipe, 'flush'):   # pragma: no cover
-                target_pipe.flush()
-    except queue.Empty:
-        pass
+def collect_chunk(chunk: bytes, l_chunks: List[bytes], sink: Optional[BinaryIO]) -> None:
+    if sink is None:
+        l_chunks.append(chunk)
+    else:
+        sink.write(chunk)
+
+
+def write_to_target_pipe(target_pipe: Any, text: str) -> None:
+    if text:
+        target_pipe.write(text)
+        if hasattr(target_pipe, 'flush'):   # pragma: no cover
+            target_pipe.flush()
+
+
+def report_pipe_not_closed(process: Union[subprocess.Popen, subprocess.CompletedProcess], pipe_name: str) -> None:    # type: ignore
+    """
+    >>> process=subprocess.CompletedProcess(args=['a', 'b', 'c'], returncode=0)
+    >>> report_pipe_not_closed(process=process, pipe_name='stdout')
+
+    """
+
+    cmd_args = [str(cmd_arg) for cmd_arg in process.args]   # type: List[str]
+    command = ' '.join(cmd_args)
+    error_msg = f'stalled pipe "{pipe_name}" on command "{command}", the process terminated but the pipe is still held open'
+    error_msg = error_msg + ' - maybe by a child process of the command'
+    logger.error(error_msg)
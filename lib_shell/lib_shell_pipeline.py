@@ -0,0 +1,436 @@
+# STDLIB
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Any, BinaryIO, Dict, List, Mapping, Optional, Tuple
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+    from . import lib_shell                     # type: ignore # pragma: no cover
+    from . import lib_shell_capture             # type: ignore # pragma: no cover
+    from . import lib_shell_encoding            # type: ignore # pragma: no cover
+    from . import lib_shell_env                 # type: ignore # pragma: no cover
+    from . import lib_shell_helpers             # type: ignore # pragma: no cover
+    from . import lib_shell_hooks               # type: ignore # pragma: no cover
+    from . import lib_shell_log                 # type: ignore # pragma: no cover
+    from . import lib_shell_pass_output         # type: ignore # pragma: no cover
+    from . import lib_shell_shlex               # type: ignore # pragma: no cover
+    from . import lib_shell_spawn               # type: ignore # pragma: no cover
+    from . import lib_shell_spill               # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+    import lib_shell                            # type: ignore # pragma: no cover
+    import lib_shell_capture                    # type: ignore # pragma: no cover
+    import lib_shell_encoding                   # type: ignore # pragma: no cover
+    import lib_shell_env                        # type: ignore # pragma: no cover
+    import lib_shell_helpers                    # type: ignore # pragma: no cover
+    import lib_shell_hooks                      # type: ignore # pragma: no cover
+    import lib_shell_log                        # type: ignore # pragma: no cover
+    import lib_shell_pass_output                # type: ignore # pragma: no cover
+    import lib_shell_shlex                      # type: ignore # pragma: no cover
+    import lib_shell_spawn                      # type: ignore # pragma: no cover
+    import lib_shell_spill                      # type: ignore # pragma: no cover
+
+
+class ShellPipelineStage(object):
+    """
+    one command of a pipeline, with its redirections - see parse_shell_pipeline
+
+    ls_command       : the command and its arguments
+    stdin_path       : the file read as stdin ('<'), '' to read the output of the previous stage
+    stdout_path      : the file stdout is written to ('>' or '1>'), '' to pass stdout to the next stage, or to the response
+    stdout_append    : append to stdout_path ('>>')
+    stderr_path      : the file stderr is written to ('2>'), '' to collect stderr in the response
+    stderr_append    : append to stderr_path ('2>>')
+    stderr_to_stdout : stderr is written to wherever stdout is written to ('2>&1')
+
+    """
+    def __init__(self) -> None:
+        self.ls_command = list()            # type: List[str]
+        self.stdin_path = ''                # type: str
+        self.stdout_path = ''               # type: str
+        self.stdout_append = False          # type: bool
+        self.stderr_path = ''               # type: str
+        self.stderr_append = False          # type: bool
+        self.stderr_to_stdout = False       # type: bool
+
+
+class ShellPipelineResponse(object):
+    """
+    the response of run_shell_pipeline
+
+    returncode : the returncode of the last stage run - like a posix shell without pipefail
+    responses  : the ShellCommandResponse of each stage run, in the order of the stages - stages skipped by '&&' or '||' are not included
+    timed_out  : True if a pipeline was killed, because the timeout or the deadline was reached
+    stdout and stderr are the output of the last stage run.
+
+    """
+    def __init__(self) -> None:
+        self.returncode = 0                 # type: int
+        self.responses = list()             # type: List[lib_shell.ShellCommandResponse]
+        self.timed_out = False              # type: bool
+
+    @property
+    def stdout(self) -> str:
+        return self.responses[-1].stdout if self.responses else ''
+
+    @property
+    def stderr(self) -> str:
+        return self.responses[-1].stderr if self.responses else ''
+
+    def close(self) -> None:
+        """ deletes the output spilled to disk """
+        for response in self.responses:
+            response.close()
+
+
+def run_shell_pipeline(command: str,
+                       raise_on_returncode_not_zero: bool = True,
+                       log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                       quiet: bool = False,
+                       decode: bool = True,
+                       spill_threshold: Optional[int] = None,
+                       env: Optional[Dict[str, str]] = None,
+                       env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                       cwd: Optional[str] = None,
+                       timeout: Optional[float] = None,
+                       deadline: Optional[float] = None) -> ShellPipelineResponse:
+    """
+    runs a commandline with pipes, redirections and sequences, without a shell - see parse_shell_pipeline.
+    the stages of a pipeline are connected directly with os pipes, the output is not copied through python.
+    stderr of each stage and stdout of the last stage are collected in the responses - files relative to cwd, if given.
+
+    the timeout applies to each pipeline of a sequence, the deadline (a time.monotonic() value) to all of them.
+    the pipelines are not retried, because their redirections are not idempotent.
+    raise_on_returncode_not_zero raises subprocess.CalledProcessError with the output of the last stage run,
+    or subprocess.TimeoutExpired if the timeout was reached.
+
+    >>> import tempfile
+    >>> import unittest
+    >>> python = f'"{sys.executable}"'
+    >>> response = run_shell_pipeline(f'{python} -c "print(1); print(2); print(3)" | {python} -c "import sys; print(len(sys.stdin.readlines()))"')
+    >>> response.stdout, response.returncode, len(response.responses)
+    ('3', 0, 2)
+
+    >>> # test redirections and sequences
+    >>> with tempfile.TemporaryDirectory() as test_directory:
+    ...     response = run_shell_pipeline(f'{python} -c "print(\\'test\\')" > out.txt && {python} -c "print(\\'test2\\')" >> out.txt', cwd=test_directory)
+    ...     response = run_shell_pipeline(f'{python} -c "import sys; print(sys.stdin.read().split())" < out.txt', cwd=test_directory)
+    ...     print(response.stdout)
+    ['test', 'test2']
+
+    >>> # test stderr per stage and 2>&1
+    >>> program = 'import sys; print(\\'error\\', file=sys.stderr, flush=True)'
+    >>> response = run_shell_pipeline(f'{python} -c "{program}; print(\\'test\\')" | {python} -c "{program}; print(input())" 2>&1 '
+    ...                               f'| {python} -c "import sys; print(sys.stdin.read().split())"')
+    >>> [stage_response.stderr.strip() for stage_response in response.responses]
+    ['error', '', '']
+    >>> response.stdout
+    "['error', 'test']"
+
+    >>> # test || and &&
+    >>> response = run_shell_pipeline(f'{python} -c "raise SystemExit(1)" && {python} -c "print(1)" || {python} -c "print(2)"', quiet=True)
+    >>> response.stdout, response.returncode, len(response.responses)
+    ('2', 0, 2)
+    >>> unittest.TestCase().assertRaises(subprocess.CalledProcessError, run_shell_pipeline, f'{python} -c "raise SystemExit(1)"', quiet=True)
+
+    >>> # test timeout, all stages are killed
+    >>> program = 'import time; time.sleep(10)'
+    >>> start_time = time.monotonic()
+    >>> response = run_shell_pipeline(f'{python} -c "{program}" | {python} -c "{program}"', timeout=0.5,
+    ...                               raise_on_returncode_not_zero=False, quiet=True)
+    >>> assert response.timed_out and response.returncode != 0
+    >>> assert time.monotonic() - start_time < 5
+
+    """
+    if quiet:
+        log_settings = conf_lib_shell.log_settings_quiet
+
+    my_env = lib_shell_env.get_env_with_overrides(env=env, env_overrides=env_overrides)
+    pipeline_response = ShellPipelineResponse()
+    pipeline_timeout = timeout
+    returncode = 0
+
+    for operator, l_stages in parse_shell_pipeline(command):
+        # like a posix shell - the pipeline after '&&' runs only on success, after '||' only on failure of the last pipeline run
+        if (operator == '&&' and returncode != 0) or (operator == '||' and returncode == 0):
+            continue
+        pipeline_timeout = lib_shell.get_attempt_timeout(timeout=timeout, deadline=deadline)
+        l_responses = _run_pipeline(l_stages=l_stages,
+                                    log_settings=log_settings,
+                                    decode=decode,
+                                    spill_threshold=spill_threshold,
+                                    env=my_env,
+                                    cwd=cwd,
+                                    timeout=pipeline_timeout)
+        pipeline_response.responses.extend(l_responses)
+        returncode = l_responses[-1].returncode
+        if l_responses[-1].timed_out:
+            pipeline_response.timed_out = True
+            break
+
+    pipeline_response.returncode = returncode
+    if returncode != 0 and raise_on_returncode_not_zero:
+        response = pipeline_response.responses[-1]
+        if pipeline_response.timed_out:
+            lib_shell.raise_timeout_expired(response=response, str_command=command, timeout=pipeline_timeout, decode=decode)    # type: ignore
+        lib_shell.raise_called_process_error(response=response, str_command=command, decode=decode)
+    return pipeline_response
+
+
+def parse_shell_pipeline(command: str, is_platform_windows: Optional[bool] = None) -> List[Tuple[str, List[ShellPipelineStage]]]:
+    """
+    parses a commandline into a sequence of pipelines - returns tuples of (operator, stages), the operator is '&&', '||',
+    or '' for the first pipeline. the stages of a pipeline are separated by '|'.
+    the redirections are '<', '>', '>>', '1>', '2>', '2>>' and '2>&1' - '2>&1' redirects stderr to wherever stdout goes,
+    independent of its position. other operators, like '&', are not supported.
+
+    >>> sequence = parse_shell_pipeline('grep -v "a | b" < in.txt 2>&1 | sort > out.txt || echo failed >> err.txt', is_platform_windows=False)
+    >>> [(operator, [stage.ls_command for stage in l_stages]) for operator, l_stages in sequence]
+    [('', [['grep', '-v', 'a | b'], ['sort']]), ('||', [['echo', 'failed']])]
+    >>> stage = sequence[0][1][0]
+    >>> stage.stdin_path, stage.stderr_to_stdout, sequence[0][1][1].stdout_path
+    ('in.txt', True, 'out.txt')
+    >>> stage = sequence[1][1][0]
+    >>> stage.stdout_path, stage.stdout_append
+    ('err.txt', True)
+
+    >>> import unittest
+    >>> unittest.TestCase().assertRaises(ValueError, parse_shell_pipeline, 'echo test &', False)
+    >>> unittest.TestCase().assertRaises(ValueError, parse_shell_pipeline, 'echo test | | cat', False)
+    >>> unittest.TestCase().assertRaises(ValueError, parse_shell_pipeline, 'echo test >', False)
+    >>> unittest.TestCase().assertRaises(ValueError, parse_shell_pipeline, '', False)
+
+    """
+    l_tokens = lib_shell_shlex.shlex_split_operators(command, is_platform_windows=is_platform_windows)
+    l_sequence = list()         # type: List[Tuple[str, List[ShellPipelineStage]]]
+    operator = ''
+    l_stages = [ShellPipelineStage()]
+    index = 0
+    while index < len(l_tokens):
+        token, is_operator = l_tokens[index]
+        index = index + 1
+        stage = l_stages[-1]
+        if not is_operator:
+            stage.ls_command.append(token)
+        elif token == '|':
+            _check_stage(stage, command)
+            l_stages.append(ShellPipelineStage())
+        elif token in ('&&', '||'):
+            _check_stage(stage, command)
+            l_sequence.append((operator, l_stages))
+            operator = token
+            l_stages = [ShellPipelineStage()]
+        elif token == '<':
+            stage.stdin_path, index = _get_redirection_target(l_tokens, index, command)
+        elif token in ('>', '1>', '2>'):
+            # '>>' is split into two operators
+            append = l_tokens[index:index + 1] == [('>', True)]
+            if append:
+                index = index + 1
+            if token == '2>' and not append and l_tokens[index:index + 2] == [('&', True), ('1', False)]:
+                stage.stderr_to_stdout = True
+                index = index + 2
+            elif token == '2>':
+                stage.stderr_path, index = _get_redirection_target(l_tokens, index, command)
+                stage.stderr_append = append
+            else:
+                stage.stdout_path, index = _get_redirection_target(l_tokens, index, command)
+                stage.stdout_append = append
+        else:
+            raise ValueError(f'the operator "{token}" is not supported in pipelines: "{command}"')
+
+    _check_stage(l_stages[-1], command)
+    l_sequence.append((operator, l_stages))
+    return l_sequence
+
+
+def _check_stage(stage: ShellPipelineStage, command: str) -> None:
+    if not stage.ls_command:
+        raise ValueError(f'empty command in pipeline: "{command}"')
+
+
+def _get_redirection_target(l_tokens: List[Tuple[str, bool]], index: int, command: str) -> Tuple[str, int]:
+    """ returns the file name following a redirection, and the index of the next token """
+    if index >= len(l_tokens) or l_tokens[index][1]:
+        raise ValueError(f'missing file name after a redirection: "{command}"')
+    return l_tokens[index][0], index + 1
+
+
+def _run_pipeline(l_stages: List[ShellPipelineStage],
+                  log_settings: lib_shell_log.RunShellCommandLogSettings,
+                  decode: bool,
+                  spill_threshold: Optional[int],
+                  env: Mapping[str, str],
+                  cwd: Optional[str],
+                  timeout: Optional[float]) -> List[lib_shell.ShellCommandResponse]:
+    """ runs the stages of one pipeline, connected with os pipes, and returns the response of each stage """
+    hooks = lib_shell_hooks.shell_command_hooks
+    deadline = None if timeout is None else time.monotonic() + timeout
+    l_processes = list()        # type: List[subprocess.Popen]     # type: ignore
+    l_responses = list()        # type: List[lib_shell.ShellCommandResponse]
+    # the output collected in temporary files - None if the output is redirected
+    l_stderr_sinks = list()     # type: List[Optional[BinaryIO]]
+    stdout_sink = None          # type: Optional[BinaryIO]
+    # the redirected files are closed in the parent, after the children were started
+    l_files = list()            # type: List[BinaryIO]
+    stdin = subprocess.DEVNULL  # type: Any
+    start_time = time.perf_counter()
+
+    try:
+        for index, stage in enumerate(l_stages):
+            is_last_stage = index == len(l_stages) - 1
+            if stage.stdin_path:
+                stdin = _open_redirection(stage.stdin_path, 'rb', cwd, l_files)
+            if stage.stdout_path:
+                stage_stdout = _open_redirection(stage.stdout_path, 'ab' if stage.stdout_append else 'wb', cwd, l_files)     # type: Any
+            elif is_last_stage and spill_threshold is not None:
+                # the last stage writes directly to the file, we dont copy the data through pipes
+                stage_stdout = stdout_sink = lib_shell_spill.create_spill_file()
+            else:
+                stage_stdout = subprocess.PIPE
+            stderr_sink = None          # type: Optional[BinaryIO]
+            if stage.stderr_to_stdout:
+                stage_stderr = subprocess.STDOUT      # type: Any
+            elif stage.stderr_path:
+                stage_stderr = _open_redirection(stage.stderr_path, 'ab' if stage.stderr_append else 'wb', cwd, l_files)
+            else:
+                # the stderr of all stages is collected in files - so no stage blocks on a full pipe, which nobody reads
+                stage_stderr = stderr_sink = lib_shell_spill.create_spill_file()
+            l_stderr_sinks.append(stderr_sink)
+
+            response = lib_shell.ShellCommandResponse()
+            response.executable = lib_shell_encoding.get_executable_key(stage.ls_command)
+            if hooks.get_has_hooks('pre_spawn'):
+                hooks.call('pre_spawn', ls_command=stage.ls_command, executable=response.executable)
+            spawn_start_time = time.perf_counter()
+            process = lib_shell_spawn.popen(stage.ls_command, stdin=stdin, stdout=stage_stdout, stderr=stage_stderr, env=env, cwd=cwd)
+            response.resource_usage.spawn_time = time.perf_counter() - spawn_start_time
+            l_processes.append(process)
+            l_responses.append(response)
+            if hooks.get_has_hooks('post_spawn'):
+                hooks.call('post_spawn', ls_command=stage.ls_command, executable=response.executable, process=process)
+
+            # the read end of the previous pipe is owned by this stage now - if it exits early, the previous stage gets SIGPIPE
+            if index and l_processes[index - 1].stdout is not None:
+                l_processes[index - 1].stdout.close()
+            stdin = subprocess.DEVNULL if process.stdout is None else process.stdout
+    except BaseException:
+        for process in l_processes:
+            lib_shell_helpers.kill_process_tree(process)
+            process.wait()
+            if process.stdout is not None:
+                process.stdout.close()
+        for sink in l_stderr_sinks + [stdout_sink]:
+            lib_shell_spill.discard_spill_file(sink)
+        raise
+    finally:
+        for redirection_file in l_files:
+            redirection_file.close()
+
+    stdout_bytes, timed_out = _wait_pipeline(l_processes, l_responses, start_time, deadline)
+
+    for stage, process, response, stderr_sink in zip(l_stages, l_processes, l_responses, l_stderr_sinks):
+        response.returncode = process.returncode
+        response.timed_out = timed_out
+        response.attempts = 1
+        resource_usage = response.resource_usage
+        resource_usage.set_rusage(getattr(process, 'rusage', None))
+
+        stdout, stdout_file = b'', None         # type: bytes, Optional[lib_shell_spill.ShellCommandOutputFile]
+        if response is l_responses[-1]:
+            stdout, stdout_file = _get_sink_output(stdout_sink, spill_threshold, default=stdout_bytes)
+        stderr, stderr_file = _get_sink_output(stderr_sink, spill_threshold, default=b'')
+        resource_usage.stdout_size = stdout_file.size if stdout_file else len(stdout)
+        resource_usage.stderr_size = stderr_file.size if stderr_file else len(stderr)
+        response.set_output_bytes(stdout, stderr)
+        if stdout_file or stderr_file:
+            # spilled output is decoded only on access
+            response.set_output_files(stdout_file, stderr_file)
+        elif decode:
+            decode_start_time = time.perf_counter()
+            response.decode_output(keep_output_bytes=False)
+            resource_usage.decode_time = time.perf_counter() - decode_start_time
+            response.stdout = response.stdout.strip()
+
+        if hooks.get_has_hooks('on_complete'):
+            hooks.call('on_complete', ls_command=stage.ls_command, executable=response.executable, response=response)
+        if response is not l_responses[-1] and hasattr(signal, 'SIGPIPE') and response.returncode == -signal.SIGPIPE:
+            # the stage was killed by SIGPIPE, because the next stage stopped reading - like 'yes | head', that is no error
+            continue
+        if lib_shell_log.get_is_log_enabled(response.returncode, log_settings):
+            stdout_log, stderr_log = lib_shell.get_output_for_log(response, decode)
+            lib_shell_log.log_results(stage.ls_command, stdout_log, stderr_log, response.returncode, True, log_settings)
+
+    return l_responses
+
+
+def _wait_pipeline(l_processes: List[subprocess.Popen],       # type: ignore
+                   l_responses: List[lib_shell.ShellCommandResponse],
+                   start_time: float,
+                   deadline: Optional[float]) -> Tuple[bytes, bool]:
+    """
+    reads stdout of the last stage, and waits for all stages - returns stdout of the last stage, and True if the deadline was reached.
+    if the deadline is reached, all stages with their descendants are killed.
+    """
+    timed_out = False
+    stdout = b''            # type: bytes
+    # with conf_lib_shell.collect_rusage the output of the last stage is read by lib_shell_capture, which reaps it with os.wait4
+    stdout_buffer = lib_shell_capture.BoundedOutputBuffer() if lib_shell_spawn.get_is_rusage_collected() else None
+    # the last stage first - it exits only after the stages before it, the pipes of the other stages are closed already
+    l_stages_reversed = list(zip(l_processes, l_responses))[::-1]
+    try:
+        for process, response in l_stages_reversed:
+            wait_timeout = lib_shell_pass_output.get_wait_timeout(timeout=None, deadline=deadline)
+            if process is l_processes[-1]:
+                stdout = _communicate(process, stdout_buffer, timeout=wait_timeout)
+            else:
+                lib_shell_spawn.wait_process(process, timeout=wait_timeout)
+            response.resource_usage.wall_time = time.perf_counter() - start_time
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        for process in l_processes:
+            if lib_shell_spawn.poll_process(process) is None:
+                lib_shell_helpers.kill_process_tree(process)
+        for process, response in l_stages_reversed:
+            if process is l_processes[-1]:
+                # the output can be read again after the timeout, to collect the rest of it
+                stdout = _communicate(process, stdout_buffer, timeout=None)
+            else:
+                lib_shell_spawn.wait_process(process)
+            response.resource_usage.wall_time = time.perf_counter() - start_time
+    return stdout or b'', timed_out
+
+
+def _communicate(process: subprocess.Popen,     # type: ignore
+                 stdout_buffer: Optional[lib_shell_capture.BoundedOutputBuffer],
+                 timeout: Optional[float]) -> bytes:
+    """ reads stdout of the last stage and waits for it - into stdout_buffer if given, then the process is reaped by lib_shell_spawn.wait_process """
+    if stdout_buffer is None:
+        stdout, stderr = process.communicate(timeout=timeout)
+        return stdout or b''
+    lib_shell_capture.capture_output(process, stdout_buffer, lib_shell_capture.BoundedOutputBuffer(), timeout=timeout)
+    return stdout_buffer.get_bytes()
+
+
+def _open_redirection(path: str, mode: str, cwd: Optional[str], l_files: List[BinaryIO]) -> BinaryIO:
+    """ opens the file of a redirection, relative to cwd, and adds it to l_files """
+    redirection_file = open(os.path.join(cwd or '', path), mode=mode)
+    l_files.append(redirection_file)       # type: ignore
+    return redirection_file     # type: ignore
+
+
+def _get_sink_output(sink: Optional[BinaryIO], spill_threshold: Optional[int],
+                     default: bytes) -> Tuple[bytes, Optional[lib_shell_spill.ShellCommandOutputFile]]:
+    """ returns the output collected in the temporary file, spilled if larger than spill_threshold - default if there is no file """
+    if sink is None:
+        return default, None
+    if spill_threshold is None:
+        spill_threshold = sys.maxsize
+    return lib_shell_spill.get_spilled_output(sink, spill_threshold)
@@ -0,0 +1,310 @@
+# STDLIB
+import os
+import selectors
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+# OWN
+import lib_platform
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from . import lib_shell_helpers             # type: ignore # pragma: no cover
+    from . import lib_shell_pass_output         # type: ignore # pragma: no cover
+    from . import lib_shell_spawn               # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    import lib_shell_helpers                    # type: ignore # pragma: no cover
+    import lib_shell_pass_output                # type: ignore # pragma: no cover
+    import lib_shell_spawn                      # type: ignore # pragma: no cover
+
+
+class WatchedProcess(object):
+    """
+    a process watched by the reaper (see ShellProcessReaper) : the output is read as it arrives and passed to on_output,
+    the process is reaped as soon as it exited and the pipes are closed, then on_complete is called.
+    the output is discarded and nothing is done on completion - subclass to use them (like lib_shell_job.ShellJob).
+    on_output and on_complete are called in the thread of the reaper, they must not block.
+
+    deadline : a time.monotonic() value - the process and its descendants are killed if they are still running then
+    timed_out : True if the process was killed, because the deadline was reached
+
+    if a pipe is still held open after the process exited (by a daemon started by the command for instance), it is closed.
+    that is reported as error only if report_pipes_not_closed is True (like for lib_shell_job.ShellJob), otherwise logged as debug.
+
+    """
+    report_pipes_not_closed = False             # type: bool
+
+    def __init__(self, process: subprocess.Popen, deadline: Optional[float] = None) -> None:     # type: ignore
+        self.process = process                  # type: subprocess.Popen    # type: ignore
+        self.deadline = deadline                # type: Optional[float]
+        self.timed_out = False                  # type: bool
+        # the pipes not at end-of-file yet
+        self.pipes = {pipe_name: pipe for pipe_name, pipe in (('stdout', process.stdout), ('stderr', process.stderr))
+                      if pipe is not None}      # type: Dict[str, Any]
+        # the process exited - set by the reaper, the pipes might still be drained
+        self.exited = False                     # type: bool
+        self.exit_time = 0.0                    # type: float
+
+    def on_output(self, pipe_name: str, chunk: bytes) -> None:
+        """ called with each chunk read from stdout or stderr, pipe_name is 'stdout' or 'stderr' """
+
+    def on_complete(self) -> None:
+        """ called after the process was reaped, and all pipes are closed """
+
+
+class ShellProcessReaper(object):
+    """
+    one background thread for all watched processes - so thousands of processes can be started in the background
+    without leaking zombies or file descriptors, and without a thread per process.
+
+    on posix the pipes of all processes are multiplexed with one selector. If os.pidfd_open is available (linux),
+    the exit of a process wakes the selector as well - otherwise the running processes are polled every poll_interval seconds.
+    on windows select does not work on pipes, there each pipe is read by its own thread, and the processes are polled.
+    the thread ends when no process is left to watch, and is started again with the next one - or if it failed.
+
+    >>> import sys
+    >>> reaper = ShellProcessReaper()
+    >>> process = subprocess.Popen([sys.executable, '-c', 'print("test")'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> watched_process = WatchedProcess(process)
+    >>> reaper.watch(watched_process)
+    >>> reaper.wait_idle(timeout=10)
+    True
+    >>> process.returncode, process.stdout.closed, reaper.get_watched_processes()
+    (0, True, [])
+
+    >>> # test deadline
+    >>> process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(10)'])
+    >>> watched_process = WatchedProcess(process, deadline=time.monotonic() + 0.2)
+    >>> reaper.watch(watched_process)
+    >>> reaper.wait_idle(timeout=10)
+    True
+    >>> watched_process.timed_out, process.returncode != 0
+    (True, True)
+
+    >>> # test the thread is started again by the next process, after it failed
+    >>> def get_select_timeout_failing(l_watched):
+    ...     raise RuntimeError('test')
+    >>> reaper._get_select_timeout = get_select_timeout_failing
+    >>> process = subprocess.Popen([sys.executable, '-c', 'print("test")'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> reaper.watch(WatchedProcess(process))
+    >>> while reaper._thread is not None:
+    ...     time.sleep(0.01)
+    >>> del reaper._get_select_timeout
+    >>> process2 = subprocess.Popen([sys.executable, '-c', 'print("test")'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    >>> reaper.watch(WatchedProcess(process2))
+    >>> reaper.wait_idle(timeout=10)
+    True
+    >>> process.returncode, process2.returncode
+    (0, 0)
+
+    """
+    def __init__(self, poll_interval: float = lib_shell_pass_output.process_poll_interval) -> None:
+        self.poll_interval = poll_interval              # type: float
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # the processes watched, and the processes added but not registered by the thread yet
+        self._watched = set()                           # type: Set[WatchedProcess]
+        self._pending = list()                          # type: List[WatchedProcess]
+        self._thread = None                             # type: Optional[threading.Thread]
+        # the selector is used only by the thread, on posix - the pidfd of each process, if pidfd_open is available
+        self._selector = None                           # type: Optional[selectors.BaseSelector]
+        self._pidfds = dict()                           # type: Dict[WatchedProcess, int]
+        self._wakeup_read = -1                          # type: int
+        self._wakeup_write = -1                         # type: int
+        # on windows there is no selector, the thread waits for this event between the polls
+        self._wakeup_event = threading.Event()
+
+    def watch(self, watched_process: WatchedProcess) -> None:
+        """ starts to watch the process - stdin is closed, if it is a pipe nobody writes to """
+        if watched_process.process.stdin is not None:
+            watched_process.process.stdin.close()
+        with self._lock:
+            if self._selector is None and not lib_platform.get_is_platform_windows():
+                self._selector = selectors.DefaultSelector()
+                self._wakeup_read, self._wakeup_write = os.pipe()
+                os.set_blocking(self._wakeup_read, False)
+                os.set_blocking(self._wakeup_write, False)
+                self._selector.register(self._wakeup_read, selectors.EVENT_READ, None)
+            self._watched.add(watched_process)
+            self._pending.append(watched_process)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='lib_shell_reaper', daemon=True)
+                self._thread.start()
+        if self._selector is None:
+            self._wakeup_event.set()    # pragma: no cover
+        else:
+            try:
+                os.write(self._wakeup_write, b'\0')
+            except BlockingIOError:
+                # the pipe is full - the reaper thread is woken up anyway
+                pass
+
+    def get_watched_processes(self) -> List[WatchedProcess]:
+        with self._lock:
+            return list(self._watched)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """ waits until no process is watched anymore - returns False if the timeout was reached """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._watched, timeout=timeout)
+
+    def _run(self) -> None:
+        selector = self._selector
+        try:
+            while True:
+                with self._lock:
+                    if not self._watched:
+                        self._thread = None
+                        return
+                    l_pending, self._pending = self._pending, list()
+                    l_watched = list(self._watched)
+
+                for watched_process in l_pending:
+                    self._register(selector, watched_process)
+
+                select_timeout = self._get_select_timeout(l_watched)
+                if selector is None:
+                    self._wakeup_event.wait(select_timeout)     # pragma: no cover
+                    self._wakeup_event.clear()                  # pragma: no cover
+                else:
+                    self._select(selector, select_timeout)
+
+                now = time.monotonic()
+                for watched_process in l_watched:
+                    self._check(selector, watched_process, now)
+        except Exception:       # pragma: no cover
+            lib_shell_pass_output.logger.error('the reaper of the background processes failed', exc_info=True)
+        finally:
+            # after a failure, the thread is started again by the next call of watch
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+                self._idle.notify_all()
+
+    def _select(self, selector: selectors.BaseSelector, select_timeout: Optional[float]) -> None:
+        for key, _ in selector.select(timeout=select_timeout):
+            if key.data is None:
+                _drain_wakeup(self._wakeup_read)
+                continue
+            watched_process, pipe_name = key.data
+            if pipe_name == 'exit':
+                self._unregister_pidfd(selector, watched_process)
+                self._set_exited(watched_process)
+                continue
+            try:
+                chunk = os.read(key.fd, lib_shell_pass_output.chunk_size)
+            except BlockingIOError:     # pragma: no cover
+                continue
+            if chunk:
+                self._call(watched_process.on_output, pipe_name, chunk)
+            else:
+                selector.unregister(key.fileobj)
+                watched_process.pipes.pop(pipe_name).close()
+
+    def _register(self, selector: Optional[selectors.BaseSelector], watched_process: WatchedProcess) -> None:
+        if selector is None:
+            _start_pipe_threads(watched_process)    # pragma: no cover
+            return                                  # pragma: no cover
+        for pipe_name, pipe in watched_process.pipes.items():
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe, selectors.EVENT_READ, (watched_process, pipe_name))
+        if hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(watched_process.process.pid)     # type: ignore
+            except OSError:     # pragma: no cover
+                # the kernel does not support it, or the process is reaped already - then we poll
+                return
+            self._pidfds[watched_process] = pidfd
+            selector.register(pidfd, selectors.EVENT_READ, (watched_process, 'exit'))
+
+    def _unregister_pidfd(self, selector: Optional[selectors.BaseSelector], watched_process: WatchedProcess) -> None:
+        pidfd = self._pidfds.pop(watched_process, None)
+        if pidfd is not None and selector is not None:
+            selector.unregister(pidfd)
+            os.close(pidfd)
+
+    def _get_select_timeout(self, l_watched: List[WatchedProcess]) -> Optional[float]:
+        """ blocks until an event arrives, unless some process needs to be polled, or some deadline is due """
+        select_timeout = None       # type: Optional[float]
+        for watched_process in l_watched:
+            if watched_process.exited or watched_process not in self._pidfds:
+                select_timeout = self.poll_interval
+            if watched_process.deadline is not None and not watched_process.exited:
+                deadline_timeout = max(0.0, watched_process.deadline - time.monotonic())
+                select_timeout = deadline_timeout if select_timeout is None else min(select_timeout, deadline_timeout)
+        return select_timeout
+
+    def _set_exited(self, watched_process: WatchedProcess) -> None:
+        # poll reaps the process, so it does not linger as zombie
+        if lib_shell_spawn.poll_process(watched_process.process) is not None:
+            watched_process.exited = True
+            watched_process.exit_time = time.monotonic()
+
+    def _check(self, selector: Optional[selectors.BaseSelector], watched_process: WatchedProcess, now: float) -> None:
+        if not watched_process.exited:
+            if watched_process not in self._pidfds:
+                self._set_exited(watched_process)
+            if not watched_process.exited and watched_process.deadline is not None and now >= watched_process.deadline:
+                watched_process.timed_out = True
+                lib_shell_helpers.kill_process_tree(watched_process.process)
+            return
+
+        if watched_process.pipes:
+            if now - watched_process.exit_time < self.poll_interval:
+                # after the process exited, we drain the pipes one more time before we give up
+                return
+            for pipe_name, pipe in list(watched_process.pipes.items()):
+                # the process is gone, but the pipe is still held open - maybe by a child process of the command
+                if watched_process.report_pipes_not_closed:
+                    lib_shell_pass_output.report_pipe_not_closed(process=watched_process.process, pipe_name=pipe_name)
+                else:
+                    lib_shell_pass_output.logger.debug(f'the pipe {pipe_name} of the process {watched_process.process.pid} is still open '
+                                                       f'after the process exited, it is closed')
+                if selector is not None and pipe in selector.get_map():
+                    selector.unregister(pipe)
+                pipe.close()
+            watched_process.pipes.clear()
+
+        self._unregister_pidfd(selector, watched_process)
+        with self._lock:
+            self._watched.discard(watched_process)
+        self._call(watched_process.on_complete)
+
+    @staticmethod
+    def _call(method: Any, *args: Any) -> None:
+        try:
+            method(*args)
+        except Exception:   # noqa - a failing callback must not stop the reaper
+            lib_shell_pass_output.logger.warning(f'the callback {method!r} of the reaper failed', exc_info=True)
+
+
+def _drain_wakeup(wakeup_read: int) -> None:
+    try:
+        while os.read(wakeup_read, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def _start_pipe_threads(watched_process: WatchedProcess) -> None:                      # pragma: no cover
+    """ on windows, each pipe is read by its own thread - the pipe is removed from watched_process.pipes at end-of-file """
+    def read_pipe(pipe_name: str, pipe: Any) -> None:
+        while True:
+            chunk = pipe.read1(lib_shell_pass_output.chunk_size)
+            if not chunk:
+                break
+            ShellProcessReaper._call(watched_process.on_output, pipe_name, chunk)
+        watched_process.pipes.pop(pipe_name, None)
+        pipe.close()
+
+    for pipe_name, pipe in list(watched_process.pipes.items()):
+        threading.Thread(target=read_pipe, args=(pipe_name, pipe), name='lib_shell_reaper_pipe', daemon=True).start()
+
+
+# the reaper of the background jobs, and of the commands run with wait_finish=False
+shell_process_reaper = ShellProcessReaper()
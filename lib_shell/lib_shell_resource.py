@@ -0,0 +1,76 @@
+# STDLIB
+import sys
+from typing import Any, Optional
+
+
+class ShellCommandResourceUsage(object):
+    """
+    the resources used by a command, all times in seconds.
+
+    wall_time        : from starting the process until the returncode was known
+    spawn_time       : the time to start the process
+    communicate_time : the time to read the output and wait for the process
+    decode_time      : the time to decode the output - 0.0 if the output was not decoded at once
+    user_time        : the cpu time the process (and its waited for children) spent in user mode, None if not available
+    system_time      : the cpu time the process (and its waited for children) spent in kernel mode, None if not available
+    max_rss          : the peak resident set size of the process (or its largest waited for child) in bytes, None if not available
+    stdout_size      : the number of bytes read from stdout, including output spilled to disk
+    stderr_size      : the number of bytes read from stderr, including output spilled to disk
+
+    user_time, system_time and max_rss are collected on posix with os.wait4 when the process is reaped,
+    if conf_lib_shell.collect_rusage is set - see lib_shell_spawn.wait_process.
+
+    >>> resource_usage = ShellCommandResourceUsage()
+    >>> resource_usage.user_time is None
+    True
+
+    """
+    def __init__(self) -> None:
+        self.wall_time = 0.0                # type: float
+        self.spawn_time = 0.0               # type: float
+        self.communicate_time = 0.0         # type: float
+        self.decode_time = 0.0              # type: float
+        self.user_time = None               # type: Optional[float]
+        self.system_time = None             # type: Optional[float]
+        self.max_rss = None                 # type: Optional[int]
+        self.stdout_size = 0                # type: int
+        self.stderr_size = 0                # type: int
+
+    def set_rusage(self, rusage: Any) -> None:
+        """
+        sets user_time, system_time and max_rss from a resource.struct_rusage, like returned by os.wait4 - None is ignored
+
+        >>> import collections
+        >>> Rusage = collections.namedtuple('Rusage', 'ru_utime ru_stime ru_maxrss')
+        >>> resource_usage = ShellCommandResourceUsage()
+        >>> resource_usage.set_rusage(Rusage(ru_utime=1.5, ru_stime=0.5, ru_maxrss=1024))
+        >>> assert resource_usage.user_time == 1.5 and resource_usage.system_time == 0.5
+        >>> assert resource_usage.max_rss in (1024, 1024 * 1024)
+
+        """
+        if rusage is None:
+            return
+        self.user_time = float(rusage.ru_utime)
+        self.system_time = float(rusage.ru_stime)
+        self.max_rss = get_max_rss_bytes(rusage.ru_maxrss)
+
+    def __repr__(self) -> str:
+        return (f'ShellCommandResourceUsage(wall_time={self.wall_time:.6f}, spawn_time={self.spawn_time:.6f}, '
+                f'communicate_time={self.communicate_time:.6f}, decode_time={self.decode_time:.6f}, '
+                f'user_time={self.user_time}, system_time={self.system_time}, max_rss={self.max_rss}, '
+                f'stdout_size={self.stdout_size}, stderr_size={self.stderr_size})')
+
+
+def get_max_rss_bytes(ru_maxrss: int) -> int:
+    """
+    returns ru_maxrss in bytes - it is reported in bytes on macOS, and in kilobytes on linux and the BSDs
+
+    >>> if sys.platform == 'darwin':
+    ...     assert get_max_rss_bytes(1024) == 1024
+    ... else:
+    ...     assert get_max_rss_bytes(1024) == 1024 * 1024
+
+    """
+    if sys.platform == 'darwin':
+        return int(ru_maxrss)
+    return int(ru_maxrss) * 1024
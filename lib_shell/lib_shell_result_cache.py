@@ -0,0 +1,324 @@
+# STDLIB
+import os
+import pathlib
+import stat
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+# OWN
+import lib_platform
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from . import lib_shell_cache               # type: ignore # pragma: no cover
+    from . import lib_shell_pass_output         # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    import lib_shell_cache                      # type: ignore # pragma: no cover
+    import lib_shell_pass_output                # type: ignore # pragma: no cover
+
+
+class ShellResultCache(object):
+    """
+    caches the responses of idempotent, read only commands - pass it as result_cache to lib_shell.run_shell_command.
+    only responses of commands which succeeded (returncode 0, not timed out) are cached.
+
+    max_size       : the maximum number of responses kept in memory, the least recently used are evicted
+    ttl            : the time to live of a response in seconds, None for no expiry
+    max_total_size : the maximum size of the output kept in memory (characters or bytes), None for no limit
+    directory      : a directory to store the responses on disk, shared by all processes using the same directory - None for memory only.
+                     the files expire with the ttl as well, at most max_size files are kept.
+                     the directory is created with mode 0o700. On posix it is not used (with a warning), if it is not owned
+                     by the current user or writable by group or others - another user could plant forged responses there.
+
+    the key of a response is the command, the user and sudo, the environment and the working directory, the options changing
+    the output, and the modification time and size of the files the command depends on (see get_cache_key) -
+    so a response is not returned anymore, when one of those files changed.
+
+    get_stats() returns the hits (the spawns saved), misses, the hits from disk, the responses stored,
+    and the evictions and expirations of the responses in memory.
+
+    >>> import collections
+    >>> Response = collections.namedtuple('Response', 'returncode executable encoding stdout stderr stdout_bytes stderr_bytes '
+    ...                                   'stdout_truncated_bytes stderr_truncated_bytes timed_out')
+    >>> response = Response(0, 'echo', 'utf-8', 'test', '', b'', b'', 0, 0, False)
+    >>> result_cache = ShellResultCache()
+    >>> cache_key = get_cache_key(['echo', 'test'])
+    >>> result_cache.get(cache_key) is None
+    True
+    >>> result_cache.set(cache_key, response, decode=True)
+    >>> result_cache.get(cache_key)['stdout']
+    'test'
+    >>> result_cache.get_stats()
+    {'hits': 1, 'misses': 1, 'disk_hits': 0, 'stores': 1, 'evictions': 0, 'expirations': 0, 'size': 1}
+
+    >>> # test the store on disk, shared by the caches using the same directory
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     ShellResultCache(directory=directory).set(cache_key, response, decode=True)
+    ...     result_cache = ShellResultCache(directory=directory)
+    ...     print(result_cache.get(cache_key)['stdout'], result_cache.disk_hits)
+    ...     result_cache.clear()
+    ...     print(result_cache.get(cache_key), os.listdir(directory))
+    test 1
+    None []
+
+    >>> # test a directory writable by others is not used
+    >>> if lib_platform.get_is_platform_posix():
+    ...     with tempfile.TemporaryDirectory() as directory:
+    ...         os.chmod(directory, 0o777)
+    ...         result_cache = ShellResultCache(directory=directory)
+    ...         result_cache.set(cache_key, response, decode=True)
+    ...         print(os.listdir(directory), result_cache._read_entry(cache_key))
+    ... else:
+    ...     print([], None)
+    [] None
+
+    """
+    def __init__(self,
+                 max_size: int = 256,
+                 ttl: Optional[float] = 60.0,
+                 max_total_size: Optional[int] = 64 * 1024 * 1024,
+                 directory: Optional[Union[str, os.PathLike]] = None) -> None:     # type: ignore
+        self.max_size = max_size                    # type: int
+        self.ttl = ttl                              # type: Optional[float]
+        self.directory = None if directory is None else pathlib.Path(directory)    # type: Optional[pathlib.Path]
+        # the entries are stored with the wall clock time, so the ttl works across processes
+        self._memory_cache = lib_shell_cache.LruTtlCache(max_size=max_size, ttl=ttl, clock=time.time,
+                                                         max_total_size=max_total_size, get_value_size=_get_entry_size)
+        self._lock = threading.Lock()
+        self.hits = 0                               # type: int
+        self.misses = 0                             # type: int
+        self.disk_hits = 0                          # type: int
+        self.stores = 0                             # type: int
+        self._is_directory_unsafe_reported = False  # type: bool
+
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """ returns the cached entry (see get_entry) or None - the entry must not be modified """
+        entry = self._memory_cache.get(cache_key)
+        if entry is not None and self.ttl is not None and time.time() - entry['created'] > self.ttl:
+            # the entry was read from disk, it was created earlier than it was cached in memory
+            self._memory_cache.delete(cache_key)
+            entry = None
+        if entry is None and self.directory is not None:
+            entry = self._read_entry(cache_key)
+            if entry is not None:
+                self._memory_cache.set(cache_key, entry)
+                with self._lock:
+                    self.disk_hits = self.disk_hits + 1
+        with self._lock:
+            if entry is None:
+                self.misses = self.misses + 1
+            else:
+                self.hits = self.hits + 1
+        return entry
+
+    def set(self, cache_key: str, response: Any, decode: bool) -> None:
+        """ caches the response (a lib_shell.ShellCommandResponse) - the decoded output with decode=True, otherwise the raw output """
+        entry = get_entry(response, decode=decode)
+        self._memory_cache.set(cache_key, entry)
+        if self.directory is not None:
+            self._write_entry(cache_key, entry)
+        with self._lock:
+            self.stores = self.stores + 1
+
+    def delete(self, cache_key: str) -> None:
+        """ removes the response of the key, from memory and from disk """
+        self._memory_cache.delete(cache_key)
+        if self.directory is not None and self._get_is_directory_safe():
+            _remove_file(self._get_path(cache_key))
+
+    def clear(self) -> None:
+        """ removes all responses from memory and from disk, and resets the statistics """
+        self._memory_cache.clear()
+        if self.directory is not None and self.directory.is_dir() and self._get_is_directory_safe():
+            for path in self.directory.glob('*.json'):
+                _remove_file(path)
+        with self._lock:
+            self.hits = self.misses = self.disk_hits = self.stores = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        memory_stats = self._memory_cache.get_stats()
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'disk_hits': self.disk_hits, 'stores': self.stores,
+                    'evictions': memory_stats['evictions'], 'expirations': memory_stats['expirations'], 'size': memory_stats['size']}
+
+    def _get_path(self, cache_key: str) -> pathlib.Path:
+        return self.directory / (cache_key + '.json')     # type: ignore
+
+    def _read_entry(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        if not self._get_is_directory_safe():
+            return None
+        path = self._get_path(cache_key)
+        try:
+            with open(str(path), mode='r', encoding='utf-8') as entry_file:
+                entry = _load_entry(entry_file.read())
+        except (OSError, ValueError, KeyError):
+            # not cached, or removed by another process meanwhile
+            return None
+        if self.ttl is not None and time.time() - entry['created'] > self.ttl:
+            _remove_file(path)
+            return None
+        return entry
+
+    def _write_entry(self, cache_key: str, entry: Dict[str, Any]) -> None:
+        """ the file is replaced atomically, so other processes never read a partial file """
+        # imported here, to keep the import of lib_shell cheap
+        import tempfile
+
+        assert self.directory is not None
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if not self._get_is_directory_safe():
+            return
+        file_descriptor, temp_path = tempfile.mkstemp(dir=str(self.directory), suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, mode='w', encoding='utf-8') as entry_file:
+                entry_file.write(_dump_entry(entry))
+            os.replace(temp_path, str(self._get_path(cache_key)))
+        except BaseException:
+            _remove_file(pathlib.Path(temp_path))
+            raise
+        self._prune_directory()
+
+    def _get_is_directory_safe(self) -> bool:
+        """
+        returns False if the directory is not owned by the current user, or writable by group or others (posix only) -
+        that is logged as warning once. A missing directory is safe, it is created with mode 0o700.
+
+        """
+        assert self.directory is not None
+        if not lib_platform.get_is_platform_posix():
+            return True     # pragma: no cover
+        try:
+            stat_result = os.stat(str(self.directory))
+        except FileNotFoundError:
+            return True
+        if stat_result.st_uid == os.getuid() and not stat_result.st_mode & (stat.S_IWGRP | stat.S_IWOTH):    # type: ignore
+            return True
+        if not self._is_directory_unsafe_reported:
+            self._is_directory_unsafe_reported = True
+            lib_shell_pass_output.logger.warning(f'the result cache directory "{self.directory}" is not used - '
+                                                 f'it is not owned by the current user, or writable by group or others')
+        return False
+
+    def _prune_directory(self) -> None:
+        """ removes the oldest files, if there are more than max_size """
+        assert self.directory is not None
+        l_entries = list()      # type: List[Tuple[float, str]]
+        with os.scandir(str(self.directory)) as it_entries:
+            for dir_entry in it_entries:
+                if dir_entry.name.endswith('.json'):
+                    try:
+                        l_entries.append((dir_entry.stat().st_mtime, dir_entry.path))
+                    except OSError:
+                        pass
+        if len(l_entries) > self.max_size:
+            for mtime, path in sorted(l_entries)[:len(l_entries) - self.max_size]:
+                _remove_file(pathlib.Path(path))
+
+
+def get_cache_key(ls_command: Iterable[Any],
+                  dependencies: Iterable[Union[str, os.PathLike]] = (),      # type: ignore
+                  **options: Any) -> str:
+    """
+    returns the key of a command : a hash of the command, the options, and the modification time and size
+    of each dependency (a file or directory the output depends on). A missing dependency is part of the key as well.
+    the options must be built from str, int, float, bool, None and tuples or dicts of those.
+    a relative cwd, and no cwd, is resolved against the current directory.
+
+    >>> get_cache_key(['echo', 'test']) == get_cache_key(('echo', 'test'))
+    True
+    >>> get_cache_key(['echo', 'test']) == get_cache_key(['echo', 'test'], use_sudo=True)
+    False
+
+    >>> # the key changes, if a dependency changes
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     path = pathlib.Path(directory) / 'test.txt'
+    ...     key_missing = get_cache_key(['cat', str(path)], dependencies=[path])
+    ...     _ = path.write_text('test')
+    ...     key_created = get_cache_key(['cat', str(path)], dependencies=[path])
+    ...     _ = path.write_text('test2')
+    ...     key_changed = get_cache_key(['cat', str(path)], dependencies=[path])
+    >>> len({key_missing, key_created, key_changed})
+    3
+
+    """
+    # imported here, to keep the import of lib_shell cheap
+    import hashlib
+    import json
+
+    options = dict(options)
+    options['cwd'] = os.path.abspath(str(options.get('cwd') or '.'))
+    l_dependencies = list()     # type: List[Any]
+    for dependency in dependencies:
+        try:
+            stat_result = os.stat(dependency)
+            l_dependencies.append([os.fspath(dependency), stat_result.st_mtime_ns, stat_result.st_size])
+        except OSError:
+            l_dependencies.append([os.fspath(dependency), None, None])
+    key_data = {'ls_command': [str(argument) for argument in ls_command], 'options': options, 'dependencies': l_dependencies}
+    s_key_data = json.dumps(key_data, sort_keys=True, default=str)
+    return hashlib.sha256(s_key_data.encode('utf-8')).hexdigest()
+
+
+def get_entry(response: Any, decode: bool) -> Dict[str, Any]:
+    """ returns the entry cached for a response - the decoded output with decode=True, otherwise the raw output """
+    entry = {'returncode': response.returncode,
+             'executable': response.executable,
+             'encoding': response.encoding if decode else '',
+             'stdout': response.stdout if decode else None,
+             'stderr': response.stderr if decode else None,
+             'stdout_bytes': b'' if decode else response.stdout_bytes,
+             'stderr_bytes': b'' if decode else response.stderr_bytes,
+             'stdout_truncated_bytes': response.stdout_truncated_bytes,
+             'stderr_truncated_bytes': response.stderr_truncated_bytes,
+             'created': time.time()}
+    return entry
+
+
+def _get_entry_size(entry: Dict[str, Any]) -> int:
+    return sum(len(entry[name] or '') for name in ('stdout', 'stderr', 'stdout_bytes', 'stderr_bytes'))
+
+
+def _dump_entry(entry: Dict[str, Any]) -> str:
+    """
+    >>> entry = {'stdout': None, 'stdout_bytes': b'\\x00test', 'stderr_bytes': b''}
+    >>> _load_entry(_dump_entry(entry)) == entry
+    True
+
+    """
+    # imported here, to keep the import of lib_shell cheap
+    import base64
+    import json
+
+    entry = dict(entry)
+    for name in ('stdout_bytes', 'stderr_bytes'):
+        entry[name] = base64.b64encode(entry[name]).decode('ascii')
+    return json.dumps(entry)
+
+
+def _load_entry(s_entry: str) -> Dict[str, Any]:
+    # imported here, to keep the import of lib_shell cheap
+    import base64
+    import json
+
+    entry = json.loads(s_entry)
+    for name in ('stdout_bytes', 'stderr_bytes'):
+        entry[name] = base64.b64decode(entry[name])
+    return entry   # type: ignore
+
+
+def _remove_file(path: pathlib.Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        # removed by another process meanwhile
+        pass
+
+
+# a cache for all commands of the process - pass it as result_cache to lib_shell.run_shell_command
+shell_result_cache = ShellResultCache()
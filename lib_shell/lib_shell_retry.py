@@ -0,0 +1,123 @@
+# STDLIB
+import re
+from typing import Any, Callable, Collection, List, Optional, Pattern, Union
+
+
+class RetryPolicy(object):
+    """
+    decides if and when a failed command is tried again.
+
+    max_attempts             : the maximum number of attempts, including the first one
+    backoff_initial          : the delay in seconds before the second attempt
+    backoff_multiplier       : the delay is multiplied by that factor for each further attempt (exponential backoff)
+    backoff_max              : the maximum delay in seconds between two attempts
+    jitter                   : 0.0 - 1.0, the part of the delay which is randomized - with 1.0 the delay is chosen randomly
+                               between 0 and the backoff delay (full jitter), so many hosts retrying on the same shared
+                               resource (like the apt lock) do not retry all at the same time
+    max_total_duration       : no further attempt is started, if it would start later than max_total_duration seconds after the first attempt
+    retry_on_returncodes     : only those returncodes are retried - None to retry any returncode not zero
+    retry_on_stderr_patterns : only retry if stderr matches one of those regular expressions - None to retry regardless of stderr
+    retry_predicate          : a callable which gets the ShellCommandResponse and returns True if the command should be retried.
+                               it is checked in addition to retry_on_returncodes and retry_on_stderr_patterns
+
+    the default policy retries any returncode not zero without delay, like lib_shell did always.
+
+    >>> policy = RetryPolicy(max_attempts=4, backoff_initial=1, backoff_multiplier=2, backoff_max=3)
+    >>> [policy.get_backoff_delay(attempt) for attempt in range(1, 4)]
+    [1.0, 2.0, 3.0]
+    >>> policy = RetryPolicy(backoff_initial=1, jitter=1.0)
+    >>> assert all(0.0 <= policy.get_backoff_delay(1) <= 1.0 for _ in range(100))
+
+    """
+    def __init__(self,
+                 max_attempts: int = 3,
+                 backoff_initial: float = 0.0,
+                 backoff_multiplier: float = 2.0,
+                 backoff_max: float = 60.0,
+                 jitter: float = 0.0,
+                 max_total_duration: Optional[float] = None,
+                 retry_on_returncodes: Optional[Collection[int]] = None,
+                 retry_on_stderr_patterns: Optional[List[Union[str, Pattern[str]]]] = None,
+                 retry_predicate: Optional[Callable[[Any], bool]] = None) -> None:
+        if max_attempts < 1:
+            raise ValueError(f'max_attempts must be at least 1, not {max_attempts}')
+        if not 0.0 <= jitter <= 1.0:
+            raise ValueError(f'jitter must be between 0.0 and 1.0, not {jitter}')
+        self.max_attempts = max_attempts                            # type: int
+        self.backoff_initial = backoff_initial                      # type: float
+        self.backoff_multiplier = backoff_multiplier                # type: float
+        self.backoff_max = backoff_max                              # type: float
+        self.jitter = jitter                                        # type: float
+        self.max_total_duration = max_total_duration                # type: Optional[float]
+        self.retry_on_returncodes = retry_on_returncodes            # type: Optional[Collection[int]]
+        self.retry_on_stderr_patterns = None                        # type: Optional[List[Pattern[str]]]
+        if retry_on_stderr_patterns is not None:
+            self.retry_on_stderr_patterns = [re.compile(pattern) for pattern in retry_on_stderr_patterns]
+        self.retry_predicate = retry_predicate                      # type: Optional[Callable[[Any], bool]]
+
+    def get_is_retryable(self, response: Any) -> bool:
+        """
+        returns True if the failed response should be retried, according to returncode, stderr and the retry_predicate
+
+        >>> class Response(object):
+        ...     def __init__(self, returncode, stderr):
+        ...         self.returncode = returncode
+        ...         self.stderr = stderr
+        >>> policy = RetryPolicy(retry_on_returncodes=[100], retry_on_stderr_patterns=[r'Could not get lock'])
+        >>> policy.get_is_retryable(Response(100, 'E: Could not get lock /var/lib/dpkg/lock'))
+        True
+        >>> policy.get_is_retryable(Response(100, 'E: Unable to locate package'))
+        False
+        >>> policy.get_is_retryable(Response(1, 'E: Could not get lock /var/lib/dpkg/lock'))
+        False
+        >>> RetryPolicy(retry_predicate=lambda response: response.returncode > 1).get_is_retryable(Response(1, ''))
+        False
+        >>> RetryPolicy().get_is_retryable(Response(0, ''))
+        False
+
+        """
+        if response.returncode == 0:
+            return False
+        if self.retry_on_returncodes is not None and response.returncode not in self.retry_on_returncodes:
+            return False
+        if self.retry_on_stderr_patterns is not None:
+            stderr = response.stderr
+            if not any(pattern.search(stderr) for pattern in self.retry_on_stderr_patterns):
+                return False
+        if self.retry_predicate is not None and not self.retry_predicate(response):
+            return False
+        return True
+
+    def get_backoff_delay(self, attempt: int) -> float:
+        """ returns the delay in seconds after the given attempt (starting with 1) failed """
+        delay = min(self.backoff_initial * self.backoff_multiplier ** (attempt - 1), self.backoff_max)
+        if self.jitter and delay:
+            # imported here, to keep the import of lib_shell cheap
+            import random
+            delay = delay * (1.0 - self.jitter * random.random())
+        return float(delay)
+
+    def get_retry_delay(self, response: Any, attempt: int, elapsed: float) -> Optional[float]:
+        """
+        returns the delay in seconds before the next attempt, or None if the command should not be retried.
+        attempt : the number of the attempt which failed, starting with 1
+        elapsed : the seconds elapsed since the first attempt started
+
+        >>> class Response(object):
+        ...     returncode = 1
+        ...     stderr = ''
+        >>> policy = RetryPolicy(max_attempts=3, backoff_initial=1, max_total_duration=5)
+        >>> policy.get_retry_delay(Response(), attempt=1, elapsed=0.5)
+        1.0
+        >>> # the maximum number of attempts is reached
+        >>> policy.get_retry_delay(Response(), attempt=3, elapsed=0.5)
+        >>> # the next attempt would start after max_total_duration
+        >>> policy.get_retry_delay(Response(), attempt=2, elapsed=3.5)
+
+        """
+        if attempt >= self.max_attempts or not self.get_is_retryable(response):
+            return None
+        delay = self.get_backoff_delay(attempt)
+        if self.max_total_duration is not None and elapsed + delay > self.max_total_duration:
+            return None
+        return delay
@@ -0,0 +1,258 @@
+# STDLIB
+import os
+import selectors
+import shlex
+import subprocess
+import threading
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+# OWN
+import lib_platform
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+    from . import lib_shell                     # type: ignore # pragma: no cover
+    from . import lib_shell_encoding            # type: ignore # pragma: no cover
+    from . import lib_shell_env                 # type: ignore # pragma: no cover
+    from . import lib_shell_log                 # type: ignore # pragma: no cover
+    from . import lib_shell_pass_output         # type: ignore # pragma: no cover
+    from . import lib_shell_spawn               # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+    import lib_shell                            # type: ignore # pragma: no cover
+    import lib_shell_encoding                   # type: ignore # pragma: no cover
+    import lib_shell_env                        # type: ignore # pragma: no cover
+    import lib_shell_log                        # type: ignore # pragma: no cover
+    import lib_shell_pass_output                # type: ignore # pragma: no cover
+    import lib_shell_spawn                      # type: ignore # pragma: no cover
+
+
+class ShellSession(object):
+    """
+    keeps one shell process (bash or sh) alive and runs many commands in it - that saves the fork/exec,
+    the environment copy and the pipe setup for each command. Only available on posix.
+
+    each command is sent over stdin, and is followed by sentinel markers on stdout (with the returncode) and stderr,
+    which are used to split the output of the commands. The command itself reads from /dev/null.
+    the commands run in the same shell - so changes of the working directory or of variables persist between commands.
+    if a command terminates the shell (like "exit 3"), the returncode of the shell is returned,
+    and a new shell is started with the next command.
+
+    >>> if lib_platform.get_is_platform_posix():
+    ...     with ShellSession() as session:
+    ...         response = session.run_shell_command('echo test')
+    ...         assert response.stdout == 'test'
+    ...         assert response.returncode == 0
+    ...         response = session.run_shell_command('echo error >&2; exit 3', raise_on_returncode_not_zero=False, quiet=True)
+    ...         assert response.stderr.strip() == 'error'
+    ...         assert response.returncode == 3
+    ...         # a new shell is started after exit
+    ...         response = session.run_shell_ls_command(['echo', 'mäßig böse büßer'])
+    ...         assert response.stdout == 'mäßig böse büßer'
+
+    """
+    def __init__(self,
+                 shell_executable: str = 'bash',
+                 use_sudo: bool = False,
+                 run_as_user: str = '') -> None:
+        self.shell_executable = shell_executable        # type: str
+        self.use_sudo = use_sudo                        # type: bool
+        self.run_as_user = run_as_user                  # type: str
+        self.process = None                             # type: Optional[subprocess.Popen]  # type: ignore
+        self._selector = None                           # type: Optional[selectors.BaseSelector]
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """ starts the shell - called on the first command, or after the shell terminated """
+        if lib_platform.get_is_platform_windows():
+            raise RuntimeError('ShellSession is only available on posix')     # pragma: no cover
+        self._close_process()
+        ls_command = [self.shell_executable]
+        if os.path.basename(self.shell_executable) == 'bash':
+            ls_command = ls_command + ['--noprofile', '--norc']
+        ls_command = lib_shell.prepend_sudo_and_run_as_user(ls_command=ls_command, shell=False, run_as_user=self.run_as_user, use_sudo=self.use_sudo)
+        self.process = lib_shell_spawn.popen(ls_command,
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE,
+                                             stderr=subprocess.PIPE,
+                                             env=lib_shell_env.get_env_with_overrides())
+        self._selector = selectors.DefaultSelector()
+        for pipe_name, pipe in (('stdout', self.process.stdout), ('stderr', self.process.stderr)):
+            os.set_blocking(pipe.fileno(), False)       # type: ignore
+            self._selector.register(pipe, selectors.EVENT_READ, pipe_name)
+
+    def get_is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def run_shell_command(self,
+                          command: str,
+                          raise_on_returncode_not_zero: bool = True,
+                          log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                          quiet: bool = False,
+                          decode: bool = True) -> lib_shell.ShellCommandResponse:
+        """
+        runs the command in the shell of the session - the command is interpreted by the shell, like with shell=True
+
+        >>> import unittest
+        >>> if lib_platform.get_is_platform_posix():
+        ...     session = ShellSession(shell_executable='sh')
+        ...     # the state of the shell persists between the commands
+        ...     response = session.run_shell_command('cd /; test_variable=test')
+        ...     assert session.run_shell_command('pwd').stdout == '/'
+        ...     assert session.run_shell_command('echo $test_variable').stdout == 'test'
+        ...     # test output without line ending, and binary output
+        ...     assert session.run_shell_command('printf test').stdout == 'test'
+        ...     assert session.run_shell_command(r'printf "\\001\\002"', decode=False).stdout_bytes == b'\\x01\\x02'
+        ...     # test returncode not zero, raising Exception
+        ...     unittest.TestCase().assertRaises(subprocess.CalledProcessError, session.run_shell_command, 'false', quiet=True)
+        ...     # test a syntax error does not hang the session
+        ...     response = session.run_shell_command('echo "test', raise_on_returncode_not_zero=False, quiet=True)
+        ...     assert response.returncode != 0
+        ...     # the command reads from /dev/null, and not the commands of the session
+        ...     assert session.run_shell_command('cat').stdout == ''
+        ...     session.close()
+        ...     assert not session.get_is_running()
+
+        """
+        if quiet:
+            actual_log_settings = conf_lib_shell.log_settings_quiet
+        else:
+            actual_log_settings = log_settings
+
+        with self._lock:
+            stdout, stderr, returncode = self._run_command(command)
+
+        response = lib_shell.ShellCommandResponse()
+        response.executable = lib_shell_encoding.get_executable_key([command])
+        response.returncode = returncode
+        response.set_output_bytes(stdout, stderr)
+        if decode:
+            response.decode_output(keep_output_bytes=False)
+
+        if lib_shell_log.get_is_log_enabled(returncode, actual_log_settings):
+            stdout_log, stderr_log = lib_shell.get_output_for_log(response, decode)
+            lib_shell_log.log_results(command, stdout_log, stderr_log, returncode, True, actual_log_settings)
+
+        if returncode != 0 and raise_on_returncode_not_zero:
+            lib_shell.raise_called_process_error(response=response, str_command=command, decode=decode)
+        if decode:
+            response.stdout = response.stdout.strip()
+        return response
+
+    def run_shell_ls_command(self,
+                             ls_command: List[str],
+                             raise_on_returncode_not_zero: bool = True,
+                             log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                             quiet: bool = False,
+                             decode: bool = True) -> lib_shell.ShellCommandResponse:
+        """ like run_shell_command, but the command is passed as list - each element is quoted for the shell """
+        command = ' '.join(shlex.quote(str(s_command)) for s_command in ls_command)
+        response = self.run_shell_command(command=command,
+                                          raise_on_returncode_not_zero=raise_on_returncode_not_zero,
+                                          log_settings=log_settings,
+                                          quiet=quiet,
+                                          decode=decode)
+        return response
+
+    def _run_command(self, command: str) -> Tuple[bytes, bytes, int]:
+        if not self.get_is_running():
+            self.start()
+
+        # the marker is unique for each command, so it can not be confused with the output of the command.
+        # eval runs the command in the current shell, and a syntax error in the command can not swallow the markers
+        marker = 'lib_shell_' + uuid.uuid4().hex
+        script = ('{{ eval {command}\n}} </dev/null\n'
+                  'lib_shell_returncode=$?\n'
+                  "printf '\\n%s %s\\n' {marker} $lib_shell_returncode\n"
+                  "printf '\\n%s\\n' {marker} >&2\n").format(command=shlex.quote(command), marker=marker)
+        try:
+            self.process.stdin.write(script.encode('utf-8'))    # type: ignore
+            self.process.stdin.flush()                          # type: ignore
+        except BrokenPipeError:     # pragma: no cover
+            # the shell terminated in the meantime
+            pass
+        return self._read_command_output(marker=marker.encode('utf-8'))
+
+    def _read_command_output(self, marker: bytes) -> Tuple[bytes, bytes, int]:
+        search_marker = b'\n' + marker
+        outputs = {'stdout': bytearray(), 'stderr': bytearray()}    # type: Dict[str, bytearray]
+        # the position of the marker in the output of each pipe, -1 as long the complete marker line was not read
+        marker_positions = {'stdout': -1, 'stderr': -1}            # type: Dict[str, int]
+        stdout_returncode = None                                    # type: Optional[int]
+        l_pipes_eof = list()                                        # type: List[str]
+
+        while any(position < 0 and pipe_name not in l_pipes_eof for pipe_name, position in marker_positions.items()):
+            events = self._selector.select(timeout=lib_shell_pass_output.process_poll_interval)  # type: ignore
+            if not events:
+                if self.process.poll() is not None:     # type: ignore  # pragma: no cover
+                    break
+                continue
+            for key, _ in events:
+                pipe_name = key.data
+                try:
+                    chunk = os.read(key.fd, lib_shell_pass_output.chunk_size)
+                except BlockingIOError:     # pragma: no cover
+                    continue
+                if not chunk:
+                    # the shell terminated
+                    self._selector.unregister(key.fileobj)  # type: ignore
+                    l_pipes_eof.append(pipe_name)
+                    continue
+                output = outputs[pipe_name]
+                # we search the marker only in the new data, and the end of the data read before - including the returncode after the marker
+                search_start = max(0, len(output) - len(search_marker) - 32)
+                output += chunk
+                position = output.find(search_marker, search_start)
+                if position >= 0 and output.find(b'\n', position + len(search_marker)) >= 0:
+                    marker_positions[pipe_name] = position
+                    if pipe_name == 'stdout':
+                        marker_line = output[position + len(search_marker):].split(b'\n', 1)[0]
+                        stdout_returncode = int(marker_line.strip())
+
+        if stdout_returncode is None or marker_positions['stderr'] < 0:
+            # the shell terminated, the returncode of the shell is the returncode of the command
+            returncode = self.process.wait()    # type: ignore
+            self._close_process()
+            return bytes(outputs['stdout']), bytes(outputs['stderr']), returncode
+
+        stdout = bytes(outputs['stdout'][:marker_positions['stdout']])
+        stderr = bytes(outputs['stderr'][:marker_positions['stderr']])
+        return stdout, stderr, stdout_returncode
+
+    def close(self) -> None:
+        """ terminates the shell """
+        with self._lock:
+            self._close_process()
+
+    def _close_process(self) -> None:
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        if self.process is None:
+            return
+        process = self.process
+        self.process = None
+        try:
+            # closing stdin ends the shell
+            process.stdin.close()           # type: ignore
+        except BrokenPipeError:             # pragma: no cover
+            pass
+        try:
+            process.wait(timeout=1)
+        except subprocess.TimeoutExpired:   # pragma: no cover
+            process.kill()
+            process.wait()
+        for pipe in (process.stdout, process.stderr):
+            if pipe is not None:
+                pipe.close()
+
+    def __enter__(self) -> 'ShellSession':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        self.close()
@@ -1,17 +1,30 @@
+import functools
 import re
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, Pattern, Tuple
 
-import lib_parameter
 import lib_platform
 
 _re_cmd_lex_precompiled_win = re.compile(pattern=r'''"((?:""|\\["\\]|[^"])*)"?()|(\\\\(?=\\*")|\\")|(&&?|\|\|?|\d?>|[<])|([^\s"&|<>]+)|(\s+)|(.)''', flags=0)
 _re_cmd_lex_precompiled_posix = re.compile(pattern=r'''"((?:\\["\\]|[^"])*)"|'([^']*)'|(\\.)|(&&?|\|\|?|\d?\>|[<])|([^\s'"\\&|<>]+)|(\s+)|(.)''', flags=0)
 
+# commandlines without those characters consist only of words and whitespace - they are split with str.split
+_re_special_characters_win = re.compile(pattern=r'''["&|<>]''', flags=0)
+_re_special_characters_posix = re.compile(pattern=r'''['"\\&|<>]''', flags=0)
+
+# the platform is resolved once, on import
+_is_platform_windows = lib_platform.get_is_platform_windows()
+
+# the number of distinct commandlines kept in the cache of _shlex_split - it is applied on import, by the lru_cache decorator
+_shlex_cache_size = 4096
+
 
 def shlex_split_multi_platform(s_commandline: str, is_platform_windows: Optional[bool] = None) -> List[str]:
     """
     its ~10x faster than shlex, which does single-char stepping and streaming;
     and also respects pipe-related characters (unlike shlex).
+    commandlines without quotes, escapes or pipe-related characters are split with str.split,
+    and the results of the last 4096 distinct commandlines are cached.
+    the result is a new list on each call, so the caller might modify it.
 
     from : https://stackoverflow.com/questions/33560364/python-windows-parsing-command-lines-with-shlex
 
@@ -30,17 +43,78 @@ def shlex_split_multi_platform(s_commandline: str, is_platform_windows: Optional
         ...
     ValueError: invalid or incomplete shell string
 
+    >>> # doubled quotes within quotes are one quote on windows - independent of the platform we run on
+    >>> shlex_split_multi_platform('test.exe "a""b"', is_platform_windows=True)
+    ['test.exe', 'a"b']
+    >>> # empty quotes are an empty argument, pieces of one argument are joined
+    >>> shlex_split_multi_platform('echo "" a"b"\\'c\\'', is_platform_windows=False)
+    ['echo', '', 'abc']
+    >>> shlex_split_multi_platform(' echo  test\\n', is_platform_windows=False)
+    ['echo', 'test']
+    >>> # the cached result is not modified by the caller
+    >>> ls_command = shlex_split_multi_platform('echo test', is_platform_windows=False)
+    >>> ls_command.append('modified')
+    >>> shlex_split_multi_platform('echo test', is_platform_windows=False)
+    ['echo', 'test']
+
+    """
+    if is_platform_windows is None:
+        is_platform_windows = _is_platform_windows
+    return list(_shlex_split(s_commandline, bool(is_platform_windows)))
+
+
+def shlex_split_many(s_commandlines: Iterable[str], is_platform_windows: Optional[bool] = None) -> List[List[str]]:
+    """
+    splits many commandlines, like shlex_split_multi_platform - repeated commandlines are split only once
+
+    >>> shlex_split_many(['echo test', 'ls -la | grep "a b"', 'echo test'], is_platform_windows=False)
+    [['echo', 'test'], ['ls', '-la', '|', 'grep', 'a b'], ['echo', 'test']]
+    >>> shlex_split_many(iter([]))
+    []
+
+    """
+    if is_platform_windows is None:
+        is_platform_windows = _is_platform_windows
+    is_platform_windows = bool(is_platform_windows)
+    return [list(_shlex_split(s_commandline, is_platform_windows)) for s_commandline in s_commandlines]
+
+
+def shlex_split_operators(s_commandline: str, is_platform_windows: Optional[bool] = None) -> List[Tuple[str, bool]]:
     """
-    is_platform_windows = lib_parameter.get_default_if_none(
-        is_platform_windows, default=lib_platform.get_is_platform_windows())  # type: ignore
+    like shlex_split_multi_platform, but returns tuples of (token, is_operator) - so a quoted '|' is not taken for a pipe
 
+    >>> shlex_split_operators('echo "|" | grep -v x 2> err.txt', is_platform_windows=False)
+    [('echo', False), ('|', False), ('|', True), ('grep', False), ('-v', False), ('x', False), ('2>', True), ('err.txt', False)]
+
+    """
+    if is_platform_windows is None:
+        is_platform_windows = _is_platform_windows
     if is_platform_windows:
         re_cmd_lex_precompiled = _re_cmd_lex_precompiled_win
     else:
         re_cmd_lex_precompiled = _re_cmd_lex_precompiled_posix
+    return list(_iter_tokens(s_commandline, re_cmd_lex_precompiled, bool(is_platform_windows)))
 
-    args = []
-    acc = None   # collects pieces of one arg
+
+@functools.lru_cache(maxsize=_shlex_cache_size)
+def _shlex_split(s_commandline: str, is_platform_windows: bool) -> Tuple[str, ...]:
+    """ returns the arguments as tuple, so the cached result can not be modified """
+    if is_platform_windows:
+        re_special_characters = _re_special_characters_win
+        re_cmd_lex_precompiled = _re_cmd_lex_precompiled_win
+    else:
+        re_special_characters = _re_special_characters_posix
+        re_cmd_lex_precompiled = _re_cmd_lex_precompiled_posix
+
+    if re_special_characters.search(s_commandline) is None:
+        return tuple(s_commandline.split())
+
+    return tuple(token for token, is_operator in _iter_tokens(s_commandline, re_cmd_lex_precompiled, is_platform_windows))
+
+
+def _iter_tokens(s_commandline: str, re_cmd_lex_precompiled: Pattern[str], is_platform_windows: bool) -> Iterator[Tuple[str, bool]]:
+    """ yields (token, is_operator) - is_operator is True for the pipe-related characters, which were not quoted """
+    acc = None          # type: Optional[List[str]]    # collects pieces of one arg
     for qs, qss, esc, pipe, word, white, fail in re_cmd_lex_precompiled.findall(s_commandline):
         if word:
             pass   # most frequent
@@ -48,23 +122,24 @@ def shlex_split_multi_platform(s_commandline: str, is_platform_windows: Optional
             word = esc[1]
         elif white or pipe:
             if acc is not None:
-                args.append(acc)
+                yield ''.join(acc), False
             if pipe:
-                args.append(pipe)
+                yield pipe, True
             acc = None
             continue
         elif fail:
             raise ValueError("invalid or incomplete shell string")
         elif qs:
             word = qs.replace('\\"', '"').replace('\\\\', '\\')
-            if lib_platform.get_is_platform_windows():
+            if is_platform_windows:
                 word = word.replace('""', '"')
         else:
             word = qss   # may be even empty; must be last
 
-        acc = (acc or '') + word
+        if acc is None:
+            acc = [word]
+        else:
+            acc.append(word)
 
     if acc is not None:
-        args.append(acc)
-
-    return args
+        yield ''.join(acc), False
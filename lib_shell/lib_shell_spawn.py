@@ -0,0 +1,189 @@
+# STDLIB
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+# OWN
+import lib_platform
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+
+
+spawn_backends = ('subprocess', 'posix_spawn')
+
+# the interval to poll a process with os.wait4, if wait_process is called with a timeout
+_wait4_poll_interval = 0.01
+
+# Popen options which force subprocess to fork - with those we use the subprocess backend
+posix_spawn_incompatible_options = ('cwd', 'preexec_fn', 'start_new_session', 'pass_fds', 'user', 'group', 'extra_groups', 'umask', 'process_group')
+
+
+def popen(ls_command: List[str], shell: bool = False, **kwargs: Any) -> subprocess.Popen:     # type: ignore
+    """
+    starts the process with the spawn backend set in conf_lib_shell.spawn_backend, the keyword arguments are passed to subprocess.Popen
+
+    'subprocess'  : subprocess.Popen with its defaults
+    'posix_spawn' : the executable is resolved to an absolute path and close_fds is disabled, so subprocess starts the child
+                    with os.posix_spawn instead of fork - for big parent processes that is much faster, because the memory
+                    of the parent does not need to be mapped into the child. The file descriptors of python are not inheritable
+                    by default, so they are not passed to the child anyway.
+                    if options are requested which need fork (like cwd), or the executable is not found, or on windows,
+                    we fall back to the subprocess backend.
+
+    >>> save_spawn_backend = conf_lib_shell.spawn_backend
+    >>> for conf_lib_shell.spawn_backend in spawn_backends:
+    ...     process = popen([sys.executable, '-c', 'print("test")'], stdout=subprocess.PIPE)
+    ...     stdout, stderr = process.communicate()
+    ...     assert stdout.strip() == b'test'
+    >>> conf_lib_shell.spawn_backend = save_spawn_backend
+
+    """
+    popen_kwargs = get_popen_kwargs(ls_command=ls_command, shell=shell, popen_kwargs=kwargs)
+    process = subprocess.Popen(ls_command, shell=shell, **popen_kwargs)
+    return process
+
+
+def get_is_rusage_collected() -> bool:
+    """
+    returns True if the resource usage of the processes is collected - see wait_process
+
+    >>> assert not get_is_rusage_collected() or hasattr(os, 'wait4')
+
+    """
+    return conf_lib_shell.collect_rusage and hasattr(os, 'wait4')
+
+
+def wait_process(process: subprocess.Popen, timeout: Optional[float] = None) -> int:     # type: ignore
+    """
+    waits for the process like process.wait(timeout) and returns the returncode.
+    with conf_lib_shell.collect_rusage (posix only), the process is reaped here with os.wait4, and the resource usage
+    of the process is kept as process.rusage (a resource.struct_rusage) - otherwise process.rusage is not set.
+    the private reaping methods of subprocess.Popen are not touched, they change between python versions.
+
+    >>> save_collect_rusage = conf_lib_shell.collect_rusage
+    >>> conf_lib_shell.collect_rusage = True
+    >>> process = popen([sys.executable, '-c', 'print("test")'], stdout=subprocess.PIPE)
+    >>> _ = process.stdout.read()
+    >>> process.stdout.close()
+    >>> wait_process(process), process.poll()
+    (0, 0)
+    >>> if hasattr(os, 'wait4'):
+    ...     assert process.rusage.ru_maxrss > 0
+
+    >>> # test timeout
+    >>> import unittest
+    >>> process = popen([sys.executable, '-c', 'import time; time.sleep(10)'])
+    >>> unittest.TestCase().assertRaises(subprocess.TimeoutExpired, wait_process, process, 0.1)
+    >>> process.kill()
+    >>> assert wait_process(process) != 0
+    >>> conf_lib_shell.collect_rusage = save_collect_rusage
+
+    """
+    if process.returncode is None and get_is_rusage_collected():
+        if timeout is None:
+            _reap_with_wait4(process, blocking=True)
+        else:
+            deadline = time.monotonic() + timeout
+            while not _reap_with_wait4(process, blocking=False):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(cmd=process.args, timeout=timeout)
+                time.sleep(min(_wait4_poll_interval, remaining))
+    return process.wait(timeout=timeout)
+
+
+def poll_process(process: subprocess.Popen) -> Optional[int]:     # type: ignore
+    """
+    like process.poll(), but with conf_lib_shell.collect_rusage the process is reaped with os.wait4 - see wait_process
+
+    >>> process = popen([sys.executable, '-c', 'pass'])
+    >>> while poll_process(process) is None:
+    ...     time.sleep(0.01)
+    >>> process.returncode
+    0
+
+    """
+    if process.returncode is None and get_is_rusage_collected():
+        _reap_with_wait4(process, blocking=False)
+    return process.poll()
+
+
+def _reap_with_wait4(process: subprocess.Popen, blocking: bool) -> bool:     # type: ignore
+    """ reaps the process with os.wait4 and sets process.returncode and process.rusage - returns False if it is still running """
+    try:
+        pid, wait_status, rusage = os.wait4(process.pid, 0 if blocking else os.WNOHANG)     # type: ignore
+    except ChildProcessError:
+        # reaped already, by subprocess - then process.wait and process.poll know the returncode
+        return True
+    if pid == 0:
+        return False
+    process.rusage = rusage     # type: ignore
+    if os.WIFSIGNALED(wait_status):     # type: ignore
+        process.returncode = -os.WTERMSIG(wait_status)      # type: ignore
+    else:
+        process.returncode = os.WEXITSTATUS(wait_status)    # type: ignore
+    return True
+
+
+def get_popen_kwargs(ls_command: List[str], shell: bool, popen_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    returns the keyword arguments for subprocess.Popen for the spawn backend set in conf_lib_shell.spawn_backend
+
+    >>> import unittest
+    >>> save_spawn_backend = conf_lib_shell.spawn_backend
+    >>> conf_lib_shell.spawn_backend = 'posix_spawn'
+    >>> if get_is_posix_spawn_available():
+    ...     popen_kwargs = get_popen_kwargs([sys.executable, '-c', 'pass'], shell=False, popen_kwargs={})
+    ...     assert popen_kwargs['close_fds'] is False
+    ...     assert os.path.isabs(popen_kwargs['executable'])
+    ...     # fall back if an incompatible option is requested
+    ...     assert get_popen_kwargs([sys.executable, '-c', 'pass'], shell=False, popen_kwargs={'cwd': '/'}) == {'cwd': '/'}
+    ...     # fall back if the executable is not found
+    ...     assert get_popen_kwargs(['not_existing_executable'], shell=False, popen_kwargs={}) == {}
+    ...     # the executable is searched in the PATH of the child
+    ...     assert get_popen_kwargs(['sh'], shell=False, popen_kwargs={'env': {'PATH': ''}}) == {'env': {'PATH': ''}}
+
+    >>> conf_lib_shell.spawn_backend = 'unknown'
+    >>> unittest.TestCase().assertRaises(ValueError, get_popen_kwargs, ['echo'], False, {})
+    >>> conf_lib_shell.spawn_backend = save_spawn_backend
+
+    """
+    spawn_backend = conf_lib_shell.spawn_backend
+    if spawn_backend not in spawn_backends:
+        raise ValueError(f'unknown spawn backend "{spawn_backend}", valid backends are {spawn_backends}')
+
+    if spawn_backend == 'subprocess' or not get_is_posix_spawn_available():
+        return popen_kwargs
+    if any(popen_kwargs.get(option) for option in posix_spawn_incompatible_options):
+        return popen_kwargs
+    if popen_kwargs.get('close_fds') or popen_kwargs.get('executable'):
+        return popen_kwargs
+
+    # subprocess uses posix_spawn only if the executable has a directory - with shell=True it is /bin/sh
+    if shell:
+        return dict(popen_kwargs, close_fds=False)
+    # the executable is searched in the PATH of the child, like subprocess does
+    exec_path = os.pathsep.join(os.get_exec_path(popen_kwargs.get('env')))
+    executable = shutil.which(ls_command[0], path=exec_path) if ls_command else None
+    if not executable:
+        return popen_kwargs
+    return dict(popen_kwargs, close_fds=False, executable=os.path.abspath(executable))
+
+
+def get_is_posix_spawn_available() -> bool:
+    """
+    >>> assert get_is_posix_spawn_available() == hasattr(os, 'posix_spawn')
+
+    """
+    # os.posix_spawn, and its use in subprocess, is available since python 3.8
+    return not lib_platform.get_is_platform_windows() and hasattr(os, 'posix_spawn') and sys.version_info >= (3, 8)
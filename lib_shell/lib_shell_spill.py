@@ -0,0 +1,146 @@
+# STDLIB
+import mmap
+import os
+import pathlib
+import weakref
+from typing import Any, BinaryIO, Iterator, Optional, Tuple
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+    from . import lib_shell_encoding            # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+    import lib_shell_encoding                   # type: ignore # pragma: no cover
+
+
+class ShellCommandOutputFile(object):
+    """
+    the output of a command which was spilled to disk, because it was larger than the spill threshold.
+    the file is deleted when close() is called, or when the object is garbage collected.
+
+    >>> spill_file = create_spill_file()
+    >>> _ = spill_file.write('mäßig\\n'.encode('utf-8') * 3)
+    >>> stdout_bytes, output_file = get_spilled_output(spill_file, spill_threshold=4)
+    >>> assert stdout_bytes == b''
+    >>> assert output_file.size == 24
+    >>> assert output_file.read_bytes() == 'mäßig\\n'.encode('utf-8') * 3
+    >>> with output_file.mmap() as output_mmap:
+    ...     assert output_mmap[:8] == 'mäßig\\n'.encode('utf-8')
+    >>> assert ''.join(output_file.iter_text(chunk_size=3)) == 'mäßig\\n' * 3
+    >>> assert output_file.read_tail_bytes(8) == 'mäßig\\n'.encode('utf-8')
+    >>> path = output_file.path
+    >>> assert path.exists()
+    >>> output_file.close()
+    >>> assert not path.exists()
+
+    """
+    def __init__(self, path: pathlib.Path, size: int) -> None:
+        self.path = path        # type: pathlib.Path
+        self.size = size        # type: int
+        self._finalizer = weakref.finalize(self, _delete_file, path)
+
+    def open(self) -> BinaryIO:
+        """ opens the file for reading """
+        return open(str(self.path), mode='rb')
+
+    def mmap(self) -> mmap.mmap:
+        """ returns a read only memory map of the file """
+        with self.open() as output_file:
+            return mmap.mmap(output_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_bytes(self) -> bytes:
+        """ reads the whole file into memory """
+        return self.path.read_bytes()
+
+    def read_tail_bytes(self, n_bytes: int) -> bytes:
+        """ reads the last n_bytes of the file """
+        with self.open() as output_file:
+            output_file.seek(max(0, self.size - n_bytes))
+            return output_file.read()
+
+    def iter_text(self, chunk_size: int = 65536) -> Iterator[str]:
+        """ yields the decoded text in chunks, the encoding is detected from the first chunk """
+        with self.open() as output_file:
+            decoder = None      # type: Any
+            while True:
+                chunk = output_file.read(chunk_size)
+                if not chunk:
+                    break
+                if decoder is None:
+                    decoder, encoding = lib_shell_encoding.get_incremental_decoder(first_chunk=chunk)
+                text = decoder.decode(chunk)
+                if text:
+                    yield text
+            if decoder is not None:
+                text = decoder.decode(b'', final=True)
+                if text:
+                    yield text
+
+    def close(self) -> None:
+        """ deletes the file """
+        self._finalizer()
+
+
+def _delete_file(path: pathlib.Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:   # pragma: no cover
+        pass
+
+
+def create_spill_file() -> BinaryIO:
+    """ creates a temporary file to spill the output of a command to, in conf_lib_shell.spill_directory """
+    # imported here, to keep the import of lib_shell cheap
+    import tempfile
+
+    spill_directory = conf_lib_shell.spill_directory or None
+    spill_file = tempfile.NamedTemporaryFile(mode='w+b', prefix='lib_shell_', suffix='.out', dir=spill_directory, delete=False)
+    return spill_file    # type: ignore
+
+
+def discard_spill_file(spill_file: Optional[BinaryIO]) -> None:
+    """
+    closes and deletes a spill file, if the command failed before its output was collected
+
+    >>> spill_file = create_spill_file()
+    >>> path = pathlib.Path(spill_file.name)
+    >>> discard_spill_file(spill_file)
+    >>> assert not path.exists()
+    >>> discard_spill_file(None)
+
+    """
+    if spill_file is None:
+        return
+    spill_file.close()
+    _delete_file(pathlib.Path(spill_file.name))
+
+
+def get_spilled_output(spill_file: BinaryIO, spill_threshold: int) -> Tuple[bytes, Optional[ShellCommandOutputFile]]:
+    """
+    returns the output as bytes if the output is not larger than spill_threshold, otherwise a ShellCommandOutputFile
+    the spill file is closed - and deleted if the output is returned as bytes
+
+    >>> spill_file = create_spill_file()
+    >>> _ = spill_file.write(b'test')
+    >>> path = pathlib.Path(spill_file.name)
+    >>> get_spilled_output(spill_file, spill_threshold=4)
+    (b'test', None)
+    >>> assert not path.exists()
+
+    """
+    # the child writes via its own file descriptor, so we ask for the size of the file, and not for our position
+    spill_file.flush()
+    size = os.fstat(spill_file.fileno()).st_size
+    path = pathlib.Path(spill_file.name)
+    if size <= spill_threshold:
+        spill_file.seek(0)
+        output = spill_file.read()
+        spill_file.close()
+        _delete_file(path)
+        return output, None
+    spill_file.close()
+    return b'', ShellCommandOutputFile(path=path, size=size)
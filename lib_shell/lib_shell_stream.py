@@ -0,0 +1,252 @@
+# STDLIB
+import collections
+import subprocess
+import sys
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+# OWN
+import lib_platform
+
+# PROJ
+try:                                            # type: ignore # pragma: no cover
+    # imports for local pytest
+    from .conf_lib_shell import conf_lib_shell  # type: ignore # pragma: no cover
+    from . import lib_shell                     # type: ignore # pragma: no cover
+    from . import lib_shell_encoding            # type: ignore # pragma: no cover
+    from . import lib_shell_env                 # type: ignore # pragma: no cover
+    from . import lib_shell_log                 # type: ignore # pragma: no cover
+    from . import lib_shell_pass_output         # type: ignore # pragma: no cover
+    from . import lib_shell_shlex               # type: ignore # pragma: no cover
+    from . import lib_shell_spawn               # type: ignore # pragma: no cover
+
+except (ImportError, ModuleNotFoundError):      # type: ignore # pragma: no cover
+    # imports for doctest local
+    from conf_lib_shell import conf_lib_shell   # type: ignore # pragma: no cover
+    import lib_shell                            # type: ignore # pragma: no cover
+    import lib_shell_encoding                   # type: ignore # pragma: no cover
+    import lib_shell_env                        # type: ignore # pragma: no cover
+    import lib_shell_log                        # type: ignore # pragma: no cover
+    import lib_shell_pass_output                # type: ignore # pragma: no cover
+    import lib_shell_shlex                      # type: ignore # pragma: no cover
+    import lib_shell_spawn                      # type: ignore # pragma: no cover
+
+
+# lines longer than that are yielded in pieces, so the memory stays bounded even if the command never writes a newline
+max_line_length = 1048576       # type: int
+
+
+class ShellCommandStream(object):
+    """
+    iterates over the output of a running command, yielding tuples of (pipe_name, text) as the output arrives,
+    pipe_name is 'stdout' or 'stderr'. The returncode is available after the iteration finished.
+    Only the last lines (conf_lib_shell.stream_log_tail_lines) of each pipe are kept for logging and for the CalledProcessError.
+
+    """
+    def __init__(self,
+                 ls_command: List[str],
+                 process: subprocess.Popen,     # type: ignore
+                 lines: bool,
+                 raise_on_returncode_not_zero: bool,
+                 log_settings: lib_shell_log.RunShellCommandLogSettings,
+                 executable: str = '') -> None:
+        self.ls_command = ls_command                    # type: List[str]
+        self.executable = executable                    # type: str
+        # the encoding used to decode stdout, or stderr if there was no output on stdout
+        self.encoding = ''                              # type: str
+        self.process = process                          # type: subprocess.Popen    # type: ignore
+        self.returncode = None                          # type: Optional[int]
+        self.lines = lines                              # type: bool
+        self.raise_on_returncode_not_zero = raise_on_returncode_not_zero    # type: bool
+        self.log_settings = log_settings                # type: lib_shell_log.RunShellCommandLogSettings
+        self.stdout_tail = collections.deque(maxlen=conf_lib_shell.stream_log_tail_lines)   # type: Deque[str]
+        self.stderr_tail = collections.deque(maxlen=conf_lib_shell.stream_log_tail_lines)   # type: Deque[str]
+        self._iterated = False                          # type: bool
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        if self._iterated:
+            raise RuntimeError('the output of the command can be iterated only once')
+        self._iterated = True
+
+        # the decoder of each pipe is created on the first chunk, the encoding is detected from that chunk
+        decoders = dict()                               # type: Dict[str, Any]
+        partial_lines = {'stdout': '', 'stderr': ''}    # type: Dict[str, str]
+        tails = {'stdout': self.stdout_tail, 'stderr': self.stderr_tail}
+
+        for pipe_name, chunk in lib_shell_pass_output.iter_process_output(self.process):
+            if pipe_name not in decoders:
+                decoders[pipe_name], encoding = lib_shell_encoding.get_incremental_decoder(first_chunk=chunk, executable=self.executable)
+                if pipe_name == 'stdout' or not self.encoding:
+                    self.encoding = encoding
+            text = decoders[pipe_name].decode(chunk)
+            for output in self._get_l_output(pipe_name, text, partial_lines, final=False):
+                tails[pipe_name].append(output)
+                yield pipe_name, output
+
+        for pipe_name, decoder in decoders.items():
+            for output in self._get_l_output(pipe_name, decoder.decode(b'', final=True), partial_lines, final=True):
+                tails[pipe_name].append(output)
+                yield pipe_name, output
+
+        self.returncode = self.process.wait()
+        self._log_and_raise()
+
+    def _get_l_output(self, pipe_name: str, text: str, partial_lines: Dict[str, str], final: bool) -> List[str]:
+        if not self.lines:
+            return [text] if text else []
+
+        l_lines = (partial_lines[pipe_name] + text).split('\n')
+        partial_line = l_lines.pop()
+        if final and partial_line:
+            l_lines.append(partial_line)
+            partial_line = ''
+        while len(partial_line) > max_line_length:
+            l_lines.append(partial_line[:max_line_length])
+            partial_line = partial_line[max_line_length:]
+        partial_lines[pipe_name] = partial_line
+        return [line.rstrip('\r') for line in l_lines]
+
+    def _log_and_raise(self) -> None:
+        separator = '\n' if self.lines else ''
+        stdout_tail = separator.join(self.stdout_tail)
+        stderr_tail = separator.join(self.stderr_tail)
+        lib_shell_log.log_results(self.ls_command, stdout_tail, stderr_tail, self.returncode, True, self.log_settings)     # type: ignore
+        if self.raise_on_returncode_not_zero and self.returncode:
+            str_command = ' '.join(self.ls_command)
+            raise subprocess.CalledProcessError(returncode=self.returncode, cmd=str_command, output=stdout_tail, stderr=stderr_tail)  # type: ignore
+
+    def close(self) -> None:
+        """ kills the command if it is still running, and closes the pipes """
+        if self.process.poll() is None:
+            self.process.kill()
+        self.returncode = self.process.wait()
+        for pipe in (self.process.stdout, self.process.stderr):
+            if pipe is not None:
+                pipe.close()
+
+    def __enter__(self) -> 'ShellCommandStream':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        self.close()
+
+
+def stream_shell_command(command: str,
+                         shell: bool = False,
+                         lines: bool = True,
+                         raise_on_returncode_not_zero: bool = True,
+                         log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                         use_sudo: bool = False,
+                         run_as_user: str = '',
+                         quiet: bool = False,
+                         env: Optional[Dict[str, str]] = None,
+                         env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                         cwd: Optional[str] = None) -> ShellCommandStream:
+    """
+    starts the command and returns a ShellCommandStream, which yields tuples of (pipe_name, text) as the output arrives.
+    lines=True  : yields each line without the line ending
+    lines=False : yields the decoded chunks as they are read from the pipes
+
+    >>> with stream_shell_command('echo test') as stream:
+    ...     l_output = list(stream)
+    >>> assert l_output == [('stdout', 'test')]
+    >>> assert stream.returncode == 0
+    >>> assert stream.encoding == 'utf-8'
+
+    """
+    command = command.strip()
+
+    if shell and lib_platform.get_is_platform_posix():
+        # when shell = True we need to pass the command in one string
+        ls_command = [command]
+    else:
+        ls_command = lib_shell_shlex.shlex_split_multi_platform(command)
+
+    stream = stream_shell_ls_command(ls_command=ls_command,
+                                     shell=shell,
+                                     lines=lines,
+                                     raise_on_returncode_not_zero=raise_on_returncode_not_zero,
+                                     log_settings=log_settings,
+                                     use_sudo=use_sudo,
+                                     run_as_user=run_as_user,
+                                     quiet=quiet,
+                                     env=env,
+                                     env_overrides=env_overrides,
+                                     cwd=cwd)
+    return stream
+
+
+def stream_shell_ls_command(ls_command: List[str],
+                            shell: bool = False,
+                            lines: bool = True,
+                            raise_on_returncode_not_zero: bool = True,
+                            log_settings: lib_shell_log.RunShellCommandLogSettings = conf_lib_shell.log_settings_default,
+                            use_sudo: bool = False,
+                            run_as_user: str = '',
+                            quiet: bool = False,
+                            env: Optional[Dict[str, str]] = None,
+                            env_overrides: Optional[Dict[str, Optional[str]]] = None,
+                            cwd: Optional[str] = None) -> ShellCommandStream:
+    """
+    like stream_shell_command, but the command is passed as list - see lib_shell.run_shell_ls_command
+
+    >>> import unittest
+    >>> program = 'import sys; [print(n) for n in range(100000)]; print("error", file=sys.stderr)'
+    >>> stream = stream_shell_ls_command([sys.executable, '-c', program])
+    >>> n_lines = 0
+    >>> for pipe_name, line in stream:
+    ...     if pipe_name == 'stdout':
+    ...         assert line == str(n_lines)
+    ...         n_lines = n_lines + 1
+    ...     else:
+    ...         assert line == 'error'
+    >>> assert n_lines == 100000
+    >>> assert stream.returncode == 0
+    >>> # only the last lines are kept
+    >>> assert len(stream.stdout_tail) == conf_lib_shell.stream_log_tail_lines
+
+    >>> # test chunks
+    >>> stream = stream_shell_ls_command([sys.executable, '-c', 'print("test")'], lines=False)
+    >>> assert ''.join(text for pipe_name, text in stream).strip() == 'test'
+
+    >>> # test returncode not zero, raising Exception
+    >>> stream = stream_shell_ls_command([sys.executable, '-c', 'import sys; sys.exit(2)'], quiet=True)
+    >>> unittest.TestCase().assertRaises(subprocess.CalledProcessError, list, stream)
+    >>> assert stream.returncode == 2
+
+    >>> # test returncode not zero, without raising Exception
+    >>> stream = stream_shell_ls_command([sys.executable, '-c', 'import sys; sys.exit(2)'], raise_on_returncode_not_zero=False, quiet=True)
+    >>> assert list(stream) == []
+    >>> assert stream.returncode == 2
+
+    >>> # test close a running command
+    >>> stream = stream_shell_ls_command([sys.executable, '-c', 'import time; print("test", flush=True); time.sleep(10)'])
+    >>> for pipe_name, line in stream:
+    ...     break
+    >>> stream.close()
+    >>> assert stream.returncode != 0
+
+    """
+    if quiet:
+        actual_log_settings = conf_lib_shell.log_settings_quiet
+    else:
+        actual_log_settings = log_settings
+
+    executable = lib_shell_encoding.get_executable_key(ls_command, use_sudo=use_sudo, run_as_user=run_as_user)
+    ls_command = lib_shell.prepend_sudo_and_run_as_user(ls_command=ls_command, shell=shell, run_as_user=run_as_user, use_sudo=use_sudo)
+
+    process = lib_shell_spawn.popen(ls_command,
+                                    startupinfo=lib_shell.get_startup_info(start_new_session=False),
+                                    stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    shell=shell,
+                                    env=lib_shell_env.get_env_with_overrides(env=env, env_overrides=env_overrides),
+                                    cwd=cwd)
+
+    stream = ShellCommandStream(ls_command=ls_command,
+                                process=process,
+                                lines=lines,
+                                raise_on_returncode_not_zero=raise_on_returncode_not_zero,
+                                log_settings=actual_log_settings,
+                                executable=executable)
+    return stream
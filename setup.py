@@ -14,7 +14,6 @@ required = ['psutil',
             'lib_detect_encoding @ git+https://github.com/bitranox/lib_detect_encoding.git',
             'btx_lib_list',
             'lib_log_utils @ git+https://github.com/bitranox/lib_log_utils.git',
-            'lib_parameter @ git+https://github.com/bitranox/lib_parameter.git',
             'lib_path @ git+https://github.com/bitranox/lib_path.git',
             'lib_platform @ git+https://github.com/bitranox/lib_platform.git']      # type: List
 